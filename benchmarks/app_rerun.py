@@ -0,0 +1,101 @@
+"""Time the Streamlit reruns caused by one edit in the app.
+
+    python benchmarks/app_rerun.py [--rows 16] [--repeat 10]
+
+All three forms are selected, the cover sheet and the non-travel report get
+``--rows`` line items and the travel report has every row used. Each form and
+the upload tab run as fragments, so an edit reruns only its own section,
+while a change to the sidebar (or a build) still reruns the whole script.
+
+Both costs are measured in this process with Streamlit's AppTest: a full
+rerun, which is what every keystroke cost before the forms were fragments,
+and the body of each fragment, which is what a keystroke in that section
+costs now. Browser and websocket time are not included; the median of
+``--repeat`` edits is shown.
+"""
+import argparse
+import functools
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "form_filler_app.py")
+
+_timings = defaultdict(list)
+_fragment = st.fragment
+_rerun = st.rerun
+
+
+def _timed_fragment(func=None, **kwargs):
+    """``st.fragment`` that records how long each call of the body takes."""
+    def decorate(body):
+        name = kwargs.get("key") or body.__name__
+
+        @functools.wraps(body)
+        def timed(*args, **kw):
+            started = time.perf_counter()
+            try:
+                return body(*args, **kw)
+            finally:
+                _timings[name].append(time.perf_counter() - started)
+
+        return _fragment(timed, **kwargs)
+
+    return decorate(func) if func is not None else decorate
+
+
+def _full_rerun(scope="app"):
+    # AppTest keeps only the fragment's elements after a rerun scoped to
+    # fragment keys, which would drop the sidebar selection on the next run
+    return _rerun("app" if isinstance(scope, (list, tuple)) else scope)
+
+
+def _fill(at, rows):
+    for checkbox in at.sidebar.checkbox[:3]:
+        checkbox.check()
+    at.run()
+    at.number_input(key="f1_num_items").set_value(rows)
+    at.number_input(key="f2_num_items").set_value(rows)
+    for key, count in (("f3_num_incidentals", 4), ("f3_num_transportation", 3),
+                       ("f3_num_lodging", 3), ("f3_num_meals", 4)):
+        at.number_input(key=key).set_value(count)
+    at.run()
+    at.text_input(key="f1_club_name").input("Tennis Club")
+    at.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=16, help="line items in the cover sheet and non-travel tables")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    st.fragment = _timed_fragment
+    st.rerun = _full_rerun
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.run()
+    _fill(at, args.rows)
+    if at.exception:
+        sys.exit(f"App raised: {at.exception[0].message}")
+
+    full = []
+    _timings.clear()
+    for i in range(args.repeat):
+        at.text_input(key="f2_desc_0").input(f"Expense {i}")
+        started = time.perf_counter()
+        at.run()
+        full.append(time.perf_counter() - started)
+
+    print(f"{'Rerun':<28}{'median ms':>10}")
+    print(f"{'full app (every edit before)':<28}{statistics.median(full) * 1000:>10.1f}")
+    for name, seconds in _timings.items():
+        print(f"{'fragment ' + name:<28}{statistics.median(seconds) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
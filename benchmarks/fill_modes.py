@@ -0,0 +1,76 @@
+"""Compare field appearance modes on all three templates.
+
+    python benchmarks/fill_modes.py [--repeat 20]
+
+Each template is filled with every line-item row used, so the numbers are
+the worst case per form. Times include opening the cached template and
+serializing the filled document; the best of ``--repeat`` runs is shown.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from form_filler import (  # noqa: E402
+    APPEARANCE_MODES, CoverSheet, ExpenseItem, IncidentalItem, LodgingItem, MealItem,
+    NonTravelReport, ReimbursementItem, TransportationItem, TravelReport,
+    fill_cover_sheet, fill_non_travel, fill_travel,
+)
+from form_filler.fields import (  # noqa: E402
+    COVER_SHEET_MAX_ITEMS, NON_TRAVEL_MAX_ITEMS, TRAVEL_MAX_INCIDENTALS,
+    TRAVEL_MAX_LODGING, TRAVEL_MAX_MEALS, TRAVEL_MAX_TRANSPORTATION,
+)
+
+
+def full_forms():
+    cover = CoverSheet(
+        club_name="Tennis Club", submitter_name="Alex", short_title="Spring Tournament",
+        account_type="RCC", pickup_check="Yes", payable_to="Alex", student_id="1234567890",
+        items=[ReimbursementItem(f"Item {i}", "2", f"{i * 1.25:.2f}") for i in range(1, COVER_SHEET_MAX_ITEMS + 1)],
+    )
+    non_travel = NonTravelReport(
+        department="Recreational Club Council Tennis Club", account="1222", business_purpose="Spring Tournament",
+        items=[ExpenseItem("2025-03-01", f"Expense {i}", "1", f"{i * 3.5:.2f}", "0.00")
+               for i in range(1, NON_TRAVEL_MAX_ITEMS + 1)],
+    )
+    travel = TravelReport(
+        reimbursee_name="Alex", department="Recreational Club Council Tennis Club", account="1222",
+        destination="Austin, TX", period_covered="03/01/2025 - 03/04/2025", business_purpose="Spring Tournament",
+        incidentals=[IncidentalItem("2025-03-01", "Parking", "12.00", "0.00")] * TRAVEL_MAX_INCIDENTALS,
+        transportation=[TransportationItem("Air", "Delta", "2025-03-01", "350.00", "0.00")] * TRAVEL_MAX_TRANSPORTATION,
+        lodging=[LodgingItem("Hilton", "2025-03-01", "2025-03-04", "3", "120.00", "360.00")] * TRAVEL_MAX_LODGING,
+        meals=[MealItem("2025-03-01", "8.00", "12.00", "20.00", "0.00")] * TRAVEL_MAX_MEALS,
+    )
+    return [
+        ("Expense Cover Sheet", fill_cover_sheet, cover),
+        ("Non-Travel Report", fill_non_travel, non_travel),
+        ("Travel Report", fill_travel, travel),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    forms = full_forms()
+    # Warm the template cache so it is not counted
+    for _, fill, data in forms:
+        fill(data)
+
+    print(f"{'template':<22}" + "".join(f"{mode:>20}" for mode in APPEARANCE_MODES) + "   (best of N, ms)")
+    for name, fill, data in forms:
+        samples = {mode: [] for mode in APPEARANCE_MODES}
+        # Interleave the modes so background noise hits them evenly
+        for _ in range(args.repeat):
+            for mode in APPEARANCE_MODES:
+                started = time.perf_counter()
+                fill(data, appearance=mode)
+                samples[mode].append((time.perf_counter() - started) * 1000)
+        print(f"{name:<22}" + "".join(f"{min(samples[mode]):>20.1f}" for mode in APPEARANCE_MODES))
+
+
+if __name__ == "__main__":
+    main()
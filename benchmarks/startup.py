@@ -0,0 +1,93 @@
+"""Time the app's cold start, first interaction and first package build.
+
+    python benchmarks/startup.py [--repeat 5] [--idle 0,2] [--warmup on,off]
+
+Every run starts a fresh Python process, as a new server container would,
+and drives ``form_filler_app.py`` with Streamlit's AppTest:
+
+``first paint``        the first script run, up to the "select a form" page.
+``first interaction``  ticking the Expense Cover Sheet, which renders the form.
+``first build``        clicking Generate until the queued build has finished.
+
+Between the first paint and the first interaction the run waits ``--idle``
+seconds, standing in for the time a user spends reading the page; the app
+warms PyMuPDF, Pillow and the templates up in the background meanwhile.
+``--warmup off`` runs the app with ``FORM_FILLER_WARMUP=0``, so they load
+at the first build instead. Streamlit itself is imported before the clock
+starts, since a server has it loaded before any session connects. The
+median of ``--repeat`` runs is shown, along with what the app had imported
+at its first paint (only meaningful with the warm-up off).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "form_filler_app.py")
+PHASES = ("first paint", "first interaction", "first build")
+
+
+def _child(idle):
+    """One cold session in this (fresh) process; prints its timings as JSON."""
+    sys.path.insert(0, ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+    at = AppTest.from_file(APP, default_timeout=120)
+    started = time.perf_counter()
+    at.run()
+    timings["first paint"] = time.perf_counter() - started
+    loaded = {"PyMuPDF": "fitz" in sys.modules, "Pillow": "PIL.Image" in sys.modules}
+
+    time.sleep(idle)
+    started = time.perf_counter()
+    at.sidebar.checkbox[0].check()
+    at.run()
+    timings["first interaction"] = time.perf_counter() - started
+
+    from form_filler.jobs import get_job_queue
+
+    started = time.perf_counter()
+    next(button for button in at.button if "Generate" in button.label).click()
+    at.run()
+    queue = get_job_queue()
+    job = queue.get(at.session_state.package_job)
+    while job.active:
+        time.sleep(0.005)
+    timings["first build"] = time.perf_counter() - started
+    if at.exception or job.status != "done":
+        sys.exit(f"Build did not finish: {at.exception or job.error}")
+    print(json.dumps({"timings": timings, "loaded": loaded}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--idle", default="0,2", help="comma-separated seconds between first paint and first interaction")
+    parser.add_argument("--warmup", default="on,off", help="comma-separated: run with the background warm-up on, off")
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        _child(args.child)
+        return
+
+    print(f"{'warm-up':<8}{'idle s':>6}  " + "".join(f"{phase:>19}" for phase in PHASES) + "   loaded at first paint")
+    for warmup in args.warmup.split(","):
+        env = dict(os.environ, FORM_FILLER_WARMUP="1" if warmup == "on" else "0")
+        for idle in (float(value) for value in args.idle.split(",")):
+            runs = []
+            for _ in range(args.repeat):
+                out = subprocess.run([sys.executable, __file__, "--child", str(idle)], capture_output=True,
+                                     text=True, check=True, cwd=ROOT, env=env)
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            medians = [statistics.median(run["timings"][phase] for run in runs) * 1000 for phase in PHASES]
+            loaded = ", ".join(name for name, was in runs[0]["loaded"].items() if was) or "neither"
+            print(f"{warmup:<8}{idle:>6.1f}  " + "".join(f"{ms:>16.1f} ms" for ms in medians) + f"   {loaded}")
+
+
+if __name__ == "__main__":
+    main()
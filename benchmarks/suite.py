@@ -0,0 +1,350 @@
+"""Benchmark form filling, package merging and attachment ingestion.
+
+    python benchmarks/suite.py [--attachments 1,10,50,200] [--line-items 100,1000] [--receipts 200]
+                               [--statement-pages 40] [--repeat 3]
+    python benchmarks/suite.py --compare benchmarks/results/<earlier>.json
+
+Inputs are synthetic: every form is filled with its maximum number of rows
+and attachments alternate between multi-page PDFs and 12-megapixel JPEGs.
+The line-items scenario fills every table with hundreds or thousands of items,
+most of them on continuation sheets. The receipts scenario attaches small
+scanned receipts of mixed shapes, one per page and packed N-up. The
+statement scenario attaches a long scanned bank statement in full and with
+only two of its pages selected.
+They are generated once into ``--data-dir`` (under the system temp directory
+by default) and reused by later runs.
+
+Each scenario runs in a fresh process so its peak memory is its own. For
+every scenario the suite records wall time (all runs, best and median), the
+peak resident memory and its growth over the starting point, and the output
+size. The results are written as JSON to ``benchmarks/results/`` together
+with the commit, library versions and machine, so runs can be compared with
+``--compare``.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fitz  # noqa: E402  PyMuPDF
+from PIL import Image, ImageDraw  # noqa: E402
+
+from fill_modes import full_forms  # noqa: E402
+from form_filler import (  # noqa: E402
+    Attachment, ExpenseItem, ImageOptions, IncidentalItem, LodgingItem, MealItem, PackageForms,
+    ReimbursementItem, TransportationItem, build_package, normalize_attachments,
+)
+from form_filler.options import NupOptions  # noqa: E402
+from form_filler.spool import PeakRSS  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+JPEG_SIZE = (3000, 4000)
+PDF_PAGES = 3
+
+
+def _synthetic_jpeg(index):
+    """A noisy 12 MP photo-like JPEG; noise keeps it from compressing away."""
+    width, height = JPEG_SIZE
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + index % 20)
+    image = Image.merge("RGB", (noise, gradient, noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _synthetic_pdf(index):
+    """A short text-and-image PDF like a scanned invoice."""
+    stamp = io.BytesIO()
+    Image.effect_noise((600, 400), 60).convert("RGB").save(stamp, format="JPEG", quality=80)
+    with fitz.open() as doc:
+        for number in range(PDF_PAGES):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Invoice {index}-{number}", fontsize=18)
+            for line in range(30):
+                page.insert_text((72, 110 + line * 14), f"Line {line}: item description and amount {line * 3.5:.2f}")
+            page.insert_image(fitz.Rect(72, 560, 372, 760), stream=stamp.getvalue())
+        return doc.tobytes(deflate=True)
+
+
+def _synthetic_statement(pages):
+    """A bank statement of ``pages`` pages, each with its own scanned letterhead image."""
+    with fitz.open() as doc:
+        for number in range(pages):
+            stamp = io.BytesIO()
+            Image.effect_noise((600, 200), 40 + number % 30).convert("RGB").save(stamp, format="JPEG", quality=80)
+            page = doc.new_page()
+            page.insert_image(fitz.Rect(72, 40, 540, 196), stream=stamp.getvalue())
+            page.insert_text((72, 220), f"Statement page {number + 1} of {pages}", fontsize=14)
+            for line in range(36):
+                page.insert_text((72, 250 + line * 14), f"2025-03-{line % 28 + 1:02d}  Card purchase {number}-{line}"
+                                                         f"  {line * 7.25:10.2f}")
+        return doc.tobytes(deflate=True)
+
+
+def _synthetic_receipt(index):
+    """A small receipt scan at 200 dpi: a stub, a till roll or a half-page invoice.
+
+    Dark text-like bars on paper with a little sensor noise, so it compresses
+    like a real scan rather than like pure noise.
+    """
+    width, height = ((400, 250), (600, 1800), (1200, 900))[index % 3]
+    paper = Image.new("L", (width, height), 245)
+    draw = ImageDraw.Draw(paper)
+    for top in range(30, height - 30, 28):
+        length = (top * 7 + index * 13) % (width - 80) + 40
+        draw.rectangle((30, top, 30 + length, top + 12), fill=40)
+    noise = Image.effect_noise((width, height), 30 + index % 10)
+    image = Image.blend(paper, noise, 0.1).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85, dpi=(200, 200))
+    return buffer.getvalue()
+
+
+def attachment_name(index):
+    return f"attachment_{index:03d}." + ("pdf" if index % 2 == 0 else "jpg")
+
+
+def generate_data(data_dir, count):
+    """Write the first ``count`` synthetic attachments that are missing."""
+    os.makedirs(data_dir, exist_ok=True)
+    for index in range(count):
+        path = os.path.join(data_dir, attachment_name(index))
+        if os.path.exists(path):
+            continue
+        data = _synthetic_pdf(index) if index % 2 == 0 else _synthetic_jpeg(index)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def load_attachments(data_dir, count):
+    attachments = []
+    for index in range(count):
+        with open(os.path.join(data_dir, attachment_name(index)), "rb") as f:
+            attachments.append(Attachment(attachment_name(index), f.read()))
+    return attachments
+
+
+def _package_forms():
+    (_, _, cover), (_, _, non_travel), (_, _, travel) = full_forms()
+    return PackageForms(cover_sheet=cover, non_travel=non_travel, travel=travel)
+
+
+def _long_forms(count):
+    """The full forms with ``count`` items in every table, mostly on continuation sheets."""
+    forms = _package_forms()
+    forms.cover_sheet.items = [ReimbursementItem(f"Item {i}", "2", f"{i * 1.25:.2f}") for i in range(count)]
+    forms.non_travel.items = [ExpenseItem("2025-03-01", f"Expense {i}", "1", f"{i * 3.5:.2f}", "0.00")
+                              for i in range(count)]
+    travel = forms.travel
+    travel.incidentals = [IncidentalItem("2025-03-01", f"Parking {i}", "12.00", "0.00") for i in range(count)]
+    travel.transportation = [TransportationItem("Air", "Delta", "2025-03-01", "350.00", "0.00")] * count
+    travel.lodging = [LodgingItem("Hilton", "2025-03-01", "2025-03-04", "3", "120.00", "360.00")] * count
+    travel.meals = [MealItem(f"2025-03-{i % 28 + 1:02d}", "8.00", "12.00", "20.00", "0.00") for i in range(count)]
+    return forms
+
+
+def _scenario_call(name, params, data_dir):
+    """Return a zero-argument callable for one run of the scenario.
+
+    It returns the output bytes, or for image normalization the total size.
+    """
+    forms = {label: (fill, data) for label, fill, data in full_forms()}
+    if name.startswith("fill_"):
+        fill, data = {
+            "fill_cover_sheet": forms["Expense Cover Sheet"],
+            "fill_non_travel": forms["Non-Travel Report"],
+            "fill_travel": forms["Travel Report"],
+        }[name]
+        return lambda: fill(data, appearance=params["appearance"])
+    if name == "package":
+        attachments = load_attachments(data_dir, params["attachments"])
+        package = _package_forms()
+        return lambda: build_package(package, attachments, profile=params["profile"],
+                                     appearance=params["appearance"])
+    if name == "line_items":
+        package = _long_forms(params["items"])
+        return lambda: build_package(package, profile=params["profile"], appearance=params["appearance"])
+    if name == "normalize_images":
+        images = [a for a in load_attachments(data_dir, params["images"] * 2) if a.is_image]
+        options = ImageOptions(dpi=params["dpi"])
+        # Report the total normalized size as the output
+        return lambda: sum(a.size for a in normalize_attachments(images, options)[0])
+    if name == "receipts":
+        receipts = [Attachment(f"receipt_{i:03d}.jpg", _synthetic_receipt(i)) for i in range(params["receipts"])]
+        nup = NupOptions() if params["layout"] == "nup" else None
+        return lambda: build_package(PackageForms(), receipts, profile=params["profile"], nup=nup)
+    if name == "statement":
+        pages = None if params["selected"] == "all" else tuple(range(params["selected"]))
+        statement = Attachment("statement.pdf", _synthetic_statement(params["pages"]), pages=pages)
+        return lambda: build_package(PackageForms(), [statement], profile=params["profile"])
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def run_scenario(name, params, data_dir, repeat):
+    """Run one scenario ``repeat`` times; meant to be called in a fresh process."""
+    call = _scenario_call(name, params, data_dir)
+    call()  # warm up: template cache, imports, first-touch allocations
+    seconds = []
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = call()
+            seconds.append(time.perf_counter() - started)
+
+    result = {
+        "scenario": name,
+        "params": params,
+        "seconds": [round(s, 5) for s in seconds],
+        "best": round(min(seconds), 5),
+        "median": round(statistics.median(seconds), 5),
+        "peak_rss": rss.peak,
+        "rss_growth": rss.peak - rss.start if rss.peak is not None and rss.start is not None else None,
+        "output_bytes": output if isinstance(output, int) else len(output),
+    }
+    if isinstance(output, bytes):
+        with fitz.open(stream=output, filetype="pdf") as doc:
+            result["pages"] = doc.page_count
+    return result
+
+
+def scenarios(args):
+    for name in ("fill_cover_sheet", "fill_non_travel", "fill_travel"):
+        yield name, {"appearance": args.appearance}
+    for count in args.attachments:
+        yield "package", {"attachments": count, "profile": args.profile, "appearance": args.appearance}
+    for count in args.line_items:
+        yield "line_items", {"items": count, "profile": args.profile, "appearance": args.appearance}
+    if args.images:
+        yield "normalize_images", {"images": args.images, "dpi": args.image_dpi}
+    if args.receipts:
+        for layout in ("page", "nup"):
+            yield "receipts", {"receipts": args.receipts, "layout": layout, "profile": args.profile}
+    if args.statement_pages:
+        for selected in ("all", 2):
+            yield "statement", {"pages": args.statement_pages, "selected": selected, "profile": args.profile}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _key(result):
+    return result["scenario"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (median time, new / old):")
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        print(f"  {_label(result):<40} {old['median'] * 1000:10.1f} ms -> {result['median'] * 1000:10.1f} ms  x{ratio:.2f}")
+
+
+def _label(result):
+    params = result["params"]
+    if result["scenario"] == "package":
+        return f"package ({params['attachments']} attachments)"
+    if result["scenario"] == "line_items":
+        return f"line_items ({params['items']} per table)"
+    if result["scenario"] == "normalize_images":
+        return f"normalize_images ({params['images']} JPEGs)"
+    if result["scenario"] == "receipts":
+        return f"receipts ({params['receipts']}, {params['layout']})"
+    if result["scenario"] == "statement":
+        return f"statement ({params['selected']} of {params['pages']} pages)"
+    return result["scenario"]
+
+
+def _counts(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--attachments", type=_counts, default=[1, 10, 50, 200],
+                        help="comma-separated attachment counts for the package scenario (default: 1,10,50,200)")
+    parser.add_argument("--line-items", type=_counts, default=[100, 1000],
+                        help="comma-separated item counts per table for the continuation-sheet scenario "
+                             "(default: 100,1000)")
+    parser.add_argument("--images", type=int, default=10, help="JPEGs to normalize (0 skips the scenario)")
+    parser.add_argument("--image-dpi", type=int, default=150)
+    parser.add_argument("--receipts", type=int, default=200,
+                        help="small receipts per package, one per page and N-up (0 skips the scenario)")
+    parser.add_argument("--statement-pages", type=int, default=40,
+                        help="pages in the bank statement, attached whole and as 2 pages (0 skips the scenario)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--profile", default="small", help="output profile for the package scenario")
+    parser.add_argument("--appearance", default="bulk", help="field appearance mode")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "form_filler_benchmark"),
+                        help="where synthetic attachments are generated and reused")
+    parser.add_argument("-o", "--output", default=None, help="results JSON (default: results/<timestamp>.json)")
+    parser.add_argument("--compare", default=None, metavar="RESULTS", help="earlier results JSON to compare with")
+    args = parser.parse_args(argv)
+
+    needed = max(args.attachments + [args.images * 2])
+    print(f"Preparing {needed} synthetic attachments in {args.data_dir}...")
+    generate_data(args.data_dir, needed)
+
+    results = []
+    print(f"{'scenario':<40}{'best ms':>12}{'median ms':>12}{'peak MB':>10}{'output KB':>12}")
+    # A fresh process per scenario keeps peak memory readings independent
+    for name, params in scenarios(args):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_scenario, name, params, args.data_dir, args.repeat).result()
+        results.append(result)
+        peak = f"{result['peak_rss'] / 1024 ** 2:10.0f}" if result["peak_rss"] else f"{'n/a':>10}"
+        print(f"{_label(result):<40}{result['best'] * 1000:12.1f}{result['median'] * 1000:12.1f}"
+              f"{peak}{result['output_bytes'] / 1024:12.0f}")
+
+    started = datetime.datetime.now()
+    output = args.output or os.path.join(RESULTS_DIR, started.strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": started.isoformat(timespec="seconds"),
+            "environment": environment(),
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
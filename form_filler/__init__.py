@@ -0,0 +1,101 @@
+"""Form-filling engine behind the USC Finance Forms Filler app.
+
+The engine is plain Python and does not import Streamlit, so it can be used
+from batch jobs, worker pools and benchmarks::
+
+    from form_filler import CoverSheet, PackageForms, build_package
+
+    pdf_bytes = build_package(PackageForms(cover_sheet=CoverSheet(club_name="Tennis")))
+"""
+import importlib
+
+# Public name -> submodule. Submodules are imported on first attribute access,
+# so ``from form_filler import CoverSheet`` does not load PyMuPDF or Pillow;
+# names from the engine, images and output modules do.
+_EXPORTS = {
+    "StageCache": "cache",
+    "append_attachment": "engine",
+    "append_image": "engine",
+    "build_package": "engine",
+    "fill_cover_sheet": "engine",
+    "fill_non_travel": "engine",
+    "fill_travel": "engine",
+    "ImageReport": "images",
+    "normalize_attachments": "images",
+    "normalize_image": "images",
+    "ACCOUNT_NUMBERS": "models",
+    "ATTACHMENT_TYPES": "models",
+    "IMAGE_TYPES": "models",
+    "Attachment": "models",
+    "CoverSheet": "models",
+    "ExpenseItem": "models",
+    "IncidentalItem": "models",
+    "LodgingItem": "models",
+    "MealItem": "models",
+    "NonTravelReport": "models",
+    "PackageForms": "models",
+    "ReimbursementItem": "models",
+    "TransportationItem": "models",
+    "TravelReport": "models",
+    "department_for": "models",
+    "format_page_ranges": "models",
+    "parse_page_ranges": "models",
+    "APPEARANCE_MODES": "options",
+    "OUTPUT_PROFILES": "options",
+    "ImageOptions": "options",
+    "NupOptions": "options",
+    "OutputProfile": "options",
+    "OutputReport": "output",
+    "save_pdf": "output",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+__all__ = [
+    "ACCOUNT_NUMBERS",
+    "APPEARANCE_MODES",
+    "ATTACHMENT_TYPES",
+    "IMAGE_TYPES",
+    "OUTPUT_PROFILES",
+    "Attachment",
+    "CoverSheet",
+    "ExpenseItem",
+    "ImageOptions",
+    "ImageReport",
+    "IncidentalItem",
+    "LodgingItem",
+    "MealItem",
+    "NonTravelReport",
+    "NupOptions",
+    "OutputProfile",
+    "OutputReport",
+    "PackageForms",
+    "ReimbursementItem",
+    "StageCache",
+    "TransportationItem",
+    "TravelReport",
+    "append_attachment",
+    "append_image",
+    "build_package",
+    "department_for",
+    "fill_cover_sheet",
+    "fill_non_travel",
+    "fill_travel",
+    "format_page_ranges",
+    "normalize_attachments",
+    "normalize_image",
+    "parse_page_ranges",
+    "save_pdf",
+]
@@ -0,0 +1,374 @@
+"""Local HTTP API for package generation.
+
+Usage::
+
+    python -m form_filler.api --port 8765
+
+Endpoints:
+
+``POST /packages``
+    Either a JSON body, or ``multipart/form-data`` with the JSON in a
+    ``request`` field and one file part per attachment (in order). The JSON
+    is a batch-mode record (see :mod:`form_filler.batch`) without
+    ``attachments``, plus optional ``profile``, ``appearance``,
+    ``flatten`` (merge the forms without form fields), ``image_dpi``,
+    ``jpeg_quality``, ``grayscale``, ``near_duplicates``, ``nup`` (pack
+    receipt images several to a page), ``nup_margin`` (inches),
+    ``nup_captions``, ``attachment_pages`` (file name -> page ranges such
+    as ``"2, 5-6"``, to include only those pages of a PDF) and ``async``.
+    Exact duplicate attachments are always left out. Small jobs answer
+    ``200`` with the PDF. Jobs whose attachments exceed the sync limit, or
+    that set ``"async": true``, answer ``202`` with a job id.
+``GET /jobs/<id>``
+    Job status as JSON.
+``GET /jobs/<id>/pdf``
+    The finished PDF; ``409`` while the job is still queued or running.
+``DELETE /jobs/<id>``
+    Cancel the job.
+``GET /health``
+    Queue length and worker count.
+``GET /metrics``
+    Build and per-stage counters and histograms in the Prometheus text format.
+
+The server is a single asyncio loop that only routes requests and moves
+bytes. Body parsing runs on the loop's default thread pool and every build
+goes through a :class:`JobQueue` of worker processes, so MuPDF never holds
+the GIL the loop needs and the number of concurrent builds stays fixed
+however many requests are in flight. It binds to 127.0.0.1 by default and
+has no authentication.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from email.parser import BytesParser
+from email.policy import HTTP
+from http import HTTPStatus
+from typing import Optional
+
+from .batch import resolve_forms
+from .diagnostics import METRICS, enable_json_log
+from .jobs import DEFAULT_WORKERS, JobQueue, PackageRequest
+from .ledger import InvalidAmounts, check_amounts
+from .models import ATTACHMENT_TYPES, Attachment, parse_page_ranges
+from .options import APPEARANCE_MODES, OUTPUT_PROFILES, ImageOptions, NupOptions
+from .templates import check_templates
+
+DEFAULT_PORT = 8765
+
+# Request keys that configure the build rather than describe the forms
+_OPTION_KEYS = ("profile", "appearance", "flatten", "image_dpi", "jpeg_quality", "grayscale", "near_duplicates",
+                "nup", "nup_margin", "nup_captions", "attachment_pages", "async")
+
+
+# Accepted image_dpi and jpeg_quality values
+_DPI_RANGE = (50, 600)
+_QUALITY_RANGE = (1, 95)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def _int_option(options: dict, key: str, default: int, low: int, high: int) -> int:
+    value = options.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{key} must be a whole number from {low} to {high}")
+    return value
+
+
+def _bool_option(options: dict, key: str, default: bool) -> bool:
+    value = options.get(key, default)
+    if not isinstance(value, bool):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{key} must be true or false")
+    return value
+
+
+def _headers(block: bytes):
+    return BytesParser(policy=HTTP).parsebytes(block + b"\r\n\r\n", headersonly=True)
+
+
+def _parse_multipart(content_type: str, body: bytes) -> tuple[dict, list[Attachment]]:
+    """Split a multipart body into its text fields and attached files.
+
+    Only part headers go through the ``email`` parser; it is far too slow
+    on tens of megabytes of attachment data.
+    """
+    boundary = _headers(b"Content-Type: " + content_type.encode("latin-1")).get_param("boundary")
+    if not boundary:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing multipart boundary")
+    fields, attachments = {}, []
+    # parts[0] is the preamble and the last one the closing "--" marker
+    for part in body.split(b"--" + boundary.encode("latin-1"))[1:-1]:
+        block, found, payload = part.removeprefix(b"\r\n").partition(b"\r\n\r\n")
+        if not found:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed multipart body")
+        headers = _headers(block)
+        payload = payload.removesuffix(b"\r\n")
+        filename = headers.get_filename()
+        if filename:
+            attachments.append(Attachment(os.path.basename(filename), payload))
+        else:
+            fields[headers.get_param("name", header="content-disposition")] = payload.decode("utf-8")
+    return fields, attachments
+
+
+def parse_package_request(content_type: str, body: bytes) -> tuple[PackageRequest, bool]:
+    """Build a :class:`PackageRequest` from a POST body; return it and the async flag."""
+    attachments = []
+    if content_type.startswith("multipart/form-data"):
+        fields, attachments = _parse_multipart(content_type, body)
+        if "request" not in fields:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing 'request' field")
+        text = fields["request"]
+    elif content_type.startswith("application/json"):
+        text = body.decode("utf-8")
+    else:
+        raise HTTPError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Use application/json or multipart/form-data")
+
+    try:
+        record = json.loads(text)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Request must be a JSON object")
+
+    options = {key: record.pop(key) for key in _OPTION_KEYS if key in record}
+    profile = options.get("profile", "small")
+    appearance = options.get("appearance", "bulk")
+    if profile not in OUTPUT_PROFILES:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unknown profile: {profile}")
+    if appearance not in APPEARANCE_MODES:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unknown appearance: {appearance}")
+    for attachment in attachments:
+        if attachment.file_type not in ATTACHMENT_TYPES:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unsupported file type: {attachment.filename}")
+    page_ranges = options.get("attachment_pages") or {}
+    if not isinstance(page_ranges, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "attachment_pages must map file names to page ranges")
+    unknown = set(page_ranges) - {attachment.filename for attachment in attachments}
+    if unknown:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "attachment_pages names no attachment: " + ", ".join(sorted(unknown)))
+    for attachment in attachments:
+        if attachment.filename in page_ranges:
+            try:
+                attachment.pages = parse_page_ranges(str(page_ranges[attachment.filename]))
+            except ValueError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"{attachment.filename}: {e}")
+
+    image_options = None
+    if options.get("image_dpi"):
+        image_options = ImageOptions(
+            dpi=_int_option(options, "image_dpi", 150, *_DPI_RANGE),
+            quality=_int_option(options, "jpeg_quality", 75, *_QUALITY_RANGE),
+            grayscale=_bool_option(options, "grayscale", False),
+        )
+    nup = None
+    if options.get("nup"):
+        margin = options.get("nup_margin", 0.5)
+        if not isinstance(margin, (int, float)) or not 0 <= margin <= 2:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "nup_margin must be between 0 and 2 inches")
+        nup = NupOptions(margin=float(margin), captions=_bool_option(options, "nup_captions", True))
+    try:
+        forms = resolve_forms(record)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid forms: {type(e).__name__}: {e}")
+    if not any((forms.cover_sheet, forms.non_travel, forms.travel)):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "No forms selected")
+    try:
+        check_amounts(forms)
+    except InvalidAmounts as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+    request = PackageRequest(forms, attachments, profile=profile, appearance=appearance,
+                             flatten=_bool_option(options, "flatten", False), image_options=image_options,
+                             near_duplicates=_bool_option(options, "near_duplicates", False), nup=nup)
+    return request, _bool_option(options, "async", False)
+
+
+class PackageAPI:
+    """Request routing on top of a :class:`JobQueue`."""
+
+    def __init__(self, queue: JobQueue, sync_limit_mb: float = 10, max_body_mb: float = 200):
+        self.queue = queue
+        self.sync_limit = sync_limit_mb * 1024 * 1024
+        self.max_body = max_body_mb * 1024 * 1024
+
+    def _job_status(self, job) -> dict:
+        return {
+            "id": job.id,
+            "status": job.status,
+            "position": self.queue.position(job.id),
+            "message": job.message,
+            "error": job.error,
+            "seconds": job.seconds,
+        }
+
+    def _job(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown job")
+        return job
+
+    async def _wait(self, job, interval: float = 0.05):
+        # Poll rather than park a thread per waiting request
+        while job.active:
+            await asyncio.sleep(interval)
+
+    def _pdf_response(self, job):
+        if job.active:
+            raise HTTPError(HTTPStatus.CONFLICT, f"Job is {job.status}")
+        if job.status != "done":
+            raise HTTPError(HTTPStatus.CONFLICT, job.error or f"Job was {job.status}")
+        result = self.queue.result(job.id)
+        if result is None:
+            raise HTTPError(HTTPStatus.GONE, "Result has expired")
+        return HTTPStatus.OK, "application/pdf", result[0], {}
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        """Return ``(status, content type, body, extra headers)``."""
+        parts = [p for p in path.split("?", 1)[0].split("/") if p]
+
+        if parts == ["health"] and method == "GET":
+            return self._json(HTTPStatus.OK, {
+                "status": "ok", "workers": self.queue.workers,
+                "queued": self.queue.queued, "running": self.queue.running,
+            })
+
+        if parts == ["metrics"] and method == "GET":
+            return HTTPStatus.OK, "text/plain; version=0.0.4", METRICS.render().encode("utf-8"), {}
+
+        if parts == ["packages"] and method == "POST":
+            request, run_async = await asyncio.get_running_loop().run_in_executor(
+                None, parse_package_request, headers.get("content-type", ""), body)
+            job = self.queue.submit(request)
+            if run_async or sum(a.size for a in request.attachments) > self.sync_limit:
+                return self._json(HTTPStatus.ACCEPTED, self._job_status(job), {"Location": f"/jobs/{job.id}"})
+            await self._wait(job)
+            return self._pdf_response(job)
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self._job(parts[1])
+            if len(parts) == 3 and parts[2] == "pdf" and method == "GET":
+                return self._pdf_response(job)
+            if len(parts) == 2 and method == "GET":
+                return self._json(HTTPStatus.OK, self._job_status(job))
+            if len(parts) == 2 and method == "DELETE":
+                self.queue.cancel(job.id)
+                return self._json(HTTPStatus.OK, self._job_status(job))
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    @staticmethod
+    def _json(status, data, headers=None):
+        return status, "application/json", json.dumps(data).encode("utf-8"), headers or {}
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer one HTTP/1.1 request, then close the connection."""
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            try:
+                status, content_type, payload, extra = await self._respond(head, reader)
+            except HTTPError as e:
+                status, content_type, payload, extra = self._json(e.status, {"error": str(e)})
+            except Exception as e:
+                status, content_type, payload, extra = self._json(
+                    HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"})
+
+            lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                     f"Content-Type: {content_type}",
+                     f"Content-Length: {len(payload)}",
+                     "Connection: close"]
+            lines += [f"{key}: {value}" for key, value in extra.items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            writer.write(payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, head: bytes, reader: asyncio.StreamReader):
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Chunked bodies are not supported")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b""
+        return await self.handle(method.upper(), path, headers, body)
+
+
+async def start_server(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    queue: Optional[JobQueue] = None,
+    sync_limit_mb: float = 10,
+) -> asyncio.base_events.Server:
+    """Start listening and return the server; ``port=0`` picks a free port.
+
+    Without a ``queue``, builds run on a new process-backed :class:`JobQueue`.
+    """
+    api = PackageAPI(queue or JobQueue(processes=True), sync_limit_mb=sync_limit_mb)
+    return await asyncio.start_server(api.serve_connection, host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve package generation over HTTP on this machine.")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"packages built at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--threads", action="store_true",
+                        help="build in worker threads instead of processes (keeps the server less responsive)")
+    parser.add_argument("--sync-limit", type=float, default=10, metavar="MB",
+                        help="attachments above this size get a job id instead of waiting (default: 10)")
+    parser.add_argument("--log-json", default=None, metavar="PATH",
+                        help="append per-stage timings as JSON lines to PATH ('-' for stderr)")
+    args = parser.parse_args(argv)
+
+    problems = check_templates()
+    if problems:
+        sys.exit("\n".join(problems))
+
+    if args.log_json:
+        enable_json_log(None if args.log_json == "-" else args.log_json)
+
+    queue = JobQueue(workers=args.workers, processes=not args.threads)
+
+    async def serve():
+        server = await start_server(args.host, args.port, queue, args.sync_limit)
+        print(f"Serving on http://{args.host}:{server.sockets[0].getsockname()[1]}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Headless batch mode: build one merged PDF package per input record.
+
+Usage::
+
+    python -m form_filler.batch records.jsonl -o packages/ -j 4
+
+Each JSONL line (or CSV row) is one package. A record holds the shared fields
+(``club_name``, ``account_type``, ``short_title``), one section per selected
+form (``cover_sheet``, ``non_travel``, ``travel``) with the same fields the
+app's expanders collect, and ``attachments``, a list of file paths relative to
+the records file. An attachment can also be ``{"path": ..., "pages": "2-3"}``
+to include only some pages of a PDF. For example::
+
+    {"id": "tennis-spring", "club_name": "Tennis", "account_type": "RCC",
+     "short_title": "Spring Tournament",
+     "cover_sheet": {"submitter_name": "Alex", "items": [{"desc": "Balls", "qty": "4", "amt": "20.00"}]},
+     "non_travel": {"items": [{"date": "2025-03-01", "desc": "Balls", "qty": "4", "amt": "20.00", "gu_amt": "0.00"}]},
+     "attachments": ["receipts/balls.jpg", {"path": "statements/march.pdf", "pages": "2, 5-6"}]}
+
+CSV files use dotted column names (``cover_sheet.submitter_name``); line-item
+columns (``cover_sheet.items`` etc.) hold JSON lists and ``attachments`` holds
+``;``-separated paths. Records are spread over a process pool and a summary of
+per-record timings and failures is written next to the packages.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from .dedupe import dedupe_attachments
+from .engine import build_package
+from .images import normalize_attachments
+from .ledger import check_amounts
+from .models import (
+    ACCOUNT_NUMBERS, Attachment, CoverSheet, NonTravelReport, PackageForms, TravelReport, department_for,
+    parse_page_ranges,
+)
+from .options import APPEARANCE_MODES, OUTPUT_PROFILES, ImageOptions, NupOptions
+from .spool import SpoolDir, build_package_to_file
+from .templates import check_templates
+
+ITEM_KEYS = ("items", "incidentals", "transportation", "lodging", "meals")
+
+
+def _csv_record(row):
+    record = {}
+    for column, value in row.items():
+        if column is None or value is None or value == "":
+            continue
+        *sections, key = column.split(".")
+        if key in ITEM_KEYS:
+            value = json.loads(value)
+        elif key == "attachments":
+            value = [path.strip() for path in value.split(";") if path.strip()]
+        target = record
+        for section in sections:
+            target = target.setdefault(section, {})
+        target[key] = value
+    return record
+
+
+def load_records(path):
+    """Read records from a ``.jsonl`` or ``.csv`` file."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            return [_csv_record(row) for row in csv.DictReader(f)]
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def resolve_forms(record):
+    """Apply the app's cross-form auto-fill and return the typed forms."""
+    cover = record.get("cover_sheet") or {}
+    club_name = record.get("club_name", cover.get("club_name", ""))
+    account_type = record.get("account_type", cover.get("account_type", "Credit Union"))
+    account_number = record.get("account_number") or ACCOUNT_NUMBERS[account_type]
+    short_title = record.get("short_title", cover.get("short_title", ""))
+
+    forms = PackageForms()
+    if record.get("cover_sheet"):
+        form = dict(record["cover_sheet"])
+        form.setdefault("club_name", club_name)
+        form.setdefault("account_type", account_type)
+        form.setdefault("account_number", account_number)
+        form.setdefault("short_title", short_title)
+        forms.cover_sheet = CoverSheet.from_dict(form)
+    for key, cls in (("non_travel", NonTravelReport), ("travel", TravelReport)):
+        if record.get(key):
+            form = dict(record[key])
+            form.setdefault("department", department_for(club_name))
+            form.setdefault("account", account_number)
+            form.setdefault("business_purpose", short_title)
+            setattr(forms, key, cls.from_dict(form))
+    return forms
+
+
+def record_id(record, position):
+    return str(record.get("id") or f"record-{position:04d}")
+
+
+def _output_name(record, position):
+    name = record.get("output") or record_id(record, position) + ".pdf"
+    return re.sub(r"[^\w.\- ]", "_", name)
+
+
+def build_record(record, position, output_dir, base_dir, image_options=None, profile="fast", appearance="bulk",
+                 memory_limit_mb=None, near_duplicates=False, nup=None, flatten=False):
+    """Build one package and return its summary entry; never raises.
+
+    With ``memory_limit_mb`` the package is assembled from the attachment
+    files on disk by :func:`build_package_to_file` instead of in memory.
+    Duplicate attachments are left out (see :func:`dedupe_attachments`).
+    ``nup`` packs image attachments several to a page and ``flatten`` merges
+    the filled forms without form fields.
+    """
+    started = time.perf_counter()
+    summary = {"id": record_id(record, position), "status": "ok"}
+    try:
+        forms = resolve_forms(record)
+        check_amounts(forms)
+        attachments = []
+        for entry in record.get("attachments", []):
+            path, pages = entry, None
+            if isinstance(entry, dict):
+                path, pages = entry["path"], parse_page_ranges(entry.get("pages", ""))
+            full_path = os.path.join(base_dir, path)
+            if memory_limit_mb is not None:
+                attachments.append(Attachment(os.path.basename(path), path=full_path, pages=pages))
+                continue
+            with open(full_path, "rb") as f:
+                attachments.append(Attachment(os.path.basename(path), f.read(), pages=pages))
+
+        attachments, duplicates = dedupe_attachments(attachments, near=near_duplicates)
+        if duplicates:
+            summary["duplicates"] = [str(d) for d in duplicates]
+        stats = {}
+        output = os.path.join(output_dir, _output_name(record, position))
+        # Disk-spooled builds keep the normalized images on disk as well
+        with SpoolDir() if memory_limit_mb is not None else nullcontext() as work_dir:
+            if image_options is not None:
+                attachments, reports = normalize_attachments(attachments, image_options, spool=work_dir)
+                summary["image_bytes_saved"] = sum(r.bytes_saved for r in reports)
+            if memory_limit_mb is not None:
+                build_package_to_file(forms, attachments, output, memory_limit_mb, profile=profile, stats=stats,
+                                      appearance=appearance, spool=work_dir, nup=nup, flatten=flatten)
+                summary["peak_rss"] = stats["peak_rss"]
+            else:
+                pdf_bytes = build_package(forms, attachments, profile=profile, stats=stats,
+                                          appearance=appearance, nup=nup, flatten=flatten)
+                with open(output, "wb") as f:
+                    f.write(pdf_bytes)
+        summary["output"] = output
+        summary["bytes"] = stats["output"].bytes
+        summary["save_seconds"] = round(stats["output"].seconds, 4)
+        summary["stages"] = [
+            dict(row, seconds=round(row["seconds"], 4)) for row in stats["trace"].summary()
+        ]
+        summary["attachments"] = len(attachments)
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = f"{type(e).__name__}: {e}"
+        summary["traceback"] = traceback.format_exc()
+    summary["seconds"] = round(time.perf_counter() - started, 4)
+    return summary
+
+
+def run_batch(records, output_dir, base_dir=".", workers=None, image_options=None, profile="fast",
+              appearance="bulk", memory_limit_mb=None, near_duplicates=False, nup=None, flatten=False):
+    """Build every record, using a process pool unless ``workers == 1``.
+
+    ``image_options`` enables the image normalization stage; ``profile``
+    names the output profile used to save each package and ``appearance``
+    the field appearance mode. ``memory_limit_mb`` switches to disk-spooled
+    assembly and ``near_duplicates`` also leaves out attachments that only
+    look like earlier ones. ``nup`` (:class:`NupOptions`) packs receipt
+    images several to a page and ``flatten`` merges the filled forms as
+    static pages.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = [None] * len(records)
+
+    if workers == 1:
+        for position, record in enumerate(records, start=1):
+            results[position - 1] = build_record(record, position, output_dir, base_dir, image_options, profile,
+                                                 appearance, memory_limit_mb, near_duplicates, nup, flatten)
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(build_record, record, position, output_dir, base_dir, image_options, profile, appearance,
+                        memory_limit_mb, near_duplicates, nup, flatten): position
+            for position, record in enumerate(records, start=1)
+        }
+        for future in as_completed(futures):
+            results[futures[future] - 1] = future.result()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill and merge finance form packages from a JSONL/CSV file.")
+    parser.add_argument("records", help="JSONL or CSV file, one package per record")
+    parser.add_argument("-o", "--output-dir", default="packages", help="where to write the merged PDFs")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: CPU count; 1 runs in-process)")
+    parser.add_argument("--summary", default=None,
+                        help="summary JSON path (default: <output-dir>/summary.json)")
+    parser.add_argument("--image-dpi", type=int, default=None,
+                        help="normalize receipt images to fit a letter page at this DPI")
+    parser.add_argument("--jpeg-quality", type=int, default=75, help="JPEG quality for normalized images")
+    parser.add_argument("--grayscale", action="store_true", help="store normalized images in grayscale")
+    parser.add_argument("--profile", choices=list(OUTPUT_PROFILES), default="small",
+                        help="output profile (default: small)")
+    parser.add_argument("--appearance", choices=APPEARANCE_MODES, default="bulk",
+                        help="how form field appearances are built (default: bulk)")
+    parser.add_argument("--flatten", action="store_true",
+                        help="merge the filled forms as static pages without form fields")
+    parser.add_argument("--memory-limit", type=float, default=None, metavar="MB",
+                        help="assemble packages on disk, flushing pages past this many MB")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="also leave out attachments whose pages look like earlier ones")
+    parser.add_argument("--nup", action="store_true", help="pack receipt images several to a letter page")
+    parser.add_argument("--nup-margin", type=float, default=0.5, metavar="INCHES",
+                        help="page margin for packed receipts (default: 0.5)")
+    parser.add_argument("--no-captions", action="store_true", help="do not print file names under packed receipts")
+    args = parser.parse_args(argv)
+
+    problems = check_templates()
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return 2
+
+    image_options = None
+    if args.image_dpi:
+        image_options = ImageOptions(dpi=args.image_dpi, quality=args.jpeg_quality, grayscale=args.grayscale)
+
+    nup = NupOptions(margin=args.nup_margin, captions=not args.no_captions) if args.nup else None
+
+    records = load_records(args.records)
+    base_dir = os.path.dirname(os.path.abspath(args.records))
+
+    started = time.perf_counter()
+    results = run_batch(records, args.output_dir, base_dir, args.workers, image_options, args.profile,
+                        args.appearance, args.memory_limit, args.near_duplicates, nup, args.flatten)
+    elapsed = time.perf_counter() - started
+
+    failed = [r for r in results if r["status"] != "ok"]
+    summary = {
+        "records": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "workers": args.workers or os.cpu_count(),
+        "profile": args.profile,
+        "seconds": round(elapsed, 4),
+        "results": results,
+    }
+    summary_path = args.summary or os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    for r in results:
+        detail = r.get("output") if r["status"] == "ok" else r["error"]
+        print(f"{r['status']:>6}  {r['seconds']:8.3f}s  {r['id']}  {detail}")
+    print(f"{summary['succeeded']}/{summary['records']} packages in {elapsed:.2f}s; summary: {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
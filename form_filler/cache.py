@@ -0,0 +1,109 @@
+"""Content-addressed cache for package build stages.
+
+Each stage (a filled form, a normalized image, an image converted to a PDF
+page) is stored under a hash of everything that determines its output. When a
+package is regenerated after a small edit, only the stages whose inputs
+changed are rebuilt; the rest are spliced in from the cache. Because keys are
+content hashes, one :func:`shared_cache` can serve every session on a server:
+the same receipt uploaded by two treasurers is converted once.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+
+def content_key(*parts) -> str:
+    """SHA-256 over ``parts``; bytes are hashed raw, anything else by ``repr``."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Bounded LRU of ``key -> value`` with hit/miss counters.
+
+    ``max_bytes`` bounds the summed size of the entries, where an entry's
+    size is ``len(value)`` unless the caller supplies one.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, size=None) -> None:
+        if size is None:
+            size = len(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def get_or_build(self, key, build: Callable, sizeof: Callable = len):
+        """Return the cached value for ``key`` or build, store and return it."""
+        value = self.get(key, _MISSING)
+        with self._lock:
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        self.put(key, value, sizeof(value))
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_MISSING = object()
+
+SHARED_CACHE_MB = 256
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> StageCache:
+    """Process-wide :class:`StageCache` shared by every session.
+
+    A session is only served stages whose inputs it already has, since the
+    key is a hash of those inputs.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = StageCache(max_bytes=SHARED_CACHE_MB * 1024 * 1024)
+        return _shared
@@ -0,0 +1,325 @@
+"""Continuation sheets for line items past a template's fixed rows.
+
+Each form has a fixed number of line-item rows (10 on the cover sheet, 16 on
+the non-travel report, three or four per travel section). Items beyond that
+go on continuation pages added right after the form page that holds the
+table. A continuation page repeats the template's own table, drawn from the
+blank template with ``show_pdf_page`` and clipped to the table: the clip is
+embedded once per document and every further band on every page is a
+reference to it, so a thousand items cost a few small content streams rather
+than a thousand copies of the form. Values are written as plain text, one
+content stream per page, at the positions of the template's own row
+widgets; continuation pages carry no fields.
+
+Every page shows the amount brought forward, its own subtotal and the running
+total, all taken from the form's :class:`~form_filler.ledger.Ledger`. The
+totals on the form itself already cover every item, so the last running
+total matches them to the cent.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import fitz  # PyMuPDF
+
+from .diagnostics import stage
+from .fields import (
+    COVER_SHEET_ITEM_FIELDS, COVER_SHEET_MAX_ITEMS,
+    NON_TRAVEL_ITEM_FIELDS, NON_TRAVEL_MAX_ITEMS,
+    TRAVEL_INCIDENTAL_FIELDS, TRAVEL_LODGING_FIELDS, TRAVEL_MAX_INCIDENTALS,
+    TRAVEL_MAX_LODGING, TRAVEL_MAX_MEALS, TRAVEL_MAX_TRANSPORTATION,
+    TRAVEL_MEAL_FIELDS, TRAVEL_TRANSPORTATION_FIELDS,
+)
+from .ledger import format_cents
+from .templates import get_template
+
+
+@dataclass(frozen=True, slots=True)
+class ContinuationTable:
+    """Where a repeating table sits in its template and how it is totalled."""
+    title: str
+    row_map: dict
+    max_rows: int
+    page: int
+    # The column headings and rows of the table, in template coordinates
+    clip: tuple
+    # (label, item keys summed for it), e.g. ("Amount", ("amt",))
+    totals: tuple
+    # x range of a printed row number to replace with the item's number
+    number_cell: Optional[tuple] = None
+
+
+COVER_SHEET_TABLE = ContinuationTable(
+    "Reimbursement Tally", COVER_SHEET_ITEM_FIELDS, COVER_SHEET_MAX_ITEMS, page=1,
+    clip=(71, 270, 541, 569), totals=(("Total Item Amount", ("amt",)),), number_cell=(73, 127),
+)
+NON_TRAVEL_TABLE = ContinuationTable(
+    "Expenses", NON_TRAVEL_ITEM_FIELDS, NON_TRAVEL_MAX_ITEMS, page=0,
+    clip=(38, 296, 553, 592), totals=(("Amount", ("amt",)), ("G/U Amount", ("gu_amt",))),
+)
+TRAVEL_INCIDENTALS_TABLE = ContinuationTable(
+    "I. Incidentals", TRAVEL_INCIDENTAL_FIELDS, TRAVEL_MAX_INCIDENTALS, page=0,
+    clip=(91, 171, 502, 243), totals=(("Amount", ("amt",)), ("G/U Amount", ("gu_amt",))),
+)
+TRAVEL_TRANSPORTATION_TABLE = ContinuationTable(
+    "II. Transportation", TRAVEL_TRANSPORTATION_FIELDS, TRAVEL_MAX_TRANSPORTATION, page=0,
+    clip=(91, 247, 502, 307), totals=(("Amount", ("amt",)), ("G/U Amount", ("gu_amt",))),
+)
+TRAVEL_LODGING_TABLE = ContinuationTable(
+    "III. Lodging", TRAVEL_LODGING_FIELDS, TRAVEL_MAX_LODGING, page=0,
+    clip=(91, 343.5, 502, 390), totals=(("Amount", ("amt",)),),
+)
+TRAVEL_MEALS_TABLE = ContinuationTable(
+    "III. Meals", TRAVEL_MEAL_FIELDS, TRAVEL_MAX_MEALS, page=0,
+    clip=(91, 390.5, 502, 456.5),
+    totals=(("Meals", ("breakfast", "lunch", "dinner")), ("G/U", ("gu",))),
+)
+
+MARGIN = 36
+# Page header (form title, section, brought forward) above the first band
+HEADER_HEIGHT = 44
+# Subtotal and running total lines below the last band
+FOOTER_HEIGHT = 34
+BAND_GAP = 8
+FONT_SIZE = 9
+
+# Base-14 fonts by their PyMuPDF resource names
+_FONTS = {"helv": fitz.Font("helv"), "hebo": fitz.Font("hebo")}
+# Glyph advances at 1pt; Font.text_length calls into MuPDF once per
+# character, which dominates with thousands of cells
+_ADVANCES = {name: {} for name in _FONTS}
+
+
+def _text_length(text, font, size):
+    advances = _ADVANCES[font]
+    length = 0.0
+    for char in text:
+        advance = advances.get(char)
+        if advance is None:
+            advance = advances[char] = _FONTS[font].glyph_advance(ord(char))
+        length += advance
+    return length * size
+
+
+def _fit(text, width, font, size):
+    """Cut ``text`` with an ellipsis so it fits in ``width`` points."""
+    if _text_length(text, font, size) <= width:
+        return text
+    while text and _text_length(text + "...", font, size) > width:
+        text = text[:-1]
+    return text + "..." if text else ""
+
+
+class _PageText:
+    """Text for one page, written as a single content stream.
+
+    Going through ``TextWriter`` or ``insert_text`` costs a round of
+    transforms and resource checks per cell; a sheet of cells is just a
+    string of ``Tj`` operators in the base-14 Helvetica the page references.
+    """
+
+    def __init__(self, page, fonts):
+        self.page = page
+        self.height = page.rect.height
+        # Resource name -> font xref, shared by every page of the document
+        self.fonts = fonts
+        self.ops = []
+
+    def put(self, rect, text, align=0, font="helv", size=FONT_SIZE):
+        """Write one line inside ``rect`` (x0, y0, x1, y1), vertically centred.
+
+        ``align`` is a PDF /Q value: 0 left, 1 centred, 2 right.
+        """
+        x0, y0, x1, y1 = rect
+        width = x1 - x0 - 4
+        # The fonts are WinAnsi-encoded; anything outside Latin-1 shows as "?"
+        text = _fit(text.encode("latin-1", "replace").decode("latin-1"), width, font, size)
+        if not text:
+            return
+        x = x0 + 2
+        if align:
+            slack = width - _text_length(text, font, size)
+            x += slack / 2 if align == 1 else slack
+        baseline = y1 - (y1 - y0 - size) / 2 - size * 0.15
+        self.ops.append(f"BT /{font} {size:g} Tf {x:.2f} {self.height - baseline:.2f} Td "
+                        f"{fitz.get_pdf_str(text)} Tj ET")
+
+    def write(self):
+        page, doc = self.page, self.page.parent
+        # The page was just created, so its only resources are the background
+        # XObject's; adding the fonts directly skips insert_font's font scan
+        kind, value = doc.xref_get_key(page.xref, "Resources")
+        resources = int(value.split()[0]) if kind == "xref" else page.xref
+        prefix = "" if kind == "xref" else "Resources/"
+        for font in _FONTS:
+            if font not in self.fonts:
+                self.fonts[font] = page.insert_font(fontname=font)
+            else:
+                doc.xref_set_key(resources, f"{prefix}Font/{font}", f"{self.fonts[font]} 0 R")
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<<>>")
+        doc.update_stream(xref, "\n".join(self.ops).encode("latin-1"))
+        kind, value = doc.xref_get_key(page.xref, "Contents")
+        existing = value.strip("[]") if kind in ("array", "xref") else ""
+        doc.xref_set_key(page.xref, "Contents", f"[{existing} {xref} 0 R]")
+
+
+def _row_cells(index, table):
+    """``[(key, (x0, y0, x1, y1), /Q, font size), ...]`` per row, from the template's row widgets.
+
+    Widgets with an automatic font size (0) get :data:`FONT_SIZE`; none is
+    taller than 80% of its cell.
+    """
+    rows = []
+    for row in range(1, table.max_rows + 1):
+        cells = []
+        for key, pattern in table.row_map.items():
+            specs = index.get(pattern.format(row))
+            if not specs:
+                continue
+            spec = specs[0]
+            height = spec.rect[3] - spec.rect[1]
+            cells.append((key, spec.rect, spec.align, min(spec.font_size or FONT_SIZE, round(height * 0.8, 1))))
+        rows.append(cells)
+    return rows
+
+
+def _totals_text(table, amounts):
+    return "   ".join(f"{label}: {format_cents(cents, currency=True)}"
+                       for (label, _), cents in zip(table.totals, amounts))
+
+
+class _Layout:
+    """Band positions for one table's continuation sheets and their backgrounds."""
+
+    def __init__(self, doc, index, table, items, ledger):
+        self.table = table
+        self.items = items
+        # Running totals per total line; sheet subtotals are differences
+        self.running = [ledger.running(*keys) for _, keys in table.totals]
+        self.clip = fitz.Rect(table.clip)
+        self.rows = _row_cells(index, table)
+        self.page_rect = fitz.Rect(doc[table.page].rect)
+        self.band_height = self.clip.height + BAND_GAP
+        usable = self.page_rect.height - 2 * MARGIN - HEADER_HEIGHT - FOOTER_HEIGHT
+        self.bands_per_page = max(1, int((usable + BAND_GAP) // self.band_height))
+        self.per_page = self.bands_per_page * table.max_rows
+        self.top = MARGIN + HEADER_HEIGHT
+        overflow = len(items) - table.max_rows
+        self.sheets = -(-overflow // self.per_page)
+        # Band count -> page number of its background in the scratch document
+        self.backgrounds = {}
+        for sheet in range(self.sheets):
+            self.backgrounds[self.bands(sheet)] = None
+
+    def bands(self, sheet):
+        left = len(self.items) - self.table.max_rows - sheet * self.per_page
+        return min(self.bands_per_page, -(-left // self.table.max_rows))
+
+    def offset(self, band):
+        """Vertical shift from template coordinates to band ``band`` on a sheet."""
+        return self.top + band * self.band_height - self.clip.y0
+
+    def number_cells(self, band):
+        dy = self.offset(band)
+        x0, x1 = self.table.number_cell
+        return [(x0, cells[0][1][1] + dy + 1, x1, cells[0][1][3] + dy - 1) for cells in self.rows if cells]
+
+    def build_backgrounds(self, scratch, source):
+        """Stamp the template table onto one scratch page per band count.
+
+        Every sheet then shows one of these pages with a single
+        ``show_pdf_page``. They must all exist before the first sheet is
+        stamped: MuPDF maps a source document's objects once.
+        """
+        for bands in self.backgrounds:
+            page = scratch.new_page(width=self.page_rect.width, height=self.page_rect.height)
+            for band in range(bands):
+                dy = self.offset(band)
+                page.show_pdf_page(self.clip + (0, dy, 0, dy), source, self.table.page, clip=self.clip)
+            if self.table.number_cell is not None:
+                # Blank out the template's printed row numbers
+                shape = page.new_shape()
+                for band in range(bands):
+                    for rect in self.number_cells(band):
+                        shape.draw_rect(rect)
+                shape.finish(color=None, fill=(1, 1, 1))
+                shape.commit()
+            self.backgrounds[bands] = page.number
+
+
+def _stamp_sheets(doc, scratch, layout, form_title, at, fonts):
+    table, items, clip = layout.table, layout.items, layout.clip
+    width = layout.page_rect.width
+    for sheet in range(layout.sheets):
+        start = table.max_rows + sheet * layout.per_page
+        chunk = items[start:start + layout.per_page]
+        stop = start + len(chunk)
+        brought = [running[start] for running in layout.running]
+        carried = [running[stop] for running in layout.running]
+        subtotal = [b - a for a, b in zip(brought, carried)]
+        first = start + 1
+        bands = layout.bands(sheet)
+        page = doc.new_page(at + sheet, width=width, height=layout.page_rect.height)
+        page.show_pdf_page(page.rect, scratch, layout.backgrounds[bands])
+
+        text = _PageText(page, fonts)
+        text.put((MARGIN, MARGIN, width - MARGIN, MARGIN + 16),
+                 f"{form_title} - continuation sheet {sheet + 1} of {layout.sheets}", font="hebo", size=11)
+        heading = (MARGIN, MARGIN + 16, width - MARGIN, MARGIN + 30)
+        text.put(heading, f"{table.title} (continued), items {first}-{first + len(chunk) - 1} of {len(items)}")
+        text.put(heading, "Brought forward: " + _totals_text(table, brought), align=2)
+
+        for band in range(bands):
+            dy = layout.offset(band)
+            band_items = chunk[band * table.max_rows:(band + 1) * table.max_rows]
+            for cells, item in zip(layout.rows, band_items):
+                for key, (x0, y0, x1, y1), align, size in cells:
+                    value = getattr(item, key)
+                    if value:
+                        text.put((x0, y0 + dy, x1, y1 + dy), str(value), align, size=size)
+            if table.number_cell is not None:
+                number = first + band * table.max_rows
+                for offset, rect in enumerate(layout.number_cells(band)[:len(band_items)]):
+                    text.put(rect, str(number + offset))
+
+        bottom = layout.top + bands * layout.band_height
+        text.put((clip.x0, bottom, clip.x1, bottom + 14),
+                 "Sheet subtotal: " + _totals_text(table, subtotal), align=2)
+        label = "Section total: " if sheet == layout.sheets - 1 else "Carried forward: "
+        text.put((clip.x0, bottom + 14, clip.x1, bottom + 28),
+                 label + _totals_text(table, carried), align=2, font="hebo")
+        text.write()
+
+
+def add_continuation_sheets(
+    doc: fitz.Document,
+    index,
+    sections,
+    template_filename: str,
+    form_title: str,
+) -> int:
+    """Add continuation pages for each ``(table, items, ledger)`` in ``sections``.
+
+    Pages for a table go right after the page holding it, in the order the
+    sections are given. ``index`` is the filled document's field index,
+    whose row widgets give the cell positions; each :class:`Ledger` is the
+    one the form's own totals came from. Returns the number of pages added.
+    """
+    layouts = [_Layout(doc, index, table, items, ledger)
+               for table, items, ledger in sections if len(items) > table.max_rows]
+    if not layouts:
+        return 0
+    added = 0
+    fonts = {}
+    # Every background of every table is stamped from one source into one
+    # scratch document, so the filled form embeds the template page once
+    with get_template(template_filename).open() as source, fitz.open() as scratch:
+        with stage("continuation.stamp", "backgrounds"):
+            for layout in layouts:
+                layout.build_backgrounds(scratch, source)
+        for layout in layouts:
+            with stage("continuation.stamp", layout.table.title) as span:
+                _stamp_sheets(doc, scratch, layout, form_title, layout.table.page + 1 + added, fonts)
+                span.pages = layout.sheets
+            added += layout.sheets
+    return added
@@ -0,0 +1,128 @@
+"""Leave duplicate attachments out of a package.
+
+Treasurers often upload the same receipt twice, or a statement whose pages
+are already attached as photos. An attachment whose bytes match an earlier
+one (with the same page selection) is always left out, before it is
+normalized, converted or embedded.
+
+Near duplicates are optional: each page is reduced to a 256-bit difference
+hash (dHash) of a small grayscale rendering, and a page within
+:data:`NEAR_DUPLICATE_DISTANCE` bits of a page already in the package is
+left out. An attachment all of whose pages match is dropped; of a PDF that
+only repeats some pages (a statement with receipts already attached as
+photos), just the repeated pages are. Pages with almost no contrast
+(blank or nearly blank) never count as duplicates. Renderings come from the
+thumbnail cache, so hashing a file twice costs nothing.
+"""
+import io
+from dataclasses import dataclass, replace
+from typing import Iterable, Optional
+
+from PIL import Image, ImageStat
+
+from .models import Attachment
+from .thumbnails import file_digest, image_thumbnail, pdf_thumbnails
+
+HASH_SIZE = 16
+# Differing bits out of HASH_SIZE ** 2 for two pages to count as the same
+NEAR_DUPLICATE_DISTANCE = 24
+# Pages whose rendering has less grayscale spread than this are not compared
+_MIN_CONTRAST = 8.0
+_HASH_WIDTH = 96  # pixels
+
+
+@dataclass(slots=True)
+class Duplicate:
+    """An attachment, or one page of it, left out because it repeats ``original``."""
+    filename: str
+    original: str
+    exact: bool
+    # 0-based page of a PDF left out on its own; None when the whole attachment is
+    page: Optional[int] = None
+
+    def __str__(self):
+        kind = "same file as" if self.exact else "looks like"
+        where = self.filename if self.page is None else f"{self.filename} page {self.page + 1}"
+        return f"{where} ({kind} {self.original})"
+
+
+def dhash(image: Image.Image):
+    """Difference hash of ``image`` as an int, or None for a featureless page."""
+    gray = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    if ImageStat.Stat(gray).stddev[0] < _MIN_CONTRAST:
+        return None
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        line = pixels[row * (HASH_SIZE + 1):(row + 1) * (HASH_SIZE + 1)]
+        for left, right in zip(line, line[1:]):
+            bits = bits << 1 | (left > right)
+    return bits
+
+
+def page_hashes(attachment: Attachment, digest: Optional[str] = None) -> list:
+    """One :func:`dhash` per page of an image or PDF attachment (selected pages only)."""
+    data = attachment.read()
+    digest = digest or file_digest(data)
+    if attachment.file_type == "pdf":
+        renderings = pdf_thumbnails(data, attachment.pages, width=_HASH_WIDTH, digest=digest)
+    else:
+        renderings = [image_thumbnail(data, width=_HASH_WIDTH, digest=digest)]
+    hashes = []
+    for jpeg in renderings:
+        with Image.open(io.BytesIO(jpeg)) as img:
+            hashes.append(dhash(img))
+    return hashes
+
+
+def _match(page, pages, distance):
+    """Filename of the first kept page within ``distance`` bits of ``page``."""
+    if page is None:
+        return None
+    for other, filename in pages:
+        if other is not None and (page ^ other).bit_count() <= distance:
+            return filename
+    return None
+
+
+def dedupe_attachments(
+    attachments: Iterable[Attachment],
+    near: bool = False,
+    distance: int = NEAR_DUPLICATE_DISTANCE,
+) -> tuple[list[Attachment], list[Duplicate]]:
+    """Drop exact (and, with ``near``, near) duplicates, keeping the first copy.
+
+    Returns the remaining attachments in their original order and one
+    :class:`Duplicate` per attachment, or per PDF page, left out. A PDF that
+    keeps some of its pages comes back as a copy with ``pages`` narrowed to
+    them.
+    """
+    kept, duplicates = [], []
+    originals = {}
+    # (page hash, filename) for every page kept so far
+    pages = []
+    for attachment in attachments:
+        digest = file_digest(attachment.read())
+        # Two different page ranges of one statement are not duplicates
+        key = (digest, attachment.pages)
+        if key in originals:
+            duplicates.append(Duplicate(attachment.filename, originals[key], exact=True))
+            continue
+        if near:
+            hashes = page_hashes(attachment, digest)
+            matches = [_match(page, pages, distance) for page in hashes]
+            if hashes and all(matches):
+                duplicates.append(Duplicate(attachment.filename, ", ".join(dict.fromkeys(matches)), exact=False))
+                continue
+            if any(matches):
+                numbers = range(len(hashes)) if attachment.pages is None else attachment.pages
+                duplicates.extend(Duplicate(attachment.filename, match, exact=False, page=number)
+                                  for number, match in zip(numbers, matches) if match)
+                attachment = replace(attachment, pages=tuple(
+                    number for number, match in zip(numbers, matches) if not match
+                ))
+                hashes = [page for page, match in zip(hashes, matches) if not match]
+            pages.extend((page, attachment.filename) for page in hashes)
+        originals[key] = attachment.filename
+        kept.append(attachment)
+    return kept, duplicates
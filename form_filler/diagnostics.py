@@ -0,0 +1,270 @@
+"""Per-stage timing for package builds.
+
+The engine wraps each pipeline stage (template open, field filling,
+appearance generation, image conversion, ``insert_pdf``, the final save) in
+:func:`stage`. While a :func:`tracing` block is active those stages are
+recorded in its :class:`Trace` with their duration and, where known, byte
+size and page count; outside one, :func:`stage` only costs a clock read.
+Inside a :func:`stage_hook` block a callback also runs as each stage starts,
+which is how a queued build notices it was cancelled.
+
+Finished traces can be written as JSON log lines (:func:`log_trace`) and
+folded into the process-wide Prometheus counters and histograms in
+:data:`METRICS`. :func:`profiled` captures a cProfile of a single call.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger("form_filler.diagnostics")
+
+_active = contextvars.ContextVar("form_filler_trace", default=None)
+_hook = contextvars.ContextVar("form_filler_stage_hook", default=None)
+
+
+@dataclass(slots=True)
+class Span:
+    """One timed stage."""
+    stage: str
+    seconds: float = 0.0
+    bytes: Optional[int] = None
+    pages: Optional[int] = None
+    detail: str = ""
+
+
+class Trace:
+    """Stages and counts recorded during one build."""
+
+    def __init__(self):
+        self.spans = []
+        self.counts = {}
+        self.started = time.time()
+        self.seconds = 0.0
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self) -> list[dict]:
+        """Spans grouped by stage in first-seen order, with totals."""
+        rows = {}
+        for span in self.spans:
+            row = rows.setdefault(span.stage, {"stage": span.stage, "calls": 0, "seconds": 0.0,
+                                               "bytes": None, "pages": None})
+            row["calls"] += 1
+            row["seconds"] += span.seconds
+            for key in ("bytes", "pages"):
+                value = getattr(span, key)
+                if value is not None:
+                    row[key] = (row[key] or 0) + value
+        return list(rows.values())
+
+
+@contextmanager
+def tracing():
+    """Record stages into a :class:`Trace` for the duration of the block.
+
+    Nested blocks share the outermost trace.
+    """
+    trace = _active.get()
+    if trace is not None:
+        yield trace
+        return
+    trace = Trace()
+    token = _active.set(trace)
+    started = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.seconds = time.perf_counter() - started
+        _active.reset(token)
+
+
+@contextmanager
+def stage_hook(hook: Callable[[str], None]):
+    """Call ``hook(stage name)`` as each :func:`stage` in the block starts.
+
+    An exception raised by the hook aborts the stage and propagates.
+    """
+    token = _hook.set(hook)
+    try:
+        yield
+    finally:
+        _hook.reset(token)
+
+
+@contextmanager
+def stage(name: str, detail: str = ""):
+    """Time the block as stage ``name``; set ``bytes``/``pages`` on the yielded span."""
+    hook = _hook.get()
+    if hook is not None:
+        hook(name)
+    span = Span(name, detail=detail)
+    started = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.seconds = time.perf_counter() - started
+        trace = _active.get()
+        if trace is not None:
+            trace.spans.append(span)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add ``n`` to a counter on the active trace, if any."""
+    trace = _active.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def log_trace(trace: Trace, **context) -> None:
+    """Log one JSON line per stage and one for the whole build.
+
+    ``context`` (a job id, say) is added to every line.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    for span in trace.spans:
+        logger.info(json.dumps({"event": "stage", **context, **asdict(span)}))
+    logger.info(json.dumps({
+        "event": "build", **context, "started": trace.started,
+        "seconds": trace.seconds, "counts": trace.counts,
+    }))
+
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def enable_json_log(path: Optional[str] = None) -> logging.Handler:
+    """Send the diagnostics log to ``path`` (stderr if None), one JSON object per line.
+
+    Calling it again with the same path returns the existing handler, so
+    scripts that rerun (Streamlit) do not duplicate lines.
+    """
+    with _handlers_lock:
+        if path not in _handlers:
+            handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            _handlers[path] = handler
+        return _handlers[path]
+
+
+# Upper bounds in seconds; +Inf is implied
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_HELP = {
+    "form_filler_builds_total": ("counter", "Package builds by final status."),
+    "form_filler_build_seconds": ("histogram", "Wall time of whole package builds."),
+    "form_filler_stage_seconds": ("histogram", "Wall time of each pipeline stage."),
+    "form_filler_stage_bytes_total": ("counter", "Bytes produced by each pipeline stage."),
+    "form_filler_stage_pages_total": ("counter", "Pages handled by each pipeline stage."),
+    "form_filler_items_total": ("counter", "Forms, attachments and cache hits seen by builds."),
+}
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """Thread-safe Prometheus-style counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                # Per-bucket hits (made cumulative when rendered), sum, count
+                entry = self._histograms[key] = [[0] * len(_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(_BUCKETS):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def record(self, trace: Trace, status: str = "done") -> None:
+        """Fold a finished build's trace into the metrics."""
+        self.inc("form_filler_builds_total", status=status)
+        self.observe("form_filler_build_seconds", trace.seconds)
+        for span in trace.spans:
+            self.observe("form_filler_stage_seconds", span.seconds, stage=span.stage)
+            if span.bytes is not None:
+                self.inc("form_filler_stage_bytes_total", span.bytes, stage=span.stage)
+            if span.pages is not None:
+                self.inc("form_filler_stage_pages_total", span.pages, stage=span.stage)
+        for name, n in trace.counts.items():
+            self.inc("form_filler_items_total", n, item=name)
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(buckets), total, n) for key, (buckets, total, n) in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text) in _HELP.items():
+            series = counters if kind == "counter" else histograms
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key in keys:
+                labels = key[1]
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(labels)} {series[key]:g}")
+                    continue
+                buckets, total, n = series[key]
+                cumulative = 0
+                for bound, hits in zip(_BUCKETS, buckets):
+                    cumulative += hits
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {n}")
+                lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_labels(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def profiled(call: Callable, *args, limit: int = 40, **kwargs):
+    """Run ``call`` under cProfile; return ``(result, text report, .prof bytes)``.
+
+    The report lists the ``limit`` most expensive functions by cumulative
+    time; the ``.prof`` bytes load in ``pstats`` or snakeviz.
+    """
+    profile = cProfile.Profile()
+    result = profile.runcall(call, *args, **kwargs)
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(limit)
+    fd, path = tempfile.mkstemp(suffix=".prof")
+    os.close(fd)
+    try:
+        profile.dump_stats(path)
+        with open(path, "rb") as f:
+            data = f.read()
+    finally:
+        os.remove(path)
+    return result, report.getvalue(), data
@@ -0,0 +1,457 @@
+"""Fill the finance forms and assemble the merged PDF package.
+
+Every entry point takes the typed models from :mod:`form_filler.models`, so
+the Streamlit app, the batch runner and benchmarks share one code path.
+"""
+import io
+from itertools import groupby
+from typing import Callable, Iterable, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from .cache import StageCache, content_key
+from .continuation import (
+    COVER_SHEET_TABLE, NON_TRAVEL_TABLE,
+    TRAVEL_INCIDENTALS_TABLE, TRAVEL_LODGING_TABLE, TRAVEL_MEALS_TABLE, TRAVEL_TRANSPORTATION_TABLE,
+    add_continuation_sheets,
+)
+from .diagnostics import count, stage, tracing
+from .fields import (
+    COVER_SHEET_FIELDS, COVER_SHEET_ITEM_FIELDS,
+    NON_TRAVEL_FIELDS, NON_TRAVEL_ITEM_FIELDS,
+    TRAVEL_FIELDS,
+    build_field_index, fill_fields, finish_fields, flatten_fields, map_fields, map_rows,
+)
+from .ledger import format_cents, form_totals
+from .models import ACCOUNT_NUMBERS, Attachment, CoverSheet, NonTravelReport, PackageForms, TravelReport
+from .nup import nup_page, nup_stage_key, pack_receipts
+from .options import NupOptions
+from .output import save_pdf
+from .templates import COVER_SHEET_PDF, NON_TRAVEL_PDF, TRAVEL_PDF, get_template
+
+FORM_KEYS = ("cover_sheet", "non_travel", "travel")
+FORM_TITLES = {
+    "cover_sheet": "Form 1: Expense Cover Sheet",
+    "non_travel": "Form 2: Non-Travel Expense Report",
+    "travel": "Form 3: Travel Expense Report",
+}
+
+
+def _open_template(filename, appearance):
+    with stage("template.open", filename) as span:
+        template = get_template(filename)
+        doc = template.open()
+        span.bytes = len(template.data)
+        span.pages = doc.page_count
+    with stage("template.index", filename):
+        return doc, build_field_index(doc, template.fields, appearance)
+
+
+def _fill_cover_sheet(data: CoverSheet, appearance: str) -> fitz.Document:
+    values = {
+        "club_name": data.club_name,
+        "date_submitted": data.date_submitted,
+        "submitter_name": data.submitter_name,
+        "submitter_phone": data.submitter_phone,
+        "submitter_email": data.submitter_email,
+        "preferred_date": data.preferred_date,
+        "account_number": data.account_number or ACCOUNT_NUMBERS[data.account_type],
+        "short_title": data.short_title,
+        "total_amount": data.total_amount,
+        "expense_purpose": data.expense_purpose,
+        "payable_to": data.payable_to,
+        "student_id": data.student_id,
+        "relationship": data.relationship,
+        "other_entity": data.other_entity,
+        "address_1": data.address_1,
+        "address_2": data.address_2,
+        "contact_number": data.contact_number,
+        "contact_email": data.contact_email,
+        # Checkboxes
+        "account_credit_union": data.account_type == "Credit Union",
+        "account_rcc": data.account_type == "RCC",
+        "account_gift": data.account_type == "Gift",
+        "cu_pay_ahead": data.expense_type == "Pay Ahead",
+        "rcc_purchase_order": data.expense_type == "Purchase Order",
+        "rcc_requisition": data.expense_type == "Requisition",
+        "rcc_credit_card": data.expense_type == "Credit Card",
+        "entity_student": data.entity_type == "Student",
+        "entity_company": data.entity_type == "Company / Organization",
+        # Radio button on-states are Yes / No / NA
+        "pickup_check": "NA" if data.pickup_check == "N/A" else data.pickup_check,
+    }
+    # Each account type has its own "Reimbursement" checkbox
+    if data.account_type == "Credit Union":
+        values["cu_reimbursement"] = data.expense_type == "Reimbursement"
+    else:
+        values["rcc_reimbursement"] = data.expense_type == "Reimbursement"
+
+    totals = form_totals("cover_sheet", data)
+    doc, index = _open_template(COVER_SHEET_PDF, appearance)
+    with stage("fields.set", COVER_SHEET_PDF):
+        # Page 2 - Reimbursement items
+        if data.items:
+            values["total_reimbursement"] = format_cents(totals.grand_total)
+            fill_fields(index, map_rows(COVER_SHEET_ITEM_FIELDS, data.items[:COVER_SHEET_TABLE.max_rows]))
+        fill_fields(index, map_fields(COVER_SHEET_FIELDS, values))
+    with stage("fields.appearance", COVER_SHEET_PDF):
+        finish_fields(index)
+    add_continuation_sheets(doc, index, [(COVER_SHEET_TABLE, data.items, totals.ledgers["items"])], COVER_SHEET_PDF,
+                            FORM_TITLES["cover_sheet"])
+    return doc
+
+
+def _fill_non_travel(data: NonTravelReport, appearance: str) -> fitz.Document:
+    totals = form_totals("non_travel", data)
+    doc, index = _open_template(NON_TRAVEL_PDF, appearance)
+    with stage("fields.set", NON_TRAVEL_PDF):
+        fill_fields(index, map_fields(NON_TRAVEL_FIELDS, {
+            "department": data.department,
+            "account": data.account,
+            "check_request": data.check_request,
+            "business_purpose": data.business_purpose,
+            "total_reimbursement": format_cents(totals.grand_total),
+            "reimbursee_sig_date": data.reimbursee_sig_date,
+        }))
+        fill_fields(index, map_rows(NON_TRAVEL_ITEM_FIELDS, data.items[:NON_TRAVEL_TABLE.max_rows]))
+    with stage("fields.appearance", NON_TRAVEL_PDF):
+        finish_fields(index)
+    add_continuation_sheets(doc, index, [(NON_TRAVEL_TABLE, data.items, totals.ledgers["items"])], NON_TRAVEL_PDF,
+                            FORM_TITLES["non_travel"])
+    return doc
+
+
+def _fill_travel(data: TravelReport, appearance: str) -> fitz.Document:
+    totals = form_totals("travel", data)
+    amounts = {name: format_cents(cents) for name, cents in totals.totals.items()}
+    gu_amounts = {name: format_cents(cents) for name, cents in totals.gu_totals.items()}
+    sections = [
+        (table, getattr(data, name), totals.ledgers[name])
+        for table, name in (
+            (TRAVEL_INCIDENTALS_TABLE, "incidentals"),
+            (TRAVEL_TRANSPORTATION_TABLE, "transportation"),
+            (TRAVEL_LODGING_TABLE, "lodging"),
+            (TRAVEL_MEALS_TABLE, "meals"),
+        )
+    ]
+
+    doc, index = _open_template(TRAVEL_PDF, appearance)
+    with stage("fields.set", TRAVEL_PDF):
+        fill_fields(index, map_fields(TRAVEL_FIELDS, {
+            "reimbursee_name": data.reimbursee_name,
+            "department": data.department,
+            "account": data.account,
+            "check_request": data.check_request,
+            "destination": data.destination,
+            "period_covered": data.period_covered,
+            "business_purpose": data.business_purpose,
+            "incidentals_total": amounts["incidentals"],
+            "incidentals_gu_total": gu_amounts["incidentals"],
+            "incidentals_boxed_total": amounts["incidentals"],
+            "transportation_total": amounts["transportation"],
+            "transportation_gu_total": gu_amounts["transportation"],
+            "transportation_boxed_total": amounts["transportation"],
+            "lodging_total": amounts["lodging"],
+            "meals_total": amounts["meals"],
+            "meals_gu_total": gu_amounts["meals"],
+            "meals_boxed_total": amounts["meals"],
+            "total_expenditure": format_cents(totals.grand_total),
+        }))
+        for table, items, _ in sections:
+            fill_fields(index, map_rows(table.row_map, items[:table.max_rows]))
+    with stage("fields.appearance", TRAVEL_PDF):
+        finish_fields(index)
+    add_continuation_sheets(doc, index, sections, TRAVEL_PDF, FORM_TITLES["travel"])
+    return doc
+
+
+_FILLERS = {
+    "cover_sheet": _fill_cover_sheet,
+    "non_travel": _fill_non_travel,
+    "travel": _fill_travel,
+}
+_TEMPLATES = {
+    "cover_sheet": COVER_SHEET_PDF,
+    "non_travel": NON_TRAVEL_PDF,
+    "travel": TRAVEL_PDF,
+}
+
+
+def _fill_form(key: str, data, appearance: str, flatten: bool = False) -> fitz.Document:
+    if flatten and appearance == "need_appearances":
+        # Flattening draws the stored appearances, so they have to be built
+        appearance = "bulk"
+    doc = _FILLERS[key](data, appearance)
+    if flatten:
+        with stage("fields.flatten", _TEMPLATES[key]) as span:
+            flatten_fields(doc)
+            span.pages = doc.page_count
+    return doc
+
+
+def _to_bytes(doc: fitz.Document) -> bytes:
+    try:
+        with stage("form.serialize") as span:
+            data = doc.tobytes()
+            span.bytes = len(data)
+        return data
+    finally:
+        doc.close()
+
+
+def fill_cover_sheet(data: CoverSheet, appearance: str = "bulk", flatten: bool = False) -> bytes:
+    """Fill the Expense Cover Sheet and return it as PDF bytes.
+
+    ``appearance`` is one of :data:`APPEARANCE_MODES`; ``flatten`` turns the
+    filled fields into static page content (see :func:`flatten_fields`).
+    """
+    return _to_bytes(_fill_form("cover_sheet", data, appearance, flatten))
+
+
+def fill_non_travel(data: NonTravelReport, appearance: str = "bulk", flatten: bool = False) -> bytes:
+    """Fill the Non-Travel Expense Report and return it as PDF bytes."""
+    return _to_bytes(_fill_form("non_travel", data, appearance, flatten))
+
+
+def fill_travel(data: TravelReport, appearance: str = "bulk", flatten: bool = False) -> bytes:
+    """Fill the Travel Expense Report and return it as PDF bytes."""
+    return _to_bytes(_fill_form("travel", data, appearance, flatten))
+
+
+def append_image(output_pdf: fitz.Document, data: bytes, dpi: Optional[int] = None) -> None:
+    """Place an image on a new page sized to its pixels at ``dpi`` (default 72).
+
+    The encoded image is handed straight to MuPDF, so JPEGs are embedded
+    without re-encoding and nothing is decoded just to build a throwaway PDF.
+    Only the header is read (lazily, by PIL) to size the page.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+    scale = 72 / (dpi or 72)
+    page = output_pdf.new_page(width=width * scale, height=height * scale)
+    page.insert_image(page.rect, stream=data)
+
+
+def image_page(attachment: Attachment) -> bytes:
+    """Convert an image attachment into a one-page PDF."""
+    with stage("image.convert", attachment.filename) as span, fitz.open() as doc:
+        append_image(doc, attachment.read(), attachment.dpi)
+        data = doc.tobytes(deflate_images=True)
+        span.bytes = len(data)
+        span.pages = 1
+        return data
+
+
+def form_stage_key(key: str, data, appearance: str = "bulk", flatten: bool = False) -> str:
+    """Cache key for a filled form: its inputs plus the template's content hash."""
+    return content_key("form", key, appearance, flatten, get_template(_TEMPLATES[key]).digest, data)
+
+
+def attachment_stage_key(attachment: Attachment) -> str:
+    return content_key("attachment", attachment.file_type, attachment.dpi, attachment.read())
+
+
+def open_attachment_pdf(attachment: Attachment) -> fitz.Document:
+    """Open a PDF attachment, straight from disk when it is spooled."""
+    if attachment.path is not None:
+        return fitz.open(attachment.path, filetype="pdf")
+    return fitz.open(stream=attachment.data, filetype="pdf")
+
+
+def select_pages(pdf_doc: fitz.Document, attachment: Attachment) -> None:
+    """Reduce ``pdf_doc`` to the attachment's selected pages, if it has a selection.
+
+    Only the page tree is rewritten; the pages left out are never loaded, and
+    ``insert_pdf`` then copies just the objects the selected pages use.
+    """
+    if attachment.pages is None:
+        return
+    if max(attachment.pages) >= pdf_doc.page_count:
+        raise ValueError(f"{attachment.filename} has {pdf_doc.page_count} pages; "
+                         f"page {max(attachment.pages) + 1} was selected")
+    pdf_doc.select(list(attachment.pages))
+
+
+def append_attachment(output_pdf: fitz.Document, attachment: Attachment) -> None:
+    """Append one supporting document (PDF or image) to ``output_pdf``.
+
+    Of a PDF only ``attachment.pages`` are added when it has a selection.
+    """
+    with stage("attachment.append", attachment.filename) as span:
+        pages = output_pdf.page_count
+        if attachment.file_type == 'pdf':
+            with open_attachment_pdf(attachment) as pdf_doc:
+                select_pages(pdf_doc, attachment)
+                output_pdf.insert_pdf(pdf_doc)
+        elif attachment.is_image:
+            append_image(output_pdf, attachment.read(), attachment.dpi)
+        else:
+            raise ValueError(f"Unsupported attachment type: {attachment.filename}")
+        span.bytes = attachment.size
+        span.pages = output_pdf.page_count - pages
+
+
+def _insert_bytes(output_pdf, pdf_bytes):
+    with stage("merge.insert_pdf") as span, fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        output_pdf.insert_pdf(doc)
+        span.bytes = len(pdf_bytes)
+        span.pages = doc.page_count
+
+
+def assemble_package(
+    output_pdf: fitz.Document,
+    forms: PackageForms,
+    attachments: list[Attachment],
+    progress: Optional[Callable[[str], None]] = None,
+    cache: Optional[StageCache] = None,
+    appearance: str = "bulk",
+    rebuilt: Optional[list] = None,
+    checkpoint: Optional[Callable[[fitz.Document, int], fitz.Document]] = None,
+    nup: Optional[NupOptions] = None,
+    flatten: bool = False,
+) -> fitz.Document:
+    """Append every stage of the package to ``output_pdf``.
+
+    With ``flatten`` the filled forms are merged as static pages, without
+    form fields. With ``nup``, each run of consecutive image attachments is packed
+    several to a page (see :mod:`form_filler.nup`) instead of one per page.
+
+    Stage names not served from ``cache`` are added to ``rebuilt``. After
+    each stage ``checkpoint``, if given, is called with the document and the
+    approximate number of bytes just added; it returns the document to keep
+    appending to, which lets a caller flush to disk and reopen. Returns the
+    final document.
+    """
+    rebuilt = [] if rebuilt is None else rebuilt
+
+    def added(doc, size):
+        return doc if checkpoint is None else checkpoint(doc, size)
+
+    for key in FORM_KEYS:
+        data = getattr(forms, key)
+        if data is None:
+            continue
+        if progress:
+            progress(f"Processing {FORM_TITLES[key]}...")
+        count("forms")
+        if cache is None:
+            rebuilt.append(key)
+            doc = _fill_form(key, data, appearance, flatten)
+            with stage("merge.insert_pdf", key) as span:
+                output_pdf.insert_pdf(doc)
+                span.pages = doc.page_count
+            doc.close()
+            # The form is not serialized here; its template's size stands in for what it added
+            output_pdf = added(output_pdf, len(get_template(_TEMPLATES[key]).data))
+            continue
+
+        def fill(key=key, data=data):
+            rebuilt.append(key)
+            return _to_bytes(_fill_form(key, data, appearance, flatten))
+
+        pdf_bytes = cache.get_or_build(form_stage_key(key, data, appearance, flatten), fill)
+        _insert_bytes(output_pdf, pdf_bytes)
+        output_pdf = added(output_pdf, len(pdf_bytes))
+
+    if appearance == "need_appearances" and not flatten and output_pdf.page_count:
+        # insert_pdf does not carry the flag over from the filled forms
+        output_pdf.need_appearances(True)
+
+    if attachments:
+        if progress:
+            progress(f"Adding {len(attachments)} supporting documents...")
+        count("attachments", len(attachments))
+        for packed, run in groupby(attachments, key=lambda a: nup is not None and a.is_image):
+            if packed:
+                output_pdf = _append_receipts(output_pdf, list(run), nup, cache, rebuilt, added)
+                continue
+            output_pdf = _append_attachments(output_pdf, run, cache, rebuilt, added)
+
+    count("pages", output_pdf.page_count)
+    return output_pdf
+
+
+def _append_attachments(output_pdf, attachments, cache, rebuilt, added):
+    """One page per image, every page of each PDF."""
+    for attachment in attachments:
+        if cache is None or not attachment.is_image:
+            if attachment.is_image:
+                rebuilt.append(attachment.filename)
+            append_attachment(output_pdf, attachment)
+            output_pdf = added(output_pdf, attachment.size)
+            continue
+
+        def convert(attachment=attachment):
+            rebuilt.append(attachment.filename)
+            return image_page(attachment)
+
+        pdf_bytes = cache.get_or_build(attachment_stage_key(attachment), convert)
+        _insert_bytes(output_pdf, pdf_bytes)
+        output_pdf = added(output_pdf, len(pdf_bytes))
+    return output_pdf
+
+
+def _append_receipts(output_pdf, images, nup, cache, rebuilt, added):
+    """Image attachments packed several to a page, one cached stage per page."""
+    with stage("image.pack", f"{len(images)} receipts") as span:
+        sheets = pack_receipts(images, nup)
+        span.pages = len(sheets)
+    for sheet in sheets:
+        def render(sheet=sheet):
+            rebuilt.extend(attachment.filename for attachment, _ in sheet)
+            return nup_page(sheet, nup)
+
+        pdf_bytes = render() if cache is None else cache.get_or_build(nup_stage_key(sheet, nup), render)
+        _insert_bytes(output_pdf, pdf_bytes)
+        output_pdf = added(output_pdf, len(pdf_bytes))
+    return output_pdf
+
+
+def build_package(
+    forms: PackageForms,
+    attachments: Iterable[Attachment] = (),
+    progress: Optional[Callable[[str], None]] = None,
+    profile: str = "fast",
+    stats: Optional[dict] = None,
+    cache: Optional[StageCache] = None,
+    appearance: str = "bulk",
+    nup: Optional[NupOptions] = None,
+    flatten: bool = False,
+) -> bytes:
+    """Fill the selected forms, append attachments and return the PDF bytes.
+
+    Forms are always emitted in cover sheet, non-travel, travel order.
+    ``progress``, if given, is called with a short status message per stage.
+    ``profile`` names an output profile from :data:`OUTPUT_PROFILES`; when a
+    ``stats`` dict is passed, its ``"output"`` entry receives the
+    :class:`OutputReport` for the final save and ``"rebuilt"`` lists the
+    stages that were not served from ``cache``.
+
+    With a :class:`StageCache`, each filled form and each image page is
+    stored under a hash of its inputs and reused on the next build, so a
+    regeneration only redoes the stages that changed.
+
+    ``appearance`` selects how field appearances are built (see
+    :data:`APPEARANCE_MODES`); ``flatten`` merges the filled forms as
+    static pages without form fields, which makes the package smaller,
+    quicker to render and free of field-name clashes between templates;
+    ``nup`` packs image attachments several to a page.
+
+    ``stats["trace"]`` receives the per-stage :class:`~form_filler.diagnostics.Trace`.
+    """
+    rebuilt = []
+    output_pdf = fitz.open()
+    try:
+        with tracing() as trace:
+            output_pdf = assemble_package(
+                output_pdf, forms, list(attachments), progress, cache, appearance, rebuilt, nup=nup, flatten=flatten,
+            )
+            pdf_bytes, report = save_pdf(output_pdf, profile)
+        if stats is not None:
+            stats["output"] = report
+            stats["rebuilt"] = rebuilt
+            stats["trace"] = trace
+        return pdf_bytes
+    finally:
+        output_pdf.close()
@@ -0,0 +1,293 @@
+"""Declarative field maps for the USC finance form templates.
+
+Each form is described by a map of logical keys to PDF field names, plus a
+row map for its repeating line items (``{}`` is replaced by the 1-based row
+number). Filling builds one ``field name -> widgets`` index per document, from
+the template's schema manifest, and then sets every value with a single
+dictionary lookup. PyMuPDF widget objects are costly to create, so the index
+loads one by xref only when its appearance has to be rebuilt.
+
+How appearance streams are produced is chosen per index:
+
+``per_field``         ``widget.update()`` right after every assignment.
+``bulk``              collect all values, then one pass per page that
+                      regenerates only widgets whose value actually changed.
+``need_appearances``  write ``/V`` (and ``/AS`` for buttons) straight into the
+                      field dictionaries and set the AcroForm NeedAppearances
+                      flag so the viewer draws the text fields.
+
+A filled form can then be flattened (:func:`flatten_fields`): every widget's
+appearance becomes ordinary page content and the form fields are removed.
+"""
+import fitz  # PyMuPDF
+
+from .options import APPEARANCE_MODES
+from .schema import scan_widgets
+
+# ---------- Form 1: Expense Cover Sheet ----------
+COVER_SHEET_FIELDS = {
+    # Text fields
+    "club_name": "Club Name",
+    "date_submitted": "Date Submitted",
+    "submitter_name": "Submitter Name",
+    "submitter_phone": "Submitter Phone",
+    "submitter_email": "Submitter Email",
+    "preferred_date": "Preferred Date to be Completed not guaranteed",
+    "account_number": "Account Number",
+    "short_title": "Short Title",
+    "total_amount": "Total Dollar Amount",
+    "expense_purpose": "Expense Purpose and Summary who what where when why 1",
+    "payable_to": "Payable To",
+    "student_id": "Student ID",
+    "relationship": "Family Member of Student Relationship",
+    "other_entity": "Other",
+    "address_1": "Address Street Address AptSte  City State Zip Code 1",
+    "address_2": "Address Street Address AptSte  City State Zip Code 2",
+    "contact_number": "Contact Number",
+    "contact_email": "Contact Email",
+    # Account type checkboxes
+    "account_credit_union": "Credit Union",
+    "account_rcc": "RCC",
+    "account_gift": "Gift",
+    # Expense type checkboxes (Credit Union column, then RCC/Gift column)
+    "cu_reimbursement": "Reimbursement",
+    "cu_pay_ahead": "Pay Ahead",
+    "rcc_reimbursement": "Reimbursement_2",
+    "rcc_purchase_order": "Purchase Order",
+    "rcc_requisition": "Requisition",
+    "rcc_credit_card": "Credit Card",
+    # Entity type checkboxes
+    "entity_student": "Is the above entity a",
+    "entity_company": "Company  Organization",
+    # Radio group; the value is the on-state of the button to select
+    "pickup_check": "If RCC or Gift Reimbursement pick up check",
+    # Page 2 total
+    "total_reimbursement": "Total Item AmountTotal Reimbursement Amount",
+}
+COVER_SHEET_ITEM_FIELDS = {
+    "desc": "Description{}",
+    "qty": "Quantity{}",
+    "amt": "Total Item Amount{}",
+}
+COVER_SHEET_MAX_ITEMS = 10
+
+# ---------- Form 2: Non-Travel Expense Report ----------
+NON_TRAVEL_FIELDS = {
+    "department": "nter-dept",
+    "account": "nter-acct",
+    "check_request": "nter-crq-no",
+    "business_purpose": "nter-purpose",
+    "total_reimbursement": "tot-amt",
+    "reimbursee_sig_date": "Text3",
+}
+NON_TRAVEL_ITEM_FIELDS = {
+    "date": "nter-dt{}",
+    "desc": "nter-desc{}",
+    "qty": "nter-qty{}",
+    "amt": "nter-amt{}",
+    "gu_amt": "nter-unall-amt{}",
+}
+NON_TRAVEL_MAX_ITEMS = 16
+
+# ---------- Form 3: Travel Expense Report ----------
+TRAVEL_FIELDS = {
+    "reimbursee_name": "ter-reimburseename",
+    "department": "ter-dept",
+    "account": "ter-acct",
+    "check_request": "ter-cr",
+    "destination": "ter-dest",
+    "period_covered": "ter-travel-pd",
+    "business_purpose": "ter-prupose",
+    # Section subtotals and boxed totals
+    "incidentals_total": "tot-inc",
+    "incidentals_gu_total": "tot-inc-gu",
+    "incidentals_boxed_total": "ter-inc-total",
+    "transportation_total": "tot-tr",
+    "transportation_gu_total": "tot-tr-gu",
+    "transportation_boxed_total": "ter-tr-total",
+    "lodging_total": "tot-hotel",
+    "meals_total": "tot-meals-temp",
+    "meals_gu_total": "tot-meals-gu",
+    "meals_boxed_total": "ter-meals-total",
+    "total_expenditure": "tot-travel-reimb",
+}
+TRAVEL_INCIDENTAL_FIELDS = {
+    "date": "ter-inc-dt{}",
+    "desc": "ter-inc-desc{}",
+    "amt": "ter-inc-amt{}",
+    "gu_amt": "ter-inc-gu-amt{}",
+}
+TRAVEL_TRANSPORTATION_FIELDS = {
+    "type": "ter-tr-type{}",
+    "company": "ter-tr-co{}",
+    "date": "ter-tr-dt{}",
+    "amt": "ter-tr-amt{}",
+    "gu_amt": "ter-tr-gu-amt{}",
+}
+TRAVEL_LODGING_FIELDS = {
+    "hotel": "ter-flr-hotel{}",
+    "from_date": "ter-flr-dt{}",
+    "to_date": "ter-flr-todt{}",
+    "days": "ter-flr-days{}",
+    "rate": "ter-flr-rate{}",
+    "amt": "ter-flr-amt{}",
+}
+TRAVEL_MEAL_FIELDS = {
+    "date": "ter-meals-dt{}",
+    "breakfast": "ter-ml-bf{}",
+    "lunch": "ter-ml-lun{}",
+    "dinner": "ter-ml-dinr{}",
+    "gu": "ter-ml-gu{}",
+}
+TRAVEL_MAX_INCIDENTALS = 4
+TRAVEL_MAX_TRANSPORTATION = 3
+TRAVEL_MAX_LODGING = 3
+TRAVEL_MAX_MEALS = 4
+
+
+class FieldIndex(dict):
+    """``field name -> [FieldSpec]`` for one document, with widgets on demand.
+
+    PyMuPDF widgets are only valid while their page object is alive, so the
+    index holds on to the pages it loads widgets from.
+    """
+
+    def __init__(self, doc, fields, mode="bulk"):
+        if mode not in APPEARANCE_MODES:
+            raise ValueError(f"Unknown appearance mode: {mode}")
+        super().__init__(fields)
+        self.doc = doc
+        self.mode = mode
+        # (spec, widget, value) triples waiting for finish_fields in bulk mode
+        self.pending = []
+        self.pages = {}
+        self._widgets = {}
+
+    def widget(self, spec):
+        """The document's widget for ``spec``, loaded by xref on first use."""
+        widget = self._widgets.get(spec.xref)
+        if widget is None:
+            page = self.pages.get(spec.page)
+            if page is None:
+                page = self.pages[spec.page] = self.doc[spec.page]
+            widget = self._widgets[spec.xref] = page.load_widget(spec.xref)
+        return widget
+
+
+def build_field_index(doc, fields=None, mode="bulk"):
+    """Index ``doc``'s fields by name.
+
+    ``fields`` is the ``field name -> [FieldSpec]`` map of the template the
+    document was opened from (:attr:`Template.fields`); without it the
+    document's widgets are scanned. ``mode`` is one of
+    :data:`APPEARANCE_MODES`.
+    """
+    if fields is None:
+        fields = {}
+        for spec in scan_widgets(doc):
+            fields.setdefault(spec.name, []).append(spec)
+    return FieldIndex(doc, fields, mode)
+
+
+def map_fields(field_map, values):
+    """Translate ``{logical key: value}`` into ``{PDF field name: value}``."""
+    return {field_map[key]: value for key, value in values.items()}
+
+
+def map_rows(row_map, items):
+    """Translate line items into ``{PDF field name: value}`` for rows 1..n."""
+    mapped = {}
+    for row, item in enumerate(items, start=1):
+        for key, pattern in row_map.items():
+            mapped[pattern.format(row)] = getattr(item, key)
+    return mapped
+
+
+def fill_fields(index, values):
+    """Set each ``{PDF field name: value}`` pair through ``index``.
+
+    Names missing from the template are skipped. For radio groups the value
+    selects the button whose on-state matches it. Outside ``per_field`` mode
+    call :func:`finish_fields` once all values are set.
+    """
+    for field_name, value in values.items():
+        for spec in index.get(field_name, ()):
+            if spec.field_type == fitz.PDF_WIDGET_TYPE_RADIOBUTTON:
+                if spec.on_state != value:
+                    continue
+            if index.mode == "per_field":
+                widget = index.widget(spec)
+                widget.field_value = value
+                widget.update()
+            elif index.mode == "bulk":
+                state = _button_state(spec, value)
+                # Already showing this value in the blank template
+                if spec.value == (value if state is None else state):
+                    continue
+                index.pending.append((spec, index.widget(spec), value))
+            else:
+                _write_value(index.doc, spec, value)
+
+
+def _button_state(spec, value):
+    if spec.field_type == fitz.PDF_WIDGET_TYPE_RADIOBUTTON:
+        return value
+    if spec.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+        return spec.on_state if value else "Off"
+    return None
+
+
+def _write_value(doc, spec, value):
+    """Store a value in the field dictionary without building appearances."""
+    state = _button_state(spec, value)
+    if state is None:
+        doc.xref_set_key(spec.xref, "V", fitz.get_pdf_str(str(value)))
+        # Drop the stale (blank) appearance so viewers must draw the value
+        doc.xref_set_key(spec.xref, "AP", "null")
+        return
+    kind, parent = doc.xref_get_key(spec.xref, "Parent")
+    # Radio kids share /V on their parent field; plain checkboxes carry it
+    if kind == "xref":
+        doc.xref_set_key(int(parent.split()[0]), "V", f"/{state}")
+    else:
+        doc.xref_set_key(spec.xref, "V", f"/{state}")
+    doc.xref_set_key(spec.xref, "AS", f"/{state}")
+
+
+def finish_fields(index):
+    """Complete a fill started with :func:`fill_fields`.
+
+    In ``bulk`` mode this is the single appearance pass, page by page, that
+    skips widgets already showing the requested value. In
+    ``need_appearances`` mode it sets the document's NeedAppearances flag.
+    """
+    if index.mode == "need_appearances":
+        index.doc.need_appearances(True)
+        return
+    if index.mode != "bulk":
+        return
+
+    by_page = {}
+    for spec, widget, value in index.pending:
+        by_page.setdefault(spec.page, []).append((spec, widget, value))
+    index.pending = []
+
+    for pno in sorted(by_page):
+        for spec, widget, value in by_page[pno]:
+            state = _button_state(spec, value)
+            if widget.field_value == (value if state is None else state):
+                continue
+            widget.field_value = value
+            widget.update()
+
+
+def flatten_fields(doc: fitz.Document) -> None:
+    """Draw every widget's appearance into its page and remove the form fields.
+
+    Checkboxes and radio buttons keep the appearance of their current state,
+    so the pages look as they did. The appearances must exist: a document
+    filled in ``need_appearances`` mode would have its text fields redrawn
+    by MuPDF in its own style. Unsigned signature fields are dropped along
+    with their "sign here" marker.
+    """
+    doc.bake(annots=False, widgets=True)
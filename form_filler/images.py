@@ -0,0 +1,163 @@
+"""Normalize receipt images before they go into the package.
+
+Phone photos arrive at 12+ megapixels. Each image is auto-rotated from its
+EXIF orientation, scaled down so it fits a letter page at the target DPI and
+re-encoded as JPEG (optionally grayscale). The result carries its DPI so the
+package page comes out at the printed size.
+"""
+import contextvars
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from PIL import Image, ImageOps
+
+from .cache import StageCache, content_key
+from .diagnostics import stage
+from .models import Attachment
+from .options import ImageOptions
+
+LETTER_INCHES = (8.5, 11.0)
+
+# EXIF orientations that rotate the image by 90 degrees
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass(slots=True)
+class ImageReport:
+    """What normalization did to one file."""
+    filename: str
+    original_bytes: int
+    normalized_bytes: int
+    width: int
+    height: int
+    seconds: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.normalized_bytes
+
+
+def _fit_box(width, height, dpi):
+    """Largest pixel box for a letter page at ``dpi``, matching orientation."""
+    short, long = (round(side * dpi) for side in LETTER_INCHES)
+    return (long, short) if width > height else (short, long)
+
+
+def _flatten(img, grayscale):
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, "white")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        img = background
+    return img.convert("L" if grayscale else "RGB")
+
+
+def normalize_image(attachment: Attachment, options: ImageOptions) -> tuple[Attachment, ImageReport]:
+    """Rotate, downscale and recompress one image attachment."""
+    with stage("image.normalize", attachment.filename) as span:
+        result, report = _normalize(attachment, options)
+        span.bytes = report.normalized_bytes
+        span.pages = 1
+    return result, report
+
+
+def _normalize(attachment, options):
+    started = time.perf_counter()
+    data = attachment.read()
+
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format
+        orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+        width, height = img.size
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        box = _fit_box(width, height, options.dpi)
+        shrink = width > box[0] or height > box[1]
+
+        if shrink and source_format == "JPEG":
+            # Let the JPEG decoder downscale by a power of two while decoding
+            draft_box = box[::-1] if orientation in _TRANSPOSED_ORIENTATIONS else box
+            img.draft("L" if options.grayscale else "RGB", draft_box)
+
+        out = ImageOps.exif_transpose(img)
+        if shrink:
+            out.thumbnail(box, Image.LANCZOS)
+        out = _flatten(out, options.grayscale)
+
+        buffer = io.BytesIO()
+        out.save(buffer, format="JPEG", quality=options.quality, optimize=True, dpi=(options.dpi, options.dpi))
+        normalized = buffer.getvalue()
+
+    dpi = options.dpi
+    unchanged = not shrink and orientation == 1 and not options.grayscale
+    if unchanged and len(normalized) >= len(data):
+        # Re-encoding bought nothing; keep the original stream at its own size
+        normalized, dpi = data, attachment.dpi
+
+    result = Attachment(attachment.filename, normalized, dpi=dpi)
+    report = ImageReport(
+        filename=attachment.filename,
+        original_bytes=len(data),
+        normalized_bytes=len(normalized),
+        width=out.width,
+        height=out.height,
+        seconds=time.perf_counter() - started,
+    )
+    return result, report
+
+
+def normalize_attachments(
+    attachments: Iterable[Attachment],
+    options: Optional[ImageOptions] = None,
+    cache: Optional[StageCache] = None,
+    spool=None,
+) -> tuple[list[Attachment], list[ImageReport]]:
+    """Normalize every image attachment; PDFs pass through untouched.
+
+    Returns the attachments in their original order plus one report per image.
+    With a ``cache``, images already normalized with the same settings are
+    reused instead of decoded again. With a ``spool``
+    (:class:`~form_filler.spool.SpoolDir`), each normalized image is written
+    to disk as soon as it is ready and returned as a spooled attachment, so
+    a disk-spooled build does not hold them all in memory.
+    """
+    options = options or ImageOptions()
+    attachments = list(attachments)
+    positions = [i for i, a in enumerate(attachments) if a.is_image]
+
+    def work(i):
+        normalized, report = normalize(i)
+        if spool is not None:
+            normalized = spool.spool(normalized.filename, normalized.data, normalized.dpi)
+        return normalized, report
+
+    def normalize(i):
+        if cache is None:
+            return normalize_image(attachments[i], options)
+        attachment = attachments[i]
+        key = content_key("image", options.dpi, options.quality, options.grayscale, attachment.read())
+        normalized, report = cache.get_or_build(
+            key,
+            lambda: normalize_image(attachment, options),
+            sizeof=lambda result: len(result[0].data),
+        )
+        # The same bytes may have been uploaded under another name
+        return Attachment(attachment.filename, normalized.data, normalized.dpi), report
+
+    if options.workers > 1 and len(positions) > 1:
+        # Run each task in a copy of this context so diagnostics reach the caller's trace
+        contexts = [contextvars.copy_context() for _ in positions]
+        with ThreadPoolExecutor(max_workers=options.workers) as pool:
+            results = list(pool.map(lambda context, i: context.run(work, i), contexts, positions))
+    else:
+        results = [work(i) for i in positions]
+
+    reports = []
+    for i, (attachment, report) in zip(positions, results):
+        attachments[i] = attachment
+        reports.append(report)
+    return attachments, reports
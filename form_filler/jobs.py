@@ -0,0 +1,336 @@
+"""Server-wide queue for package generation.
+
+Builds are queued first-in first-out and run by a fixed number of workers
+shared by every session, so a burst of submissions before a deadline waits
+its turn instead of running all at once. Each job has a status, a position
+while queued and can be cancelled; finished packages are kept in a size-bounded
+result cache keyed by job id until they are fetched or evicted.
+
+Workers are threads by default, which lets a job use its session's
+:class:`StageCache` and report progress. With ``processes=True`` each build
+runs in a process pool of the same size instead; jobs then cannot share
+caches and can only be cancelled before they start.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .cache import StageCache
+from .diagnostics import METRICS, log_trace, profiled, stage, stage_hook, tracing
+from .models import Attachment, PackageForms
+from .options import DEFAULT_MEMORY_LIMIT_MB, ImageOptions, NupOptions
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+DEFAULT_WORKERS = min(2, os.cpu_count() or 1)
+
+# Finished job records kept for status lookups (results are bounded separately)
+_MAX_FINISHED_JOBS = 1000
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when its cancellation is noticed."""
+
+
+@dataclass(slots=True)
+class PackageRequest:
+    """Everything needed to build one package away from the UI."""
+    forms: PackageForms
+    attachments: list[Attachment] = field(default_factory=list)
+    profile: str = "fast"
+    appearance: str = "bulk"
+    # Merge the filled forms as static pages without form fields
+    flatten: bool = False
+    # Normalize images first; None leaves them as uploaded
+    image_options: Optional[ImageOptions] = None
+    # Also leave out attachments that only look like earlier ones (exact copies always are)
+    near_duplicates: bool = False
+    # Pack image attachments several to a page; None gives each its own page
+    nup: Optional[NupOptions] = None
+    # Write the package here with disk-spooled assembly instead of returning bytes
+    output_path: Optional[str] = None
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB
+    # Run the build under cProfile; see generate_package
+    capture_profile: bool = False
+
+
+def generate_package(
+    request: PackageRequest,
+    cache: Optional[StageCache] = None,
+    progress: Optional[Callable[[str], None]] = None,
+) -> tuple[Optional[bytes], dict]:
+    """Normalize images and build the package described by ``request``.
+
+    Returns the PDF bytes (None when ``request.output_path`` is set) and the
+    build stats; ``stats["images"]`` holds the image normalization reports,
+    ``stats["duplicates"]`` the attachments left out as duplicates and
+    ``stats["trace"]`` the per-stage timings. With
+    ``request.capture_profile``, ``stats["profile"]`` holds a cProfile text
+    report and ``stats["profile_data"]`` the raw ``.prof`` bytes.
+    """
+    if request.capture_profile:
+        result, report, data = profiled(_generate, request, cache, progress)
+        result[1]["profile"] = report
+        result[1]["profile_data"] = data
+        return result
+    return _generate(request, cache, progress)
+
+
+def _generate(request, cache, progress):
+    with tracing() as trace:
+        pdf_bytes, stats = _build(request, cache, progress)
+    stats["trace"] = trace
+    return pdf_bytes, stats
+
+
+def _build(request, cache, progress):
+    # The build stack loads PyMuPDF and Pillow; a UI that only creates the
+    # queue and shows job status should not pay for that
+    from .dedupe import dedupe_attachments
+    from .engine import build_package
+    from .images import normalize_attachments
+    from .spool import SpoolDir, build_package_to_file
+
+    stats = {"images": []}
+    with stage("attachments.dedupe"):
+        attachments, stats["duplicates"] = dedupe_attachments(request.attachments, near=request.near_duplicates)
+
+    if request.output_path is not None:
+        # Disk-spooled builds keep the normalized images on disk as well
+        with SpoolDir() as work_dir:
+            if request.image_options is not None and attachments:
+                if progress:
+                    progress("Optimizing images...")
+                attachments, stats["images"] = normalize_attachments(attachments, request.image_options,
+                                                                     cache=cache, spool=work_dir)
+            build_package_to_file(
+                request.forms, attachments, request.output_path, request.memory_limit_mb,
+                progress=progress, profile=request.profile, stats=stats, cache=cache,
+                appearance=request.appearance, spool=work_dir, nup=request.nup, flatten=request.flatten,
+            )
+        return None, stats
+
+    if request.image_options is not None and attachments:
+        if progress:
+            progress("Optimizing images...")
+        attachments, stats["images"] = normalize_attachments(attachments, request.image_options, cache=cache)
+    pdf_bytes = build_package(
+        request.forms, attachments, progress=progress, profile=request.profile, stats=stats,
+        cache=cache, appearance=request.appearance, nup=request.nup, flatten=request.flatten,
+    )
+    return pdf_bytes, stats
+
+
+@dataclass(slots=True)
+class Job:
+    """Status of one queued build; read it, the queue updates it."""
+    id: str
+    status: str = "queued"
+    # Latest progress message from the build
+    message: str = ""
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    cancel_requested: bool = False
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def seconds(self) -> Optional[float]:
+        """Build time once the job has finished."""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class JobQueue:
+    """A FIFO of package builds served by ``workers`` workers.
+
+    ``result_cache_mb`` bounds the memory held by finished packages waiting
+    to be fetched; the oldest are dropped first. A package larger than the
+    whole cache fails its job; build it with ``output_path`` instead.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, processes: bool = False, result_cache_mb: int = 256):
+        self.workers = workers
+        self.processes = processes
+        self.results = StageCache(max_bytes=result_cache_mb * 1024 * 1024)
+        self._jobs = OrderedDict()
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pool = None
+        self._closed = False
+
+    def _start(self):
+        # Called with the lock held; workers are started on first use
+        if self._threads:
+            return
+        if self.processes:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"package-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, request: PackageRequest, cache: Optional[StageCache] = None) -> Job:
+        """Queue a build and return its :class:`Job` immediately."""
+        job = Job(uuid.uuid4().hex)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Job queue is shut down")
+            self._start()
+            self._jobs[job.id] = job
+            self._pending.append((job, request, cache))
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based place in line for a queued job, None once it has started."""
+        with self._cond:
+            for place, (job, _, _) in enumerate(self._pending, start=1):
+                if job.id == job_id:
+                    return place
+        return None
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> int:
+        return sum(1 for job in list(self._jobs.values()) if job.status == "running")
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; return False if it had already finished.
+
+        A queued job is dropped at once. A running thread job stops as its
+        next stage (a form, an attachment, a page) starts; a running process
+        job finishes but its result is thrown away.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            job.cancel_requested = True
+            for entry in self._pending:
+                if entry[0] is job:
+                    self._pending.remove(entry)
+                    self._finish(job, "cancelled")
+                    break
+        return True
+
+    def result(self, job_id: str) -> Optional[tuple[Optional[bytes], dict]]:
+        """``(pdf bytes, stats)`` of a finished job, or None if absent or evicted."""
+        return self.results.get(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Block until the job is no longer queued or running."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and job.active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return job
+
+    def shutdown(self) -> None:
+        """Cancel queued jobs and stop the workers after their current build."""
+        with self._cond:
+            self._closed = True
+            while self._pending:
+                self._finish(self._pending.popleft()[0], "cancelled")
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _finish(self, job, status, error=None):
+        # Called with the lock held
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        self._cond.notify_all()
+        finished = [key for key, j in self._jobs.items() if not j.active]
+        for key in finished[:max(0, len(finished) - _MAX_FINISHED_JOBS)]:
+            del self._jobs[key]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                job, request, cache = self._pending.popleft()
+                job.status = "running"
+                job.started = time.time()
+
+            def check_cancelled(_stage=None, job=job):
+                if job.cancel_requested:
+                    raise JobCancelled()
+
+            def progress(message, job=job):
+                check_cancelled()
+                job.message = message
+
+            try:
+                if self._pool is not None:
+                    result = self._pool.submit(generate_package, request).result()
+                else:
+                    with stage_hook(check_cancelled):
+                        result = generate_package(request, cache, progress)
+            except JobCancelled:
+                METRICS.inc("form_filler_builds_total", status="cancelled")
+                with self._cond:
+                    self._finish(job, "cancelled")
+                continue
+            except Exception as e:
+                METRICS.inc("form_filler_builds_total", status="failed")
+                with self._cond:
+                    self._finish(job, "failed", f"{type(e).__name__}: {e}")
+                continue
+
+            pdf_bytes, stats = result
+            size = len(pdf_bytes) if pdf_bytes is not None else 0
+            # A result the cache cannot hold would leave a "done" job with nothing to fetch
+            too_large = size > self.results.max_bytes
+            METRICS.record(stats["trace"], status="failed" if too_large else "done")
+            log_trace(stats["trace"], job=job.id)
+            with self._cond:
+                if job.cancel_requested:
+                    self._finish(job, "cancelled")
+                elif too_large:
+                    self._finish(job, "failed", f"The package is {size / 1024 ** 2:,.0f} MB, more than the "
+                                                f"{self.results.max_bytes / 1024 ** 2:,.0f} MB result cache holds; "
+                                                f"build it to a file (streaming mode) instead")
+                else:
+                    self.results.put(job.id, result, size=size)
+                    self._finish(job, "done")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue shared by every session."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,204 @@
+"""Exact totals for line items.
+
+Amounts arrive as the strings a user typed. A :class:`Ledger` parses the
+amount columns of a list of line items once, into integer cents stored
+column by column, and records a :class:`RowError` for every value that is not
+a dollar amount instead of quietly counting it as zero. Section totals, G/U
+totals, the grand total and the running totals on continuation sheets are
+then integer sums over those columns, so no figure on any page can drift by a
+cent from another.
+
+:func:`form_totals` computes every section total, G/U total and the grand
+total of a form in one pass; :func:`validate_forms` collects the errors of a
+whole package so the app, the batch runner and the API can reject bad input
+before building.
+"""
+import re
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Iterable
+
+from .models import PackageForms
+
+# Optional sign, digits with optional thousands separators, up to two decimals
+_AMOUNT = re.compile(r"(-?)\$?(\d{1,3}(?:,\d{3})*|\d+|)(?:\.(\d*))?")
+
+# Amount columns of each line-item list, per form
+LEDGER_COLUMNS = {
+    "cover_sheet": {"items": ("amt",)},
+    "non_travel": {"items": ("amt", "gu_amt")},
+    "travel": {
+        "incidentals": ("amt", "gu_amt"),
+        "transportation": ("amt", "gu_amt"),
+        "lodging": ("rate", "amt"),
+        "meals": ("breakfast", "lunch", "dinner", "gu"),
+    },
+}
+# Columns summed into each list's total and into its G/U total
+SECTION_TOTALS = {
+    ("cover_sheet", "items"): (("amt",), ()),
+    ("non_travel", "items"): (("amt",), ("gu_amt",)),
+    ("travel", "incidentals"): (("amt",), ("gu_amt",)),
+    ("travel", "transportation"): (("amt",), ("gu_amt",)),
+    ("travel", "lodging"): (("amt",), ()),
+    ("travel", "meals"): (("breakfast", "lunch", "dinner"), ("gu",)),
+}
+SECTION_TITLES = {
+    ("cover_sheet", "items"): "Reimbursement tally",
+    ("non_travel", "items"): "Non-travel expenses",
+    ("travel", "incidentals"): "Travel incidentals",
+    ("travel", "transportation"): "Travel transportation",
+    ("travel", "lodging"): "Travel lodging",
+    ("travel", "meals"): "Travel meals",
+}
+
+
+class AmountError(ValueError):
+    """A typed amount that is not a whole number of cents."""
+
+
+class InvalidAmounts(ValueError):
+    """Raised by :func:`check_amounts`; ``errors`` lists every bad amount."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        shown = "; ".join(str(error) for error in errors[:5])
+        more = f" (and {len(errors) - 5} more)" if len(errors) > 5 else ""
+        super().__init__(f"{len(errors)} invalid amount(s): {shown}{more}")
+
+
+def parse_cents(value) -> int:
+    """Parse a typed dollar amount into integer cents.
+
+    Blanks are zero; ``$`` and thousands separators are accepted. Anything
+    else, including fractions of a cent, raises :class:`AmountError`.
+    """
+    text = str(value).strip().replace(" ", "") if value is not None else ""
+    if not text:
+        return 0
+    match = _AMOUNT.fullmatch(text)
+    if match is None or not (match.group(2) or match.group(3)):
+        raise AmountError(f"{value!r} is not a dollar amount")
+    sign, dollars, cents = match.groups()
+    cents = cents or ""
+    if len(cents) > 2:
+        raise AmountError(f"{value!r} has fractions of a cent")
+    total = int(dollars.replace(",", "") or 0) * 100 + int(cents.ljust(2, "0"))
+    return -total if sign else total
+
+
+def format_cents(cents: int, currency: bool = False) -> str:
+    """``123456`` -> ``"1234.56"``, or ``"$1,234.56"`` with ``currency``."""
+    sign = "-" if cents < 0 else ""
+    dollars, rest = divmod(abs(cents), 100)
+    if currency:
+        return f"{sign}${dollars:,}.{rest:02d}"
+    return f"{sign}{dollars}.{rest:02d}"
+
+
+@dataclass(slots=True)
+class RowError:
+    """One amount that could not be parsed; ``row`` is 1-based."""
+    section: str
+    row: int
+    column: str
+    value: str
+    message: str
+
+    def __str__(self):
+        return f"{self.section}, row {self.row}, {self.column}: {self.message}"
+
+
+class Ledger:
+    """Amount columns of a list of line items, in integer cents.
+
+    ``columns`` names the item attributes that hold amounts. Unparseable
+    amounts count as zero and are listed in :attr:`errors`.
+    """
+
+    __slots__ = ("section", "rows", "columns", "errors")
+
+    def __init__(self, items: Iterable, columns: Iterable[str], section: str = ""):
+        self.section = section
+        self.columns = {}
+        self.errors = []
+        items = list(items)
+        self.rows = len(items)
+        for column in columns:
+            values = array("q", bytes(8 * self.rows))
+            for row, item in enumerate(items):
+                raw = getattr(item, column)
+                try:
+                    values[row] = parse_cents(raw)
+                except AmountError as e:
+                    self.errors.append(RowError(section, row + 1, column, str(raw), str(e)))
+            self.columns[column] = values
+        self.errors.sort(key=lambda error: error.row)
+
+    def column(self, name: str) -> array:
+        return self.columns[name]
+
+    def total(self, *columns: str, start: int = 0, stop=None) -> int:
+        """Sum of ``columns`` over rows ``start:stop`` (all rows by default)."""
+        return sum(sum(self.columns[name][start:stop]) for name in columns)
+
+    def totals(self) -> dict:
+        """``{column: total}`` for every column."""
+        return {name: sum(values) for name, values in self.columns.items()}
+
+    def running(self, *columns: str) -> list:
+        """Prefix sums of ``columns``: entry ``i`` is the total of the first ``i`` rows."""
+        if len(columns) == 1:
+            combined = self.columns[columns[0]]
+        else:
+            combined = map(sum, zip(*(self.columns[name] for name in columns)))
+        return list(accumulate(combined, initial=0))
+
+
+@dataclass(slots=True)
+class FormTotals:
+    """Ledgers and totals, in cents, for every line-item list of one form."""
+    ledgers: dict
+    # list name -> total and G/U total
+    totals: dict
+    gu_totals: dict
+    # Sum of the list totals (G/U amounts are part of them, not added again)
+    grand_total: int
+
+    @property
+    def errors(self) -> list[RowError]:
+        return [error for ledger in self.ledgers.values() for error in ledger.errors]
+
+
+def section_ledger(key: str, name: str, items) -> Ledger:
+    """Ledger for one line-item list, e.g. ``section_ledger("travel", "meals", items)``."""
+    return Ledger(items, LEDGER_COLUMNS[key][name], SECTION_TITLES[key, name])
+
+
+def form_totals(key: str, data) -> FormTotals:
+    """Parse every amount of form ``key`` once and total each list."""
+    ledgers, totals, gu_totals = {}, {}, {}
+    for name in LEDGER_COLUMNS[key]:
+        ledger = ledgers[name] = section_ledger(key, name, getattr(data, name))
+        total_columns, gu_columns = SECTION_TOTALS[key, name]
+        totals[name] = ledger.total(*total_columns)
+        gu_totals[name] = ledger.total(*gu_columns)
+    return FormTotals(ledgers, totals, gu_totals, sum(totals.values()))
+
+
+def validate_forms(forms: PackageForms) -> list[RowError]:
+    """Every unparseable amount in the selected forms, in form order."""
+    errors = []
+    for key in LEDGER_COLUMNS:
+        data = getattr(forms, key)
+        if data is not None:
+            errors += form_totals(key, data).errors
+    return errors
+
+
+def check_amounts(forms: PackageForms) -> None:
+    """Raise :class:`InvalidAmounts` if any amount in ``forms`` does not parse."""
+    errors = validate_forms(forms)
+    if errors:
+        raise InvalidAmounts(errors)
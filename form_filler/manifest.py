@@ -0,0 +1,39 @@
+"""Write or check the template schema manifest.
+
+Usage::
+
+    python -m form_filler.manifest --write   # after replacing a template
+    python -m form_filler.manifest           # check only
+
+``--write`` scans each template's widgets once and rewrites
+``form_filler/schema_manifest.json``. Either way the templates are then
+checked against the manifest and the field maps in :mod:`form_filler.fields`;
+the exit status is 1 if anything disagrees.
+"""
+import argparse
+import sys
+
+from .schema import MANIFEST_PATH
+from .templates import TEMPLATE_DIR, check_templates, write_template_manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or check the template schema manifest.")
+    parser.add_argument("--write", action="store_true", help="scan the templates and rewrite the manifest first")
+    parser.add_argument("--template-dir", default=TEMPLATE_DIR)
+    args = parser.parse_args(argv)
+
+    if args.write:
+        schemas = write_template_manifest(args.template_dir)
+        for filename, schema in schemas.items():
+            print(f"{filename}: {len(schema.fields)} fields, {len(schema.widgets)} widgets on {schema.page_count} pages")
+        print(f"Wrote {MANIFEST_PATH}")
+    problems = check_templates(args.template_dir)
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problem(s)" if problems else "Templates and field maps agree")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
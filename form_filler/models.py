@@ -0,0 +1,257 @@
+"""Typed inputs for each finance form and its line items.
+
+Values are kept as the strings a user types (amounts included); the ledger
+parses amounts when it computes totals. Dates are ISO strings and default to
+today, like the app's date pickers.
+"""
+import os
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Optional
+
+
+ACCOUNT_NUMBERS = {"Credit Union": "1233", "RCC": "1222", "Gift": "1244"}
+
+
+def department_for(club_name: str) -> str:
+    return f"Recreational Club Council {club_name}".strip()
+
+
+def _today() -> str:
+    return str(date.today())
+
+
+def _from_dict(cls, data, **item_types):
+    """Build ``cls`` from a dict, converting nested line-item dicts.
+
+    Unknown keys raise ``TypeError`` so typos in batch input fail loudly.
+    """
+    kwargs = dict(data)
+    for key, item_cls in item_types.items():
+        if key in kwargs:
+            kwargs[key] = [item if isinstance(item, item_cls) else item_cls(**item) for item in kwargs[key]]
+    return cls(**kwargs)
+
+
+# ---------- Line items ----------
+
+@dataclass(slots=True)
+class ReimbursementItem:
+    desc: str = ""
+    qty: str = ""
+    amt: str = "0.00"
+
+
+@dataclass(slots=True)
+class ExpenseItem:
+    date: str = ""
+    desc: str = ""
+    qty: str = ""
+    amt: str = "0.00"
+    gu_amt: str = "0.00"
+
+
+@dataclass(slots=True)
+class IncidentalItem:
+    date: str = ""
+    desc: str = ""
+    amt: str = "0.00"
+    gu_amt: str = "0.00"
+
+
+@dataclass(slots=True)
+class TransportationItem:
+    type: str = ""
+    company: str = ""
+    date: str = ""
+    amt: str = "0.00"
+    gu_amt: str = "0.00"
+
+
+@dataclass(slots=True)
+class LodgingItem:
+    hotel: str = ""
+    from_date: str = ""
+    to_date: str = ""
+    days: str = ""
+    rate: str = "0.00"
+    amt: str = "0.00"
+
+
+@dataclass(slots=True)
+class MealItem:
+    date: str = ""
+    breakfast: str = "0.00"
+    lunch: str = "0.00"
+    dinner: str = "0.00"
+    gu: str = "0.00"
+
+
+# ---------- Forms ----------
+
+@dataclass(slots=True)
+class CoverSheet:
+    """Form 1: Expense Cover Sheet."""
+    club_name: str = ""
+    date_submitted: str = field(default_factory=_today)
+    submitter_name: str = ""
+    submitter_phone: str = ""
+    submitter_email: str = ""
+    preferred_date: str = field(default_factory=_today)
+    short_title: str = ""
+    total_amount: str = ""
+    account_type: str = "Credit Union"
+    # Blank means "derive from account_type"
+    account_number: str = ""
+    expense_type: str = "Reimbursement"
+    pickup_check: str = "N/A"
+    expense_purpose: str = ""
+    payable_to: str = ""
+    entity_type: str = "Student"
+    student_id: str = ""
+    relationship: str = ""
+    other_entity: str = ""
+    address_1: str = ""
+    address_2: str = ""
+    contact_number: str = ""
+    contact_email: str = ""
+    items: list[ReimbursementItem] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CoverSheet":
+        return _from_dict(cls, data, items=ReimbursementItem)
+
+
+@dataclass(slots=True)
+class NonTravelReport:
+    """Form 2: Non-Travel Expense Report."""
+    department: str = ""
+    account: str = ""
+    check_request: str = ""
+    business_purpose: str = ""
+    reimbursee_sig_date: str = field(default_factory=_today)
+    items: list[ExpenseItem] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NonTravelReport":
+        return _from_dict(cls, data, items=ExpenseItem)
+
+
+@dataclass(slots=True)
+class TravelReport:
+    """Form 3: Travel Expense Report."""
+    reimbursee_name: str = ""
+    department: str = ""
+    account: str = ""
+    check_request: str = ""
+    destination: str = ""
+    period_covered: str = ""
+    business_purpose: str = ""
+    # Collected by the app; the travel template has no field for it yet
+    reimbursee_sig_date: str = field(default_factory=_today)
+    incidentals: list[IncidentalItem] = field(default_factory=list)
+    transportation: list[TransportationItem] = field(default_factory=list)
+    lodging: list[LodgingItem] = field(default_factory=list)
+    meals: list[MealItem] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TravelReport":
+        return _from_dict(
+            cls, data,
+            incidentals=IncidentalItem,
+            transportation=TransportationItem,
+            lodging=LodgingItem,
+            meals=MealItem,
+        )
+
+
+@dataclass(slots=True)
+class PackageForms:
+    """The forms selected for one package; ``None`` means not selected."""
+    cover_sheet: Optional[CoverSheet] = None
+    non_travel: Optional[NonTravelReport] = None
+    travel: Optional[TravelReport] = None
+
+
+IMAGE_TYPES = ("png", "jpg", "jpeg", "gif", "bmp")
+ATTACHMENT_TYPES = ("pdf",) + IMAGE_TYPES
+
+
+@dataclass(slots=True)
+class Attachment:
+    """A supporting document: its original file name and raw bytes.
+
+    A spooled attachment leaves ``data`` empty and points ``path`` at a file
+    on disk instead; use :meth:`read` when the bytes are needed either way.
+    """
+    filename: str
+    data: bytes = b""
+    # Resolution an image was normalized to; sizes its page (None = 72 dpi)
+    dpi: Optional[int] = None
+    path: Optional[str] = None
+    # 0-based pages of a PDF to include, in this order (None = every page)
+    pages: Optional[tuple[int, ...]] = None
+
+    def read(self) -> bytes:
+        if self.path is None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.path is None else os.path.getsize(self.path)
+
+    @property
+    def file_type(self) -> str:
+        return self.filename.split('.')[-1].lower()
+
+    @property
+    def is_image(self) -> bool:
+        return self.file_type in IMAGE_TYPES
+
+
+def parse_page_ranges(text: str, page_count: Optional[int] = None) -> Optional[tuple[int, ...]]:
+    """Parse 1-based page ranges such as ``"1-3, 7, 10-"`` into 0-based pages.
+
+    Blank text or ``"all"`` means every page and returns None. An open range
+    (``"10-"``) runs to the last page and needs ``page_count``; with a
+    ``page_count`` every page is also checked to exist. Raises ``ValueError``.
+    """
+    text = text.strip().lower()
+    if text in ("", "all"):
+        return None
+    pages = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            start = int(first)
+            end = start if not dash else int(last) if last.strip() else page_count
+        except ValueError:
+            raise ValueError(f"Not a page range: {part!r}") from None
+        if end is None:
+            raise ValueError(f"Open page range {part!r} needs the page count")
+        if start < 1 or end < start:
+            raise ValueError(f"Not a page range: {part!r}")
+        if page_count is not None and end > page_count:
+            raise ValueError(f"Page {end} is past the last page ({page_count})")
+        pages.extend(range(start - 1, end))
+    if not pages:
+        raise ValueError(f"No pages in {text!r}")
+    return tuple(pages)
+
+
+def format_page_ranges(pages: Optional[tuple[int, ...]]) -> str:
+    """The inverse of :func:`parse_page_ranges`: ``(0, 1, 2, 6)`` -> ``"1-3, 7"``."""
+    if pages is None:
+        return "all"
+    runs = []
+    for page in pages:
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return ", ".join(str(start + 1) if start == end else f"{start + 1}-{end + 1}" for start, end in runs)
@@ -0,0 +1,175 @@
+"""Pack image attachments several to a letter page ("N-up").
+
+By default every receipt photo becomes a page of its own, so a trip with
+sixty parking stubs makes a sixty-page package. In N-up mode each image is
+given its printed size (its pixels at the resolution it was normalized to,
+or the one stored in the file, else 72 dpi), capped to a share of the
+printable area, and the boxes are bin-packed onto letter pages. Each
+receipt is captioned with its file name when captions are on. A receipt
+shrunk into a small box keeps only the pixels the box needs at
+``NupOptions.dpi``, which is what makes the package smaller as well as
+shorter.
+
+Packing is first-fit decreasing height over shelves: boxes are taken
+tallest first and each goes on the first shelf (a row across a page) with
+room left, or opens a new shelf on the first page with enough height. That
+is ``O(receipts x shelves)`` arithmetic; only the image headers are read.
+Each packed page is rendered on its own, so it can be cached and a
+streaming build can flush between pages.
+"""
+import io
+from typing import Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from .cache import content_key
+from .diagnostics import stage
+from .models import Attachment
+from .options import NupOptions
+
+PAGE_SIZE = (612, 792)  # US letter in points
+CAPTION_SIZE = 7  # points
+# Caption line below each image, including the space above the text
+CAPTION_HEIGHT = CAPTION_SIZE + 4
+# Resolutions outside this range in a file's metadata are treated as missing
+_FILE_DPI_RANGE = (50, 1200)
+# Downsample only images at least this many times wider than their box needs
+_RESAMPLE_SLACK = 2.0
+_JPEG_QUALITY = 75
+_EPSILON = 0.01
+
+
+def _file_dpi(img) -> Optional[float]:
+    dpi = img.info.get("dpi")
+    if not dpi:
+        return None
+    low, high = _FILE_DPI_RANGE
+    return dpi[0] if low <= dpi[0] <= high else None
+
+
+def _caption_height(options: NupOptions) -> float:
+    return CAPTION_HEIGHT if options.captions else 0
+
+
+def _printable(options: NupOptions, page_size=PAGE_SIZE) -> tuple[float, float]:
+    margin = options.margin * 72
+    return page_size[0] - 2 * margin, page_size[1] - 2 * margin
+
+
+def receipt_size(attachment: Attachment, options: NupOptions, page_size=PAGE_SIZE) -> tuple[float, float]:
+    """Printed ``(width, height)`` of an image attachment in points, without its caption."""
+    with Image.open(io.BytesIO(attachment.read())) as img:
+        width, height = img.size
+        dpi = attachment.dpi or _file_dpi(img) or 72
+    width, height = width * 72 / dpi, height * 72 / dpi
+    printable_width, printable_height = _printable(options, page_size)
+    # With max_fraction 1/n, n boxes and the gaps between them fill the page exactly
+    gap = options.gap * 72
+    scale = min(
+        1.0,
+        (options.max_fraction * (printable_width + gap) - gap) / width,
+        (options.max_fraction * (printable_height + gap) - gap - _caption_height(options)) / height,
+    )
+    return width * scale, height * scale
+
+
+def pack(sizes: list[tuple[float, float]], options: NupOptions, page_size=PAGE_SIZE) -> list[list[tuple]]:
+    """Bin-pack ``(width, height)`` boxes in points onto pages.
+
+    Returns one list per page of ``(index into sizes, (x0, y0, x1, y1))``.
+    Every box must fit the printable area.
+    """
+    margin = options.margin * 72
+    gap = options.gap * 72
+    printable_width, printable_height = _printable(options, page_size)
+    pages = []
+    # Height used on each page, including the gap after its last shelf
+    used = []
+    # [page, top, width used] per shelf; a shelf is as tall as its first box
+    shelves = []
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[index]
+        shelf = next((s for s in shelves if s[2] + width <= printable_width + _EPSILON), None)
+        if shelf is None:
+            page = next((p for p, h in enumerate(used) if h + height <= printable_height + _EPSILON), None)
+            if page is None:
+                page = len(pages)
+                pages.append([])
+                used.append(0.0)
+            shelf = [page, used[page], 0.0]
+            used[page] += height + gap
+            shelves.append(shelf)
+        page, top, left = shelf
+        x0, y0 = margin + left, margin + top
+        pages[page].append((index, (x0, y0, x0 + width, y0 + height)))
+        shelf[2] += width + gap
+    return pages
+
+
+def pack_receipts(attachments: list[Attachment], options: NupOptions) -> list[list[tuple]]:
+    """Lay image attachments out on pages: ``[[(attachment, (x0, y0, x1, y1)), ...], ...]``.
+
+    The box includes the caption line below the image.
+    """
+    caption = _caption_height(options)
+    sizes = [receipt_size(attachment, options) for attachment in attachments]
+    boxes = [(width, height + caption) for width, height in sizes]
+    return [[(attachments[index], rect) for index, rect in page] for page in pack(boxes, options)]
+
+
+def _caption(filename: str, width: float) -> str:
+    """``filename``, shortened with "..." to fit ``width`` points."""
+    def length(text):
+        return fitz.get_text_length(text, fontname="helv", fontsize=CAPTION_SIZE)
+
+    if length(filename) <= width:
+        return filename
+    text = filename
+    while text and length(text + "...") > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def _fit_image(data: bytes, width: float, height: float, dpi: int) -> bytes:
+    """``data`` downsampled to ``width`` x ``height`` points at ``dpi``, if it has far more pixels.
+
+    Images with transparency or unusual color modes are left as they are.
+    """
+    target = (max(1, round(width * dpi / 72)), max(1, round(height * dpi / 72)))
+    with Image.open(io.BytesIO(data)) as img:
+        if img.width < target[0] * _RESAMPLE_SLACK or img.mode not in ("RGB", "L"):
+            return data
+        if img.format == "JPEG":
+            # Let the JPEG decoder downscale by a power of two while decoding
+            img.draft(img.mode, target)
+        # Bicubic is about twice as fast as Lanczos and looks the same on print-size receipts
+        out = img.resize(target, Image.BICUBIC, reducing_gap=3.0)
+    buffer = io.BytesIO()
+    out.save(buffer, format="JPEG", quality=_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue() if buffer.tell() < len(data) else data
+
+
+def nup_stage_key(sheet: list[tuple], options: NupOptions) -> str:
+    """Cache key for one packed page: the layout, file names and image bytes."""
+    return content_key(
+        "nup", options, [(attachment.filename, rect) for attachment, rect in sheet],
+        *(attachment.read() for attachment, _ in sheet),
+    )
+
+
+def nup_page(sheet: list[tuple], options: NupOptions) -> bytes:
+    """Render one page from :func:`pack_receipts` as a one-page PDF."""
+    caption = _caption_height(options)
+    with stage("image.nup", f"{len(sheet)} receipts") as span, fitz.open() as doc:
+        page = doc.new_page(width=PAGE_SIZE[0], height=PAGE_SIZE[1])
+        for attachment, (x0, y0, x1, y1) in sheet:
+            rect = fitz.Rect(x0, y0, x1, y1 - caption)
+            page.insert_image(rect, stream=_fit_image(attachment.read(), rect.width, rect.height, options.dpi))
+            if options.captions:
+                page.insert_text((x0, y1 - 2), _caption(attachment.filename, x1 - x0),
+                                 fontname="helv", fontsize=CAPTION_SIZE)
+        data = doc.tobytes(deflate_images=True)
+        span.bytes = len(data)
+        span.pages = 1
+        return data
@@ -0,0 +1,67 @@
+"""Build options a UI can offer before the PDF and imaging libraries load.
+
+Everything here is plain data: choosing an appearance mode, an output
+profile or image settings does not import PyMuPDF or Pillow. The modules
+that act on these options (:mod:`form_filler.fields`,
+:mod:`form_filler.output`, :mod:`form_filler.images`,
+:mod:`form_filler.spool`, :mod:`form_filler.nup`) import them from here.
+"""
+from dataclasses import dataclass
+
+# How form field appearances are produced; see form_filler.fields
+APPEARANCE_MODES = ("per_field", "bulk", "need_appearances")
+
+# Pending pages flushed to disk past this size in streaming mode; see form_filler.spool
+DEFAULT_MEMORY_LIMIT_MB = 64
+
+
+@dataclass(slots=True, frozen=True)
+class OutputProfile:
+    name: str
+    label: str
+    garbage: int = 0
+    deflate: bool = False
+    deflate_fonts: bool = False
+    subset_fonts: bool = False
+    object_streams: bool = False
+    linear: bool = False
+
+
+OUTPUT_PROFILES = {
+    profile.name: profile
+    for profile in (
+        OutputProfile("fast", "Fast (no optimization)"),
+        OutputProfile(
+            "small", "Small (dedupe, compress, subset fonts)",
+            garbage=4, deflate=True, deflate_fonts=True, subset_fonts=True, object_streams=True,
+        ),
+        OutputProfile(
+            "web", "Web (small + linearized for fast first page)",
+            garbage=3, deflate=True, deflate_fonts=True, subset_fonts=True, linear=True,
+        ),
+    )
+}
+
+
+@dataclass(slots=True)
+class ImageOptions:
+    """Settings for the image normalization stage."""
+    dpi: int = 150
+    quality: int = 75
+    grayscale: bool = False
+    # Threads used by normalize_attachments; 1 means run inline
+    workers: int = 1
+
+
+@dataclass(slots=True, frozen=True)
+class NupOptions:
+    """Settings for packing image attachments several to a letter page."""
+    # Page margin and the space between receipts, in inches
+    margin: float = 0.5
+    gap: float = 0.15
+    # Print each receipt's file name under it
+    captions: bool = True
+    # Largest share of the printable width and height one receipt may take
+    max_fraction: float = 0.5
+    # Receipts with far more pixels than their box needs at this resolution are downsampled
+    dpi: int = 150
@@ -0,0 +1,80 @@
+"""Output profiles controlling how the merged package is written.
+
+``fast``  saves as-is apart from compressing raw image pixels.
+``small`` drops duplicate and unused objects, deflates every stream, subsets
+          embedded fonts and packs objects into object streams.
+``web``   is ``small`` without object streams and with linearization, so
+          browsers can show page 1 before the whole file has arrived.
+          MuPDF 1.26+ can no longer linearize; the file is then written
+          without it and the report says so.
+"""
+import os
+import time
+from dataclasses import dataclass
+
+import fitz  # PyMuPDF
+
+from .diagnostics import stage
+from .options import OUTPUT_PROFILES, OutputProfile
+
+# MuPDF 1.26 dropped linearization; asking for it raises
+_CAN_LINEARIZE = tuple(int(part) for part in fitz.VersionFitz.split(".")[:2]) < (1, 26)
+
+
+@dataclass(slots=True)
+class OutputReport:
+    """Size and time of the final save."""
+    profile: str
+    bytes: int
+    seconds: float
+    linearized: bool = False
+
+
+def _save_options(settings: OutputProfile) -> dict:
+    return dict(
+        garbage=settings.garbage,
+        deflate=settings.deflate,
+        # Non-JPEG images are inserted as raw pixels; always compress them
+        deflate_images=True,
+        deflate_fonts=settings.deflate_fonts,
+        use_objstms=int(settings.object_streams),
+    )
+
+
+def _write(doc, settings, write):
+    """Run ``write(**options)`` with the profile's options; return (result, linearized)."""
+    if settings.subset_fonts:
+        doc.subset_fonts()
+
+    options = _save_options(settings)
+    if settings.linear and _CAN_LINEARIZE:
+        return write(linear=True, **options), True
+    return write(**options), False
+
+
+def save_pdf(doc: fitz.Document, profile: str = "fast") -> tuple[bytes, OutputReport]:
+    """Serialize ``doc`` with the named output profile.
+
+    Font subsetting modifies ``doc`` in place, so call this last.
+    """
+    settings = OUTPUT_PROFILES[profile]
+    started = time.perf_counter()
+    with stage("save", profile) as span:
+        data, linearized = _write(doc, settings, doc.tobytes)
+        span.bytes = len(data)
+        span.pages = doc.page_count
+    return data, OutputReport(profile, len(data), time.perf_counter() - started, linearized)
+
+
+def save_pdf_file(doc: fitz.Document, path: str, profile: str = "fast") -> OutputReport:
+    """Like :func:`save_pdf`, but write straight to ``path``.
+
+    ``path`` must not be the file ``doc`` was opened from.
+    """
+    settings = OUTPUT_PROFILES[profile]
+    started = time.perf_counter()
+    with stage("save", profile) as span:
+        _, linearized = _write(doc, settings, lambda **options: doc.save(path, **options))
+        span.bytes = os.path.getsize(path)
+        span.pages = doc.page_count
+    return OutputReport(profile, span.bytes, time.perf_counter() - started, linearized)
@@ -0,0 +1,133 @@
+"""Convert uploads in the background while the user is still filling forms.
+
+Each upload is submitted to a shared thread pool as soon as it arrives. The
+worker validates it, normalizes images and converts them to PDF pages, and
+stores the results in the session's :class:`StageCache` under the same keys
+``normalize_attachments`` and ``build_package`` use, so the generate step
+finds every stage ready and only has to merge.
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from .cache import StageCache
+from .engine import attachment_stage_key, image_page, open_attachment_pdf
+from .images import ImageOptions, normalize_attachments
+from .models import ATTACHMENT_TYPES, Attachment
+from .thumbnails import file_digest
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Process-wide pool shared by every session."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=min(4, os.cpu_count() or 1),
+                thread_name_prefix="preconvert",
+            )
+        return _executor
+
+
+@dataclass(slots=True)
+class ConversionJob:
+    filename: str
+    future: Future
+    # SHA-256 of the upload; identical uploads share one future
+    digest: str = ""
+
+    @property
+    def status(self) -> str:
+        if not self.future.done():
+            return "converting" if self.future.running() else "queued"
+        return "failed" if self.future.exception() is not None else "ready"
+
+    @property
+    def pages(self) -> int:
+        return self.future.result()[0] if self.status == "ready" else 0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.future.result()[1] if self.status == "ready" else 0
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.status != "failed":
+            return None
+        error = self.future.exception()
+        return f"{type(error).__name__}: {error}"
+
+
+def preconvert(attachment: Attachment, options: Optional[ImageOptions], cache: StageCache) -> tuple[int, int]:
+    """Validate and convert one upload into ``cache``; return (pages, bytes saved)."""
+    if attachment.file_type not in ATTACHMENT_TYPES:
+        raise ValueError(f"Unsupported file type: .{attachment.file_type}")
+
+    if attachment.file_type == "pdf":
+        with open_attachment_pdf(attachment) as doc:
+            if doc.page_count == 0:
+                raise ValueError("PDF has no pages")
+            return doc.page_count, 0
+
+    saved = 0
+    if options is not None:
+        normalized, reports = normalize_attachments([attachment], options, cache)
+        attachment = normalized[0]
+        saved = reports[0].bytes_saved
+    cache.get_or_build(attachment_stage_key(attachment), lambda: image_page(attachment))
+    return 1, saved
+
+
+class UploadStore:
+    """Per-session conversion jobs, keyed by upload id and image settings."""
+
+    def __init__(self, cache: StageCache):
+        self.cache = cache
+        self._jobs = {}
+        # (content digest, settings) -> job, so a file uploaded twice is converted once
+        self._by_content = {}
+
+    def sync(
+        self,
+        uploads: Iterable[tuple[str, str, Callable[[], bytes]]],
+        options: Optional[ImageOptions],
+    ) -> list[ConversionJob]:
+        """Submit uploads not seen yet and forget removed ones.
+
+        ``uploads`` holds ``(upload id, filename, read bytes)``; bytes are only
+        read for new uploads. Returns the jobs in upload order.
+        """
+        settings = None if options is None else (options.dpi, options.quality, options.grayscale)
+        jobs, by_content = {}, {}
+        for upload_id, filename, read in uploads:
+            key = (upload_id, settings)
+            job = self._jobs.get(key)
+            if job is None:
+                attachment = Attachment(filename, read())
+                digest = file_digest(attachment.data)
+                same = by_content.get((digest, settings)) or self._by_content.get((digest, settings))
+                if same is not None:
+                    future = same.future
+                else:
+                    future = _get_executor().submit(preconvert, attachment, options, self.cache)
+                job = ConversionJob(filename, future, digest)
+            jobs[key] = job
+            by_content.setdefault((job.digest, settings), job)
+        self._jobs = jobs
+        self._by_content = by_content
+        return list(jobs.values())
+
+    def wait(self, timeout: Optional[float] = None) -> list[ConversionJob]:
+        """Wait for the current jobs to finish and return the failed ones.
+
+        Jobs still running after ``timeout`` are left alone; the build simply
+        converts those attachments itself.
+        """
+        futures = [job.future for job in self._jobs.values()]
+        wait_futures(futures, timeout)
+        return [job for job in self._jobs.values() if job.status == "failed"]
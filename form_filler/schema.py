@@ -0,0 +1,157 @@
+"""Field schema of the form templates, persisted as a JSON manifest.
+
+Scanning a template's widgets with PyMuPDF costs tens of milliseconds per
+form, so it is done once, by :func:`write_manifest` (run through
+``python -m form_filler.manifest --write``), and the result is
+stored next to this module. For every widget the manifest records its field
+name, type, page, xref, rect, font size, alignment, on-state (buttons) and
+value in the blank template, together with the SHA-256 of the template it
+describes. Loading the manifest is a JSON read; no PDF is parsed.
+"""
+import json
+import os
+import threading
+from dataclasses import astuple, dataclass
+from typing import Optional
+
+import fitz  # PyMuPDF
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_manifest.json")
+MANIFEST_VERSION = 1
+
+FIELD_TYPES = {
+    fitz.PDF_WIDGET_TYPE_BUTTON: "button",
+    fitz.PDF_WIDGET_TYPE_CHECKBOX: "checkbox",
+    fitz.PDF_WIDGET_TYPE_COMBOBOX: "combobox",
+    fitz.PDF_WIDGET_TYPE_LISTBOX: "listbox",
+    fitz.PDF_WIDGET_TYPE_RADIOBUTTON: "radio",
+    fitz.PDF_WIDGET_TYPE_SIGNATURE: "signature",
+    fitz.PDF_WIDGET_TYPE_TEXT: "text",
+}
+_TYPE_CODES = {name: code for code, name in FIELD_TYPES.items()}
+_BUTTON_TYPES = (fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON)
+
+
+@dataclass(frozen=True, slots=True)
+class FieldSpec:
+    """One widget of a template, as recorded in the manifest."""
+    name: str
+    page: int
+    xref: int
+    field_type: int
+    rect: tuple
+    font_size: float
+    # Quadding: 0 left, 1 centered, 2 right
+    align: int
+    # Button on-state (checkboxes and radio kids), else None
+    on_state: Optional[str]
+    # Value in the blank template
+    value: str
+
+
+class TemplateSchema:
+    """Widgets of one template grouped by field name."""
+
+    __slots__ = ("digest", "page_count", "fields", "field_pages")
+
+    def __init__(self, digest: str, page_count: int, widgets: list[FieldSpec]):
+        self.digest = digest
+        self.page_count = page_count
+        # field name -> [FieldSpec, ...] in page order
+        self.fields = {}
+        for spec in widgets:
+            self.fields.setdefault(spec.name, []).append(spec)
+        self.field_pages = sorted({spec.page for spec in widgets})
+
+    @property
+    def widgets(self) -> list[FieldSpec]:
+        return [spec for specs in self.fields.values() for spec in specs]
+
+
+def scan_widgets(doc: fitz.Document) -> list[FieldSpec]:
+    """Read every widget of ``doc``; this is the slow path the manifest avoids."""
+    widgets = []
+    for page in doc:
+        for widget in page.widgets():
+            kind, align = doc.xref_get_key(widget.xref, "Q")
+            widgets.append(FieldSpec(
+                name=widget.field_name,
+                page=page.number,
+                xref=widget.xref,
+                field_type=widget.field_type,
+                rect=tuple(round(v, 2) for v in widget.rect),
+                font_size=widget.text_fontsize or 0,
+                align=int(align) if kind == "int" else 0,
+                on_state=widget.on_state() if widget.field_type in _BUTTON_TYPES else None,
+                value=str(widget.field_value or ""),
+            ))
+    return widgets
+
+
+def scan_template(data: bytes, digest: str) -> TemplateSchema:
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return TemplateSchema(digest, doc.page_count, scan_widgets(doc))
+
+
+def _encode(spec):
+    row = list(astuple(spec))
+    row[3] = FIELD_TYPES.get(spec.field_type, str(spec.field_type))
+    row[4] = list(spec.rect)
+    return row
+
+
+def _decode(row):
+    name, page, xref, field_type, rect, font_size, align, on_state, value = row
+    return FieldSpec(name, page, xref, _TYPE_CODES.get(field_type, field_type), tuple(rect),
+                     font_size, align, on_state, value)
+
+
+def write_manifest(schemas: dict, path: str = MANIFEST_PATH) -> None:
+    """Write ``{template filename: TemplateSchema}`` to ``path``.
+
+    One widget per line as ``[name, page, xref, type, rect, font size,
+    align, on-state, value]`` keeps the file small and its diffs readable.
+    """
+    lines = ["{", f'"version": {MANIFEST_VERSION},', '"columns": ["name", "page", "xref", "type", "rect", '
+             '"font_size", "align", "on_state", "value"],', '"templates": {']
+    for t, (filename, schema) in enumerate(sorted(schemas.items())):
+        lines.append(f"{json.dumps(filename)}: {{\"sha256\": \"{schema.digest}\", "
+                     f"\"pages\": {schema.page_count}, \"widgets\": [")
+        widgets = sorted(schema.widgets, key=lambda spec: (spec.page, spec.xref))
+        lines += [json.dumps(_encode(spec), ensure_ascii=False) + ("," if i < len(widgets) - 1 else "")
+                  for i, spec in enumerate(widgets)]
+        lines.append("]}" + ("," if t < len(schemas) - 1 else ""))
+    lines += ["}", "}"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    clear_manifest_cache()
+
+
+_manifests = {}
+_lock = threading.Lock()
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """``{template filename: TemplateSchema}`` from ``path``, read once per process.
+
+    A missing manifest is an empty one; templates are then scanned on load.
+    """
+    with _lock:
+        if path not in _manifests:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    raw = json.load(f)
+            except FileNotFoundError:
+                raw = {"version": MANIFEST_VERSION, "templates": {}}
+            if raw.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"{path}: unsupported manifest version {raw.get('version')}")
+            _manifests[path] = {
+                filename: TemplateSchema(entry["sha256"], entry["pages"], [_decode(row) for row in entry["widgets"]])
+                for filename, entry in raw["templates"].items()
+            }
+        return _manifests[path]
+
+
+def clear_manifest_cache() -> None:
+    with _lock:
+        _manifests.clear()
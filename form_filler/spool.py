@@ -0,0 +1,197 @@
+"""Disk-spooled package assembly with a bounded memory ceiling.
+
+``build_package`` holds every upload and the whole merged document in memory
+until the final save, which for dozens of large scans is several times their
+combined size. Here uploads live as files in a per-session spool directory
+and the package is assembled in a working file: whenever the pages appended
+since the last flush exceed the memory limit they are written out with an
+incremental save and the document is reopened from disk, so MuPDF drops what
+it already wrote and reloads objects lazily. The final save goes straight to
+the output path with the chosen profile.
+"""
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import Callable, Iterable, Optional
+
+import fitz  # PyMuPDF
+
+from .cache import StageCache
+from .diagnostics import stage, tracing
+from .engine import assemble_package
+from .models import Attachment, PackageForms
+from .options import DEFAULT_MEMORY_LIMIT_MB, NupOptions
+from .output import OutputReport, save_pdf_file
+
+
+class SpoolDir:
+    """A private temp directory, removed on :meth:`cleanup` or garbage collection."""
+
+    def __init__(self, prefix: str = "form_filler_"):
+        self.path = tempfile.mkdtemp(prefix=prefix)
+        self._names = itertools.count()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+
+    def new_path(self, suffix: str = "") -> str:
+        """A fresh file name inside the directory; nothing is created."""
+        return os.path.join(self.path, f"{next(self._names):06d}{suffix}")
+
+    def spool(self, filename: str, data: bytes, dpi: Optional[int] = None) -> Attachment:
+        """Write ``data`` to disk and return an attachment that points at it.
+
+        The user's file name is kept on the attachment only; the file on disk
+        gets a generated name with the same extension.
+        """
+        path = self.new_path("." + filename.rsplit(".", 1)[-1].lower() if "." in filename else "")
+        with open(path, "wb") as f:
+            f.write(data)
+        return Attachment(filename, dpi=dpi, path=path)
+
+    def discard(self, attachment: Attachment) -> None:
+        """Delete a spooled attachment's file."""
+        if attachment.path is not None:
+            try:
+                os.remove(attachment.path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self) -> None:
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None where unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss() -> Optional[int]:
+    """Lifetime peak RSS from getrusage; a fallback where /proc is missing."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class PeakRSS:
+    """Track the highest resident memory seen while the ``with`` block runs.
+
+    A daemon thread samples ``/proc/self/statm`` every ``interval`` seconds.
+    Without ``/proc`` the process-lifetime peak from ``getrusage`` is used,
+    which can overstate the block's own peak.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, name="peak-rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+        else:
+            self.peak = _max_rss()
+
+
+def build_package_to_file(
+    forms: PackageForms,
+    attachments: Iterable[Attachment],
+    path: str,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    progress: Optional[Callable[[str], None]] = None,
+    profile: str = "fast",
+    stats: Optional[dict] = None,
+    cache: Optional[StageCache] = None,
+    appearance: str = "bulk",
+    spool: Optional[SpoolDir] = None,
+    nup: Optional[NupOptions] = None,
+    flatten: bool = False,
+) -> OutputReport:
+    """Assemble the package like ``build_package`` but write it to ``path``.
+
+    Pages appended since the last flush are kept below roughly
+    ``memory_limit_mb``. Attachments with a ``path`` are read from disk as
+    they are appended; N-up receipt pages (``nup``) count toward the limit
+    one page at a time. The working file goes in ``spool`` (a temporary
+    directory by default). Besides ``"output"``, ``"rebuilt"`` and
+    ``"trace"``, ``stats`` receives ``"flushes"`` and ``"peak_rss"`` (bytes,
+    or None if unknown).
+    """
+    limit = memory_limit_mb * 1024 * 1024
+    work_dir = spool or SpoolDir()
+    working = work_dir.new_path(".pdf")
+    state = {"pending": 0, "flushes": 0, "on_disk": False}
+
+    def checkpoint(doc, size):
+        state["pending"] += size
+        if state["pending"] < limit:
+            return doc
+        with stage("spool.flush") as span:
+            span.bytes = state["pending"]
+            if state["on_disk"]:
+                doc.save(working, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            else:
+                doc.save(working)
+                state["on_disk"] = True
+            doc.close()
+            state["pending"] = 0
+            state["flushes"] += 1
+            return fitz.open(working)
+
+    rebuilt = []
+    with PeakRSS() as rss, tracing() as trace:
+        output_pdf = fitz.open()
+        try:
+            output_pdf = assemble_package(
+                output_pdf, forms, list(attachments), progress, cache, appearance, rebuilt, checkpoint, nup,
+                flatten,
+            )
+            report = save_pdf_file(output_pdf, path, profile)
+        finally:
+            output_pdf.close()
+            if spool is None:
+                work_dir.cleanup()
+            elif os.path.exists(working):
+                os.remove(working)
+
+    if stats is not None:
+        stats["output"] = report
+        stats["rebuilt"] = rebuilt
+        stats["flushes"] = state["flushes"]
+        stats["peak_rss"] = rss.peak
+        stats["trace"] = trace
+    return report
@@ -0,0 +1,199 @@
+"""Process-wide cache of the blank form templates.
+
+Each template is read once per process and kept as raw bytes plus its field
+schema, which comes from the schema manifest (see :mod:`form_filler.schema`)
+instead of a widget scan. Every fill gets a fresh document opened from the
+cached bytes, so no request touches the disk or re-parses the original file.
+An entry is refreshed when the file's mtime/size changes and its content hash
+differs; a template whose hash does not match the manifest is refused.
+
+Regenerate the manifest after replacing a template, and check that the field
+maps still agree with the templates::
+
+    python -m form_filler.manifest --write
+    python -m form_filler.manifest
+"""
+import hashlib
+import os
+import threading
+
+import fitz  # PyMuPDF
+
+from .fields import (
+    COVER_SHEET_FIELDS, COVER_SHEET_ITEM_FIELDS, COVER_SHEET_MAX_ITEMS,
+    NON_TRAVEL_FIELDS, NON_TRAVEL_ITEM_FIELDS, NON_TRAVEL_MAX_ITEMS,
+    TRAVEL_FIELDS, TRAVEL_INCIDENTAL_FIELDS, TRAVEL_LODGING_FIELDS, TRAVEL_MAX_INCIDENTALS,
+    TRAVEL_MAX_LODGING, TRAVEL_MAX_MEALS, TRAVEL_MAX_TRANSPORTATION, TRAVEL_MEAL_FIELDS,
+    TRAVEL_TRANSPORTATION_FIELDS,
+)
+from .schema import MANIFEST_PATH, TemplateSchema, load_manifest, scan_template, write_manifest
+
+TEMPLATE_DIR = "Original Forms"
+COVER_SHEET_PDF = "Expense_Cover_Sheet.pdf"
+NON_TRAVEL_PDF = "Non_travel expense form.pdf"
+TRAVEL_PDF = "Travel_Expense_Form.pdf"
+
+# The repository root also ships the blank forms
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Field maps each template must satisfy: (map, rows), rows None for single fields
+FORM_FIELD_MAPS = {
+    COVER_SHEET_PDF: ((COVER_SHEET_FIELDS, None), (COVER_SHEET_ITEM_FIELDS, COVER_SHEET_MAX_ITEMS)),
+    NON_TRAVEL_PDF: ((NON_TRAVEL_FIELDS, None), (NON_TRAVEL_ITEM_FIELDS, NON_TRAVEL_MAX_ITEMS)),
+    TRAVEL_PDF: (
+        (TRAVEL_FIELDS, None),
+        (TRAVEL_INCIDENTAL_FIELDS, TRAVEL_MAX_INCIDENTALS),
+        (TRAVEL_TRANSPORTATION_FIELDS, TRAVEL_MAX_TRANSPORTATION),
+        (TRAVEL_LODGING_FIELDS, TRAVEL_MAX_LODGING),
+        (TRAVEL_MEAL_FIELDS, TRAVEL_MAX_MEALS),
+    ),
+}
+# Radio groups and the on-states the engine selects
+RADIO_STATES = {
+    COVER_SHEET_PDF: {COVER_SHEET_FIELDS["pickup_check"]: ("Yes", "No", "NA")},
+}
+
+
+class TemplateMismatch(ValueError):
+    """A template's content does not match its entry in the schema manifest."""
+
+
+class Template:
+    """Cached bytes and field schema for one blank form."""
+
+    __slots__ = ("path", "data", "digest", "stamp", "schema")
+
+    def __init__(self, path, data, digest, stamp, schema: TemplateSchema):
+        self.path = path
+        self.data = data
+        self.digest = digest
+        self.stamp = stamp
+        self.schema = schema
+
+    @property
+    def fields(self) -> dict:
+        """field name -> [FieldSpec, ...]"""
+        return self.schema.fields
+
+    @property
+    def field_pages(self) -> list[int]:
+        return self.schema.field_pages
+
+    def open(self):
+        """Return a fresh, independent document built from the cached bytes."""
+        return fitz.open(stream=self.data, filetype="pdf")
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def template_path(filename, template_dir=TEMPLATE_DIR):
+    """Resolve a template file, falling back to the repository root."""
+    path = os.path.join(template_dir, filename)
+    if not os.path.exists(path):
+        fallback = os.path.join(_REPO_DIR, filename)
+        if os.path.exists(fallback):
+            return fallback
+    return path
+
+
+def _read_schema(path, data, digest):
+    """The manifest's schema for ``path``, or a widget scan if it has no entry."""
+    schema = load_manifest().get(os.path.basename(path))
+    if schema is None:
+        return scan_template(data, digest)
+    if schema.digest != digest:
+        raise TemplateMismatch(f"{path} has changed since the schema manifest was written; "
+                               f"run 'python -m form_filler.manifest --write' and check the field maps")
+    return schema
+
+
+def get_template(filename, template_dir=TEMPLATE_DIR):
+    """Return the cached :class:`Template` for ``filename``, loading it if needed."""
+    path = os.path.abspath(template_path(filename, template_dir))
+    info = os.stat(path)
+    stamp = (info.st_mtime_ns, info.st_size)
+
+    entry = _cache.get(path)
+    if entry is not None and entry.stamp == stamp:
+        return entry
+
+    with _lock:
+        entry = _cache.get(path)
+        if entry is not None and entry.stamp == stamp:
+            return entry
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry.digest == digest:
+            # Touched but unchanged: keep the parsed schema
+            entry.stamp = stamp
+            return entry
+        entry = Template(path, data, digest, stamp, _read_schema(path, data, digest))
+        _cache[path] = entry
+        return entry
+
+
+def open_template(filename, template_dir=TEMPLATE_DIR):
+    """Open a fresh document for ``filename`` from the template cache."""
+    return get_template(filename, template_dir).open()
+
+
+def clear_template_cache():
+    """Drop every cached template."""
+    with _lock:
+        _cache.clear()
+
+
+def check_field_maps(filename: str, schema: TemplateSchema) -> list[str]:
+    """Disagreements between the field maps of ``filename`` and its schema."""
+    problems = []
+    for field_map, rows in FORM_FIELD_MAPS[filename]:
+        for pattern in field_map.values():
+            names = [pattern] if rows is None else [pattern.format(row) for row in range(1, rows + 1)]
+            problems += [f"{filename}: no field {name!r}" for name in names if name not in schema.fields]
+            if rows is not None and pattern.format(rows + 1) in schema.fields:
+                problems.append(f"{filename}: {pattern.format(rows + 1)!r} exists; the form has more than {rows} rows")
+    for name, states in RADIO_STATES.get(filename, {}).items():
+        specs = schema.fields.get(name, ())
+        if any(spec.field_type != fitz.PDF_WIDGET_TYPE_RADIOBUTTON for spec in specs):
+            problems.append(f"{filename}: {name!r} is not a radio group")
+        missing = set(states) - {spec.on_state for spec in specs}
+        if specs and missing:
+            problems.append(f"{filename}: radio group {name!r} has no state {', '.join(sorted(missing))}")
+    return problems
+
+
+def check_templates(template_dir=TEMPLATE_DIR) -> list[str]:
+    """Check every template against the manifest and the field maps.
+
+    Reads and hashes each template but parses none of them; returns a list
+    of problems, empty when everything agrees.
+    """
+    problems = []
+    manifest = load_manifest()
+    for filename in FORM_FIELD_MAPS:
+        if filename not in manifest:
+            problems.append(f"{filename}: not in the schema manifest")
+            continue
+        try:
+            template = get_template(filename, template_dir)
+        except (OSError, TemplateMismatch) as e:
+            problems.append(str(e))
+            continue
+        problems += check_field_maps(filename, template.schema)
+    return problems
+
+
+def write_template_manifest(template_dir=TEMPLATE_DIR, path=MANIFEST_PATH) -> dict:
+    """Scan every template and write the schema manifest; returns the schemas."""
+    schemas = {}
+    for filename in FORM_FIELD_MAPS:
+        with open(template_path(filename, template_dir), "rb") as f:
+            data = f.read()
+        schemas[filename] = scan_template(data, hashlib.sha256(data).hexdigest())
+    write_manifest(schemas, path)
+    clear_template_cache()
+    return schemas
+
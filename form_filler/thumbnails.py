@@ -0,0 +1,87 @@
+"""Low-resolution previews of uploads and generated packages.
+
+Previews are rendered only when asked for (the app asks when a preview
+expander is opened) and kept in a process-wide, size-bounded LRU keyed by the
+SHA-256 of the file, so a rerun, a second session or a re-upload of the same
+file never renders it twice. Images are decoded at reduced size where the
+format allows it; PDF pages are rasterized one at a time at thumbnail scale.
+"""
+import hashlib
+import io
+from typing import Iterable, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps
+
+from .cache import StageCache, content_key
+
+THUMBNAIL_WIDTH = 240  # pixels
+THUMBNAIL_QUALITY = 70
+CACHE_BYTES = 32 * 1024 * 1024
+
+_cache = StageCache(max_bytes=CACHE_BYTES)
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def thumbnail_cache() -> StageCache:
+    """The process-wide thumbnail cache (JPEG bytes per image or PDF page)."""
+    return _cache
+
+
+def _render_image(data, width):
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale, which skips most of the work
+        img.draft("RGB", (width, width))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((width, width * 4))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+        return buffer.getvalue()
+
+
+def image_thumbnail(data: bytes, width: int = THUMBNAIL_WIDTH, digest: Optional[str] = None) -> bytes:
+    """JPEG thumbnail of an image file, ``width`` pixels wide at most."""
+    key = content_key("thumb-image", digest or file_digest(data), width)
+    return _cache.get_or_build(key, lambda: _render_image(data, width))
+
+
+def _render_page(page, width):
+    rect = page.rect
+    zoom = width / max(rect.width, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=THUMBNAIL_QUALITY)
+
+
+def pdf_page_count(data: bytes, digest: Optional[str] = None) -> int:
+    key = content_key("page-count", digest or file_digest(data))
+
+    def count():
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return doc.page_count
+
+    return _cache.get_or_build(key, count, sizeof=lambda _: 64)
+
+
+def pdf_thumbnails(data: bytes, pages: Optional[Iterable[int]] = None, width: int = THUMBNAIL_WIDTH,
+                   digest: Optional[str] = None) -> list[bytes]:
+    """JPEG thumbnails of ``pages`` (0-based, all pages by default) of a PDF.
+
+    The document is opened only if some requested page is not cached yet.
+    """
+    digest = digest or file_digest(data)
+    if pages is None:
+        pages = range(pdf_page_count(data, digest))
+    keys = [(pno, content_key("thumb-page", digest, pno, width)) for pno in pages]
+    thumbs = {pno: _cache.get(key) for pno, key in keys}
+    missing = [(pno, key) for pno, key in keys if thumbs[pno] is None]
+    if missing:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for pno, key in missing:
+                thumbs[pno] = thumb = _render_page(doc[pno], width)
+                _cache.put(key, thumb)
+    return [thumbs[pno] for pno, _ in keys]
@@ -0,0 +1,66 @@
+"""Load the build stack in the background while the first page is read.
+
+Importing PyMuPDF, Pillow and the engine and reading the templates takes
+a few hundred milliseconds, which a UI that only renders forms should not
+spend before its first paint. :func:`start_warmup` does that work once per
+process on a daemon thread; the first build or preview then finds it
+done, or waits only for what is left.
+"""
+import importlib
+import threading
+from concurrent.futures import Future
+
+# Modules a build or a preview needs; importing them loads PyMuPDF and Pillow
+WARM_MODULES = (
+    "form_filler.engine",
+    "form_filler.images",
+    "form_filler.thumbnails",
+    "form_filler.dedupe",
+    "form_filler.preconvert",
+    "form_filler.spool",
+)
+
+_warmup = None
+_lock = threading.Lock()
+
+
+def warm_up() -> list[str]:
+    """Import :data:`WARM_MODULES` and load every template into the cache.
+
+    Returns the template problems found by
+    :func:`form_filler.templates.check_templates`, empty when there are none.
+    """
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    from .templates import check_templates
+
+    return check_templates()
+
+
+def _run(future):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(warm_up())
+    except BaseException as e:
+        future.set_exception(e)
+
+
+def start_warmup(background: bool = True) -> Future:
+    """Start :func:`warm_up` unless it already started in this process.
+
+    It runs on a daemon thread, or in the caller with ``background=False``.
+    Returns a future for its result; every caller gets the same one, so
+    ``start_warmup(background=False).result()`` waits for a warm-up already
+    running instead of starting a second.
+    """
+    global _warmup
+    with _lock:
+        started = _warmup is not None
+        if not started:
+            _warmup = Future()
+            if background:
+                threading.Thread(target=_run, args=(_warmup,), name="form-filler-warmup", daemon=True).start()
+    if not started and not background:
+        _run(_warmup)
+    return _warmup
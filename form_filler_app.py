@@ -1,10 +1,114 @@
 import streamlit as st
-import fitz  # PyMuPDF
-from PIL import Image
-import io
 import os
+from dataclasses import replace
 from datetime import datetime, date
 
+from form_filler import (
+    ACCOUNT_NUMBERS, APPEARANCE_MODES, ATTACHMENT_TYPES, IMAGE_TYPES, OUTPUT_PROFILES, Attachment, ImageOptions,
+    CoverSheet, ExpenseItem, IncidentalItem, LodgingItem, MealItem, NonTravelReport, NupOptions, PackageForms,
+    ReimbursementItem, TransportationItem, TravelReport, department_for, format_page_ranges, parse_page_ranges,
+)
+from form_filler.cache import shared_cache
+from form_filler.diagnostics import METRICS, enable_json_log
+from form_filler.ledger import InvalidAmounts, check_amounts, format_cents, section_ledger
+from form_filler.jobs import PackageRequest, get_job_queue
+from form_filler.options import DEFAULT_MEMORY_LIMIT_MB
+from form_filler.warmup import start_warmup
+
+# PyMuPDF and Pillow are imported where a preview, an upload or a build first
+# needs them (and warmed up in the background), not before the first paint
+
+# Items past a form's own rows are printed on continuation sheets
+MAX_LINE_ITEMS = 500
+# Pages rendered per PDF preview; thumbnails are only made while a preview is open
+PREVIEW_PAGES = 12
+# How long Generate waits for background conversions; the build converts the rest itself
+CONVERSION_WAIT_SECONDS = 1.0
+
+
+def show_amount_errors(ledger, limit=5):
+    """Warn about amounts in one section that are not valid dollar amounts."""
+    for error in ledger.errors[:limit]:
+        st.warning(f"⚠️ Row {error.row}, {error.column}: {error.message}")
+    if len(ledger.errors) > limit:
+        st.warning(f"⚠️ ...and {len(ledger.errors) - limit} more invalid amounts")
+
+
+def share_cover_sheet_fields():
+    """Copy the cover sheet's shared fields to where the other forms read them."""
+    st.session_state.club_name = st.session_state.f1_club_name
+    st.session_state.short_title = st.session_state.f1_short_title
+    st.session_state.account_type = st.session_state.f1_account_type
+    st.session_state.account_number = ACCOUNT_NUMBERS[st.session_state.f1_account_type]
+
+
+def propagate_shared_fields(fragments):
+    """``on_change`` of a shared field: rerun only the forms that show it."""
+    share_cover_sheet_fields()
+    st.rerun(scope=fragments)
+
+
+def show_pdf_preview(data, digest=None, selected=None, show_all=False):
+    """Thumbnails of a PDF's pages, four per row: the first PREVIEW_PAGES unless ``show_all``.
+
+    With ``selected`` (0-based pages), each caption says whether the page goes into the package.
+    """
+    from form_filler.thumbnails import file_digest, pdf_page_count, pdf_thumbnails
+
+    digest = digest or file_digest(data)
+    page_count = pdf_page_count(data, digest)
+    shown = page_count if show_all else min(page_count, PREVIEW_PAGES)
+    if shown < page_count:
+        st.caption(f"First {shown} of {page_count} pages")
+    thumbs = pdf_thumbnails(data, range(shown), digest=digest)
+    for row in range(0, shown, 4):
+        for column, (pno, thumb) in zip(st.columns(4), enumerate(thumbs[row:row + 4], start=row)):
+            caption = f"Page {pno + 1}"
+            if selected is not None:
+                caption += " ✅" if pno in selected else " (left out)"
+            column.image(thumb, caption=caption)
+
+
+def selected_pages(file_id):
+    """The pages chosen for an uploaded PDF (0-based), or None for every page."""
+    return st.session_state.page_selection.get(file_id, ("", None))[1]
+
+
+def choose_pdf_pages(file, data, digest):
+    """Page-range input and thumbnails for one uploaded PDF."""
+    from form_filler.thumbnails import pdf_page_count
+
+    page_count = pdf_page_count(data, digest)
+    st.caption(f"PDF file, {file.size / 1024:,.0f} KB, {page_count} page(s)")
+    text = st.text_input(
+        "Pages to include",
+        value=st.session_state.page_selection.get(file.file_id, ("", None))[0],
+        placeholder="all, or e.g. 1-2, 5",
+        help="Only these pages are copied into the package.",
+        key=f"pages_{file.file_id}",
+    )
+    try:
+        pages = parse_page_ranges(text, page_count)
+    except ValueError as e:
+        st.error(f"❌ {e}. Every page is included until this is fixed.")
+        pages = None
+    st.session_state.page_selection[file.file_id] = (text, pages)
+    if pages is not None:
+        st.caption(f"Including {len(pages)} of {page_count} pages: {format_page_ranges(pages)}")
+    show_all = page_count > PREVIEW_PAGES and st.checkbox(f"Show all {page_count} pages",
+                                                          key=f"all_pages_{file.file_id}")
+    show_pdf_preview(data, digest, selected=None if pages is None else set(pages), show_all=show_all)
+
+
+def upload_store():
+    """The session's UploadStore, created on the first upload."""
+    if 'upload_store' not in st.session_state:
+        from form_filler.preconvert import UploadStore
+
+        st.session_state.upload_store = UploadStore(st.session_state.stage_cache)
+    return st.session_state.upload_store
+
+
 # Page configuration
 st.set_page_config(
     page_title="USC Finance Forms Filler",
@@ -24,6 +128,16 @@ form1_selected = st.sidebar.checkbox("✅ Expense Cover Sheet", value=False)
 form2_selected = st.sidebar.checkbox("✅ Non-Travel Expense Report", value=False)
 form3_selected = st.sidebar.checkbox("✅ Travel Expense Report", value=False)
 
+# Load PyMuPDF, Pillow and the templates while the user reads the page
+# (FORM_FILLER_WARMUP=0 leaves that to the first build or preview). A replaced
+# template or an edited field map would otherwise fill silently wrong.
+if os.environ.get("FORM_FILLER_WARMUP", "1") != "0":
+    warmup = start_warmup()
+    if warmup.done() and warmup.result():
+        st.error("❌ The form templates do not match the schema manifest:\n\n"
+                 + "\n".join(f"- {problem}" for problem in warmup.result()))
+        st.stop()
+
 if not any([form1_selected, form2_selected, form3_selected]):
     st.warning("⚠️ Please select at least one form from the sidebar to get started.")
     st.stop()
@@ -37,6 +151,24 @@ if 'club_name' not in st.session_state:
     st.session_state.club_name = ""
 if 'short_title' not in st.session_state:
     st.session_state.short_title = ""
+# Each form fragment leaves its filled-in model here for "Generate"
+if 'form_data' not in st.session_state:
+    st.session_state.form_data = {}
+# Filled forms and converted attachments from earlier builds, keyed by input hash
+# and shared with every session on this server
+if 'stage_cache' not in st.session_state:
+    st.session_state.stage_cache = shared_cache()
+# Streaming mode: uploads written to disk once per upload id, plus the last package;
+# the spool directory itself is created by the first streaming build
+if 'spooled_uploads' not in st.session_state:
+    st.session_state.spooled_uploads = {}
+    st.session_state.spooled_package = None
+# Upload id -> (page ranges as typed, 0-based pages or None) for uploaded PDFs
+if 'page_selection' not in st.session_state:
+    st.session_state.page_selection = {}
+# Per-stage build timings as JSON lines, e.g. FORM_FILLER_DIAGNOSTICS_LOG=diagnostics.jsonl
+if os.environ.get("FORM_FILLER_DIAGNOSTICS_LOG"):
+    enable_json_log(os.environ["FORM_FILLER_DIAGNOSTICS_LOG"])
 
 # Main content tabs
 tab1, tab2, tab3 = st.tabs(["📝 Fill Forms", "📎 Upload Documents", "📦 Generate Package"])
@@ -45,15 +177,21 @@ tab1, tab2, tab3 = st.tabs(["📝 Fill Forms", "📎 Upload Documents", "📦 Ge
 with tab1:
     st.header("Fill Out Selected Forms")
 
+    # Each form is a fragment, so editing a field reruns only that form.
+    # Shared cover-sheet fields rerun the forms in `form_fragments`.
+    form_fragments = [key for key, selected in (("cover_sheet", form1_selected), ("non_travel", form2_selected),
+                                                 ("travel", form3_selected)) if selected]
+
     # FORM 1: Expense Cover Sheet
-    if form1_selected:
+    @st.fragment(key="cover_sheet")
+    def cover_sheet_form(form_fragments):
         with st.expander("📋 Form 1: Expense Cover Sheet", expanded=True):
             st.subheader("Basic Information")
             col1, col2 = st.columns(2)
 
             with col1:
-                f1_club_name = st.text_input("Club Name", key="f1_club_name")
-                st.session_state.club_name = f1_club_name
+                f1_club_name = st.text_input("Club Name", key="f1_club_name",
+                                             on_change=propagate_shared_fields, args=(form_fragments,))
                 f1_date_submitted = st.date_input("Date Submitted", key="f1_date_submitted")
                 f1_submitter_name = st.text_input("Submitter Name", key="f1_submitter_name")
                 f1_submitter_phone = st.text_input("Submitter Phone", key="f1_submitter_phone")
@@ -61,18 +199,17 @@ with tab1:
 
             with col2:
                 f1_preferred_date = st.date_input("Preferred Date to be Completed", key="f1_preferred_date")
-                f1_short_title = st.text_input("Short Title", key="f1_short_title")
-                st.session_state.short_title = f1_short_title
+                f1_short_title = st.text_input("Short Title", key="f1_short_title",
+                                               on_change=propagate_shared_fields, args=(form_fragments,))
                 f1_total_amount = st.text_input("Total Dollar Amount", key="f1_total_amount")
 
             st.subheader("Expense Account Type")
-            f1_account_type = st.radio("Select Account Type", ["Credit Union", "RCC", "Gift"], key="f1_account_type")
+            f1_account_type = st.radio("Select Account Type", ["Credit Union", "RCC", "Gift"], key="f1_account_type",
+                                       on_change=propagate_shared_fields, args=(form_fragments,))
 
             # Auto-fill account number based on type
-            account_mapping = {"Credit Union": "1233", "RCC": "1222", "Gift": "1244"}
-            f1_account_number = account_mapping[f1_account_type]
-            st.session_state.account_type = f1_account_type
-            st.session_state.account_number = f1_account_number
+            f1_account_number = ACCOUNT_NUMBERS[f1_account_type]
+            share_cover_sheet_fields()
             st.info(f"📝 Account Number (auto-filled): **{f1_account_number}**")
 
             st.subheader("Expense Type")
@@ -130,11 +267,10 @@ with tab1:
                 f1_contact_email = st.text_input("Contact Email", key="f1_contact_email")
 
             st.subheader("Reimbursement Tally")
-            st.markdown("Add purchase items (up to 10)")
+            st.markdown("Add purchase items (items past 10 go on continuation sheets)")
             f1_reimbursement_items = []
-            num_items = st.number_input("Number of items", min_value=0, max_value=10, value=0, key="f1_num_items")
+            num_items = st.number_input("Number of items", min_value=0, max_value=MAX_LINE_ITEMS, value=0, key="f1_num_items")
 
-            total_reimbursement = 0.0
             for i in range(int(num_items)):
                 with st.container():
                     col_a, col_b, col_c = st.columns([2, 1, 1])
@@ -145,30 +281,53 @@ with tab1:
                     with col_c:
                         amt = st.text_input(f"Amount #{i+1}", key=f"f1_amt_{i}", value="0.00")
 
-                    # Calculate total
-                    try:
-                        total_reimbursement += float(amt) if amt else 0.0
-                    except:
-                        pass
-
-                    f1_reimbursement_items.append({"desc": desc, "qty": qty, "amt": amt})
+                    f1_reimbursement_items.append(ReimbursementItem(desc=desc, qty=qty, amt=amt))
 
             # Show total reimbursement
             if num_items > 0:
-                st.success(f"💰 **Total Reimbursement Amount: ${total_reimbursement:.2f}**")
-                f1_total_reimbursement = f"{total_reimbursement:.2f}"
-            else:
-                f1_total_reimbursement = "0.00"
+                f1_ledger = section_ledger("cover_sheet", "items", f1_reimbursement_items)
+                show_amount_errors(f1_ledger)
+                st.success(f"💰 **Total Reimbursement Amount: {format_cents(f1_ledger.total('amt'), currency=True)}**")
+
+            st.session_state.form_data["cover_sheet"] = CoverSheet(
+                club_name=f1_club_name,
+                date_submitted=str(f1_date_submitted),
+                submitter_name=f1_submitter_name,
+                submitter_phone=f1_submitter_phone,
+                submitter_email=f1_submitter_email,
+                preferred_date=str(f1_preferred_date),
+                short_title=f1_short_title,
+                total_amount=f1_total_amount,
+                account_type=f1_account_type,
+                account_number=f1_account_number,
+                expense_type=f1_expense_type,
+                pickup_check=f1_pickup_check,
+                expense_purpose=f1_expense_purpose,
+                payable_to=f1_payable_to,
+                entity_type=f1_entity_type,
+                student_id=f1_student_id,
+                relationship=f1_relationship,
+                other_entity=f1_other_entity,
+                address_1=f1_address_1,
+                address_2=f1_address_2,
+                contact_number=f1_contact_number,
+                contact_email=f1_contact_email,
+                items=f1_reimbursement_items,
+            )
+
+    if form1_selected:
+        cover_sheet_form(form_fragments)
 
     # FORM 2: Non-Travel Expense Report
-    if form2_selected:
+    @st.fragment(key="non_travel")
+    def non_travel_form():
         with st.expander("📋 Form 2: Non-Travel Expense Report", expanded=True):
             st.subheader("Basic Information")
             col1, col2 = st.columns(2)
 
             with col1:
                 # Auto-fill department
-                f2_department = f"Recreational Club Council {st.session_state.club_name}".strip()
+                f2_department = department_for(st.session_state.club_name)
                 st.info(f"📝 Department (auto-filled): **{f2_department}**")
 
                 # Use shared account number
@@ -185,12 +344,9 @@ with tab1:
                 st.info(f"📝 Business Purpose (auto-filled): **{f2_business_purpose}**")
 
             st.subheader("Expense Items")
-            st.markdown("Add expense items (up to 16)")
+            st.markdown("Add expense items (items past 16 go on continuation sheets)")
             f2_expense_items = []
-            num_items_f2 = st.number_input("Number of expense items", min_value=0, max_value=16, value=0, key="f2_num_items")
-
-            f2_total_amt = 0.0
-            f2_total_gu_amt = 0.0
+            num_items_f2 = st.number_input("Number of expense items", min_value=0, max_value=MAX_LINE_ITEMS, value=0, key="f2_num_items")
 
             for i in range(int(num_items_f2)):
                 with st.container():
@@ -206,26 +362,32 @@ with tab1:
                     with col_e:
                         gu_amt = st.text_input(f"G/U Amt #{i+1}", key=f"f2_gu_amt_{i}", value="0.00")
 
-                    # Calculate totals
-                    try:
-                        f2_total_amt += float(amt) if amt else 0.0
-                        f2_total_gu_amt += float(gu_amt) if gu_amt else 0.0
-                    except:
-                        pass
-
-                    f2_expense_items.append({"date": str(date) if date else "", "desc": desc, "qty": qty, "amt": amt, "gu_amt": gu_amt})
+                    f2_expense_items.append(ExpenseItem(date=str(date) if date else "", desc=desc, qty=qty, amt=amt, gu_amt=gu_amt))
 
             if num_items_f2 > 0:
-                st.success(f"💰 **Subtotal: ${f2_total_amt:.2f} | G/U Amount: ${f2_total_gu_amt:.2f}**")
-                f2_total_reimbursement = f"{f2_total_amt:.2f}"
-            else:
-                f2_total_reimbursement = "0.00"
+                f2_ledger = section_ledger("non_travel", "items", f2_expense_items)
+                show_amount_errors(f2_ledger)
+                st.success(f"💰 **Subtotal: {format_cents(f2_ledger.total('amt'), currency=True)} | "
+                           f"G/U Amount: {format_cents(f2_ledger.total('gu_amt'), currency=True)}**")
 
             st.subheader("Signature")
             f2_reimbursee_sig_date = st.date_input("Reimbursee's Signature Date", key="f2_reimbursee_sig_date")
 
+            st.session_state.form_data["non_travel"] = NonTravelReport(
+                department=f2_department,
+                account=f2_account,
+                check_request=f2_check_request,
+                business_purpose=f2_business_purpose,
+                reimbursee_sig_date=str(f2_reimbursee_sig_date),
+                items=f2_expense_items,
+            )
+
+    if form2_selected:
+        non_travel_form()
+
     # FORM 3: Travel Expense Report
-    if form3_selected:
+    @st.fragment(key="travel")
+    def travel_form():
         with st.expander("📋 Form 3: Travel Expense Report", expanded=True):
             st.subheader("Basic Travel Information")
             col1, col2 = st.columns(2)
@@ -234,7 +396,7 @@ with tab1:
                 f3_reimbursee_name = st.text_input("Reimbursee's Name", key="f3_reimbursee_name")
 
                 # Auto-fill department
-                f3_department = f"Recreational Club Council {st.session_state.club_name}".strip()
+                f3_department = department_for(st.session_state.club_name)
                 st.info(f"📝 Department (auto-filled): **{f3_department}**")
 
                 # Use shared account number
@@ -256,10 +418,9 @@ with tab1:
             # INCIDENTALS SECTION
             st.subheader("I. Incidentals")
             f3_incidentals = []
-            num_incidentals = st.number_input("Number of incidental items", min_value=0, max_value=4, value=0, key="f3_num_incidentals")
+            num_incidentals = st.number_input("Number of incidental items", min_value=0, max_value=MAX_LINE_ITEMS, value=0,
+                                              key="f3_num_incidentals", help="Rows past 4 go on continuation sheets")
 
-            inc_total_amt = 0.0
-            inc_total_gu = 0.0
             for i in range(int(num_incidentals)):
                 col_a, col_b, col_c, col_d = st.columns(4)
                 with col_a:
@@ -271,24 +432,21 @@ with tab1:
                 with col_d:
                     gu_amt = st.text_input(f"G/U Amount #{i+1}", key=f"f3_inc_gu_amt_{i}", value="0.00")
 
-                try:
-                    inc_total_amt += float(amt) if amt else 0.0
-                    inc_total_gu += float(gu_amt) if gu_amt else 0.0
-                except:
-                    pass
-
-                f3_incidentals.append({"date": str(inc_date) if inc_date else "", "desc": desc, "amt": amt, "gu_amt": gu_amt})
+                f3_incidentals.append(IncidentalItem(date=str(inc_date) if inc_date else "", desc=desc, amt=amt, gu_amt=gu_amt))
 
+            inc_ledger = section_ledger("travel", "incidentals", f3_incidentals)
+            inc_total_amt = inc_ledger.total("amt")
             if num_incidentals > 0:
-                st.info(f"**Incidentals Subtotal: ${inc_total_amt:.2f} | G/U: ${inc_total_gu:.2f}**")
+                show_amount_errors(inc_ledger)
+                st.info(f"**Incidentals Subtotal: {format_cents(inc_total_amt, currency=True)} | "
+                        f"G/U: {format_cents(inc_ledger.total('gu_amt'), currency=True)}**")
 
             # TRANSPORTATION SECTION
             st.subheader("II. Transportation")
             f3_transportation = []
-            num_transportation = st.number_input("Number of transportation items", min_value=0, max_value=3, value=0, key="f3_num_transportation")
+            num_transportation = st.number_input("Number of transportation items", min_value=0, max_value=MAX_LINE_ITEMS, value=0,
+                                                 key="f3_num_transportation", help="Rows past 3 go on continuation sheets")
 
-            trans_total_amt = 0.0
-            trans_total_gu = 0.0
             for i in range(int(num_transportation)):
                 col_a, col_b, col_c, col_d, col_e = st.columns(5)
                 with col_a:
@@ -302,23 +460,21 @@ with tab1:
                 with col_e:
                     gu_amt = st.text_input(f"G/U Amount #{i+1}", key=f"f3_tr_gu_amt_{i}", value="0.00")
 
-                try:
-                    trans_total_amt += float(amt) if amt else 0.0
-                    trans_total_gu += float(gu_amt) if gu_amt else 0.0
-                except:
-                    pass
-
-                f3_transportation.append({"type": tr_type, "company": company, "date": str(tr_date) if tr_date else "", "amt": amt, "gu_amt": gu_amt})
+                f3_transportation.append(TransportationItem(type=tr_type, company=company, date=str(tr_date) if tr_date else "", amt=amt, gu_amt=gu_amt))
 
+            trans_ledger = section_ledger("travel", "transportation", f3_transportation)
+            trans_total_amt = trans_ledger.total("amt")
             if num_transportation > 0:
-                st.info(f"**Transportation Subtotal: ${trans_total_amt:.2f} | G/U: ${trans_total_gu:.2f}**")
+                show_amount_errors(trans_ledger)
+                st.info(f"**Transportation Subtotal: {format_cents(trans_total_amt, currency=True)} | "
+                        f"G/U: {format_cents(trans_ledger.total('gu_amt'), currency=True)}**")
 
             # LODGING SECTION
             st.subheader("III. Lodging")
             f3_lodging = []
-            num_lodging = st.number_input("Number of lodging items", min_value=0, max_value=3, value=0, key="f3_num_lodging")
+            num_lodging = st.number_input("Number of lodging items", min_value=0, max_value=MAX_LINE_ITEMS, value=0,
+                                          key="f3_num_lodging", help="Rows past 3 go on continuation sheets")
 
-            lodging_total = 0.0
             for i in range(int(num_lodging)):
                 col_a, col_b, col_c, col_d, col_e, col_f = st.columns(6)
                 with col_a:
@@ -334,30 +490,27 @@ with tab1:
                 with col_f:
                     amt = st.text_input(f"Amount #{i+1}", key=f"f3_lodging_amt_{i}", value="0.00")
 
-                try:
-                    lodging_total += float(amt) if amt else 0.0
-                except:
-                    pass
-
-                f3_lodging.append({
-                    "hotel": hotel,
-                    "from_date": str(from_date) if from_date else "",
-                    "to_date": str(to_date) if to_date else "",
-                    "days": days,
-                    "rate": rate,
-                    "amt": amt
-                })
-
+                f3_lodging.append(LodgingItem(
+                    hotel=hotel,
+                    from_date=str(from_date) if from_date else "",
+                    to_date=str(to_date) if to_date else "",
+                    days=days,
+                    rate=rate,
+                    amt=amt
+                ))
+
+            lodging_ledger = section_ledger("travel", "lodging", f3_lodging)
+            lodging_total = lodging_ledger.total("amt")
             if num_lodging > 0:
-                st.info(f"**Lodging Subtotal: ${lodging_total:.2f}**")
+                show_amount_errors(lodging_ledger)
+                st.info(f"**Lodging Subtotal: {format_cents(lodging_total, currency=True)}**")
 
             # MEALS SECTION
             st.subheader("IV. Meals")
             f3_meals = []
-            num_meals = st.number_input("Number of meal days", min_value=0, max_value=4, value=0, key="f3_num_meals")
+            num_meals = st.number_input("Number of meal days", min_value=0, max_value=MAX_LINE_ITEMS, value=0,
+                                        key="f3_num_meals", help="Rows past 4 go on continuation sheets")
 
-            meals_total = 0.0
-            meals_gu_total = 0.0
             for i in range(int(num_meals)):
                 col_a, col_b, col_c, col_d, col_e = st.columns(5)
                 with col_a:
@@ -371,471 +524,416 @@ with tab1:
                 with col_e:
                     meal_gu = st.text_input(f"G/U #{i+1}", key=f"f3_meal_gu_{i}", value="0.00")
 
-                try:
-                    day_total = float(breakfast or 0) + float(lunch or 0) + float(dinner or 0)
-                    meals_total += day_total
-                    meals_gu_total += float(meal_gu) if meal_gu else 0.0
-                except:
-                    pass
-
-                f3_meals.append({
-                    "date": str(meal_date) if meal_date else "",
-                    "breakfast": breakfast,
-                    "lunch": lunch,
-                    "dinner": dinner,
-                    "gu": meal_gu
-                })
+                f3_meals.append(MealItem(
+                    date=str(meal_date) if meal_date else "",
+                    breakfast=breakfast,
+                    lunch=lunch,
+                    dinner=dinner,
+                    gu=meal_gu
+                ))
 
+            meals_ledger = section_ledger("travel", "meals", f3_meals)
+            meals_total = meals_ledger.total("breakfast", "lunch", "dinner")
             if num_meals > 0:
-                st.info(f"**Meals Subtotal: ${meals_total:.2f} | G/U: ${meals_gu_total:.2f}**")
+                show_amount_errors(meals_ledger)
+                st.info(f"**Meals Subtotal: {format_cents(meals_total, currency=True)} | "
+                        f"G/U: {format_cents(meals_ledger.total('gu'), currency=True)}**")
 
             # TOTAL EXPENDITURE
             total_expenditure = inc_total_amt + trans_total_amt + lodging_total + meals_total
-            st.success(f"💰 **TOTAL EXPENDITURES: ${total_expenditure:.2f}**")
+            st.success(f"💰 **TOTAL EXPENDITURES: {format_cents(total_expenditure, currency=True)}**")
 
             st.subheader("Signature")
             f3_reimbursee_sig_date = st.date_input("Reimbursee's Signature Date", key="f3_reimbursee_sig_date")
 
-# ========== TAB 2: UPLOAD DOCUMENTS ==========
-with tab2:
-    st.header("Upload Supporting Documents")
-    st.markdown("Upload receipts, bank statements, photos, or any other supporting documents.")
-
-    uploaded_files = st.file_uploader(
-        "Choose files",
-        type=["pdf", "png", "jpg", "jpeg", "gif", "bmp"],
-        accept_multiple_files=True,
-        key="uploaded_files"
-    )
+            st.session_state.form_data["travel"] = TravelReport(
+                reimbursee_name=f3_reimbursee_name,
+                department=f3_department,
+                account=f3_account,
+                check_request=f3_check_request,
+                destination=f3_destination,
+                period_covered=f3_period_covered,
+                business_purpose=f3_business_purpose,
+                reimbursee_sig_date=str(f3_reimbursee_sig_date),
+                incidentals=f3_incidentals,
+                transportation=f3_transportation,
+                lodging=f3_lodging,
+                meals=f3_meals,
+            )
 
-    if uploaded_files:
-        st.success(f"✅ {len(uploaded_files)} file(s) uploaded successfully!")
+    if form3_selected:
+        travel_form()
 
-        # Show preview of uploaded files
-        st.subheader("Preview of Uploaded Files")
-        for idx, file in enumerate(uploaded_files):
-            with st.expander(f"📄 {file.name}"):
-                file_type = file.name.split('.')[-1].lower()
+# ========== TAB 2: UPLOAD DOCUMENTS ==========
+with tab2:
+    # A fragment: uploading, previewing and tuning images rerun only this tab
+    @st.fragment(key="uploads")
+    def upload_documents():
+        st.header("Upload Supporting Documents")
+        st.markdown("Upload receipts, bank statements, photos, or any other supporting documents.")
+
+        uploaded_files = st.file_uploader(
+            "Choose files",
+            type=list(ATTACHMENT_TYPES),
+            accept_multiple_files=True,
+            key="uploaded_files"
+        )
+
+        with st.expander("🖼️ Image Optimization"):
+            st.markdown("Phone photos are auto-rotated, scaled to fit a letter page and recompressed to keep the package small.")
+            optimize_images = st.checkbox("Optimize receipt images", value=True, key="img_optimize")
+            col_a, col_b, col_c = st.columns(3)
+            with col_a:
+                image_dpi = st.select_slider("Target DPI", options=[100, 150, 200, 300], value=150, key="img_dpi")
+            with col_b:
+                image_quality = st.slider("JPEG quality", min_value=40, max_value=95, value=75, key="img_quality")
+            with col_c:
+                image_grayscale = st.checkbox("Grayscale", value=False, key="img_grayscale")
+                image_workers = st.number_input("Parallel workers", min_value=1, max_value=8,
+                                                value=min(4, os.cpu_count() or 1), key="img_workers")
+
+        image_options = None
+        if optimize_images:
+            image_options = ImageOptions(
+                dpi=image_dpi,
+                quality=image_quality,
+                grayscale=image_grayscale,
+                workers=int(image_workers),
+            )
+
+        with st.expander("🧾 Receipt Layout"):
+            st.markdown("Print receipt photos several to a page instead of one per page. "
+                        "PDFs are still added page by page.")
+            pack_receipts = st.checkbox("Pack receipts onto shared pages", value=False, key="nup_pack")
+            col_a, col_b = st.columns(2)
+            with col_a:
+                nup_margin = st.slider("Page margin (inches)", min_value=0.25, max_value=1.0, value=0.5, step=0.05,
+                                       key="nup_margin")
+            with col_b:
+                nup_captions = st.checkbox("Print file names under receipts", value=True, key="nup_captions")
+        nup_options = NupOptions(margin=nup_margin, captions=nup_captions) if pack_receipts else None
+
+        # Start converting new uploads right away so "Generate" only has to merge
+        conversion_jobs = []
+        if uploaded_files or 'upload_store' in st.session_state:
+            conversion_jobs = upload_store().sync(
+                [(file.file_id, file.name, file.getvalue) for file in uploaded_files or []],
+                image_options,
+            )
+
+        near_duplicates = st.checkbox(
+            "Leave out near-duplicate attachments",
+            value=False,
+            help="Exact copies are always left out. This also drops a file whose pages all look like pages "
+                 "already uploaded (e.g. a photo of a receipt that is also in a statement). "
+                 "Forms with the same layout can look alike, so check the list below.",
+            key="near_duplicates",
+        )
+
+        if uploaded_files:
+            from form_filler.dedupe import dedupe_attachments
+            from form_filler.thumbnails import file_digest, image_thumbnail
+
+            st.success(f"✅ {len(uploaded_files)} file(s) uploaded successfully!")
+
+            try:
+                _, duplicates = dedupe_attachments(
+                    [Attachment(file.name, file.getvalue(), pages=selected_pages(file.file_id))
+                     for file in uploaded_files],
+                    near=near_duplicates,
+                )
+            except Exception as e:
+                duplicates = []
+                st.warning(f"Could not check for duplicates: {e}")
+            if duplicates:
+                st.warning("♻️ Left out of the package as duplicates: " + "; ".join(str(d) for d in duplicates))
+
+            failed_jobs = [job for job in conversion_jobs if job.status == "failed"]
+            if failed_jobs:
+                st.error(f"❌ {len(failed_jobs)} file(s) could not be converted: " + ", ".join(job.filename for job in failed_jobs))
+            if any(job.status in ("queued", "converting") for job in conversion_jobs):
+                st.button("🔄 Refresh conversion status", key="refresh_conversions")
+
+            # Show preview of uploaded files
+            st.subheader("Preview of Uploaded Files")
+            status_icons = {"queued": "⏳", "converting": "🔄", "ready": "✅", "failed": "❌"}
+            for idx, (file, job) in enumerate(zip(uploaded_files, conversion_jobs)):
+                # A stable label keeps the expander open while the status changes;
+                # its contents only run while it is open
+                preview = st.expander(file.name, key=f"preview_{file.file_id}", on_change="rerun")
+                with preview:
+                    if not preview.open:
+                        continue
+                    file_type = file.name.split('.')[-1].lower()
+
+                    if job.status == "failed":
+                        st.error(f"Conversion failed: {job.error}")
+                    elif job.status == "ready":
+                        saved = f", {job.saved_bytes / 1024:,.0f} KB saved" if job.saved_bytes else ""
+                        st.caption(f"{status_icons[job.status]} Converted: {job.pages} page(s){saved}")
+                    else:
+                        st.caption(f"{status_icons[job.status]} Conversion {job.status}...")
 
-                if file_type == 'pdf':
-                    st.info(f"PDF file: {file.name} ({file.size} bytes)")
-                elif file_type in ['png', 'jpg', 'jpeg', 'gif', 'bmp']:
-                    image = Image.open(file)
-                    st.image(image, caption=file.name, use_container_width=True)
-    else:
-        st.info("No files uploaded yet. You can proceed without uploading documents.")
+                    try:
+                        if file_type == 'pdf':
+                            data = file.getvalue()
+                            choose_pdf_pages(file, data, file_digest(data))
+                        elif file_type in IMAGE_TYPES:
+                            st.image(image_thumbnail(file.getvalue()), caption=file.name)
+                    except Exception as e:
+                        st.warning(f"No preview available: {e}")
+        else:
+            st.info("No files uploaded yet. You can proceed without uploading documents.")
+
+        current = {file.file_id for file in uploaded_files or []}
+        st.session_state.page_selection = {
+            file_id: selection for file_id, selection in st.session_state.page_selection.items() if file_id in current
+        }
+        st.session_state.image_options = image_options
+        st.session_state.nup_options = nup_options
+
+    upload_documents()
 
 # ========== TAB 3: GENERATE PACKAGE ==========
 with tab3:
     st.header("Generate PDF Package")
     st.markdown("Click the button below to generate and download your complete PDF package.")
 
+    output_profile = st.selectbox(
+        "Output profile",
+        list(OUTPUT_PROFILES),
+        index=1,
+        format_func=lambda name: OUTPUT_PROFILES[name].label,
+        key="output_profile",
+    )
+    appearance_labels = {
+        "per_field": "Rebuild each field as it is set",
+        "bulk": "Rebuild changed fields once per page",
+        "need_appearances": "Let the PDF viewer draw fields (fastest)",
+    }
+    appearance_mode = st.selectbox(
+        "Form field rendering",
+        APPEARANCE_MODES,
+        index=1,
+        format_func=appearance_labels.get,
+        key="appearance_mode",
+    )
+    flatten_forms = st.checkbox(
+        "Flatten filled forms",
+        value=False,
+        help="Print the filled fields into the pages so the forms can no longer be edited. "
+             "The package is smaller and opens faster; checkboxes and radio buttons look the same.",
+        key="flatten_forms",
+    )
+    streaming = st.checkbox(
+        "Streaming mode (low memory)",
+        value=False,
+        help="Spool uploads to disk and assemble the package in a temporary file, "
+             "flushing pages whenever the memory limit is reached. Use for many or very large attachments.",
+        key="streaming",
+    )
+    memory_limit_mb = DEFAULT_MEMORY_LIMIT_MB
+    if streaming:
+        memory_limit_mb = st.number_input(
+            "Memory limit for pending pages (MB)", min_value=8, max_value=1024,
+            value=DEFAULT_MEMORY_LIMIT_MB, step=8, key="memory_limit_mb",
+        )
+
+    capture_profile = st.checkbox(
+        "Profile the next build (cProfile)",
+        value=False,
+        help="Slows the build down; the report appears under Diagnostics.",
+        key="capture_profile",
+    )
+
+    job_queue = get_job_queue()
+
+    @st.fragment(run_every=1.0)
+    def package_job_status(job_id):
+        """Poll the queued build without rerunning the whole page."""
+        job = job_queue.get(job_id)
+        if job is None or not job.active:
+            st.rerun()
+        position = job_queue.position(job_id)
+        if position is not None:
+            st.info(f"⏳ Waiting in line: position {position} of {job_queue.queued} "
+                    f"({job_queue.workers} package(s) are built at a time).")
+        else:
+            st.info(f"⚙️ {job.message or 'Generating your PDF package...'}")
+        if st.button("✖️ Cancel", key="cancel_package_job"):
+            job_queue.cancel(job_id)
+            st.rerun()
+
     if st.button("🎯 Generate Complete PDF Package", type="primary"):
+        uploaded_files = st.session_state.get("uploaded_files")
+        image_options = st.session_state.image_options
         try:
-            with st.spinner("Generating your PDF package..."):
-                # Create output PDF
-                output_pdf = fitz.open()
-
-                # FILL FORM 1
-                if form1_selected:
-                    st.info("Processing Form 1: Expense Cover Sheet...")
-                    doc1 = fitz.open('Original Forms/Expense_Cover_Sheet.pdf')
-
-                    # Fill page 1
-                    page = doc1[0]
-                    for widget in page.widgets():
-                        field_name = widget.field_name
-
-                        # Fill text fields
-                        if field_name == 'Club Name':
-                            widget.field_value = f1_club_name
-                            widget.update()
-                        elif field_name == 'Date Submitted':
-                            widget.field_value = str(f1_date_submitted)
-                            widget.update()
-                        elif field_name == 'Submitter Name':
-                            widget.field_value = f1_submitter_name
-                            widget.update()
-                        elif field_name == 'Submitter Phone':
-                            widget.field_value = f1_submitter_phone
-                            widget.update()
-                        elif field_name == 'Submitter Email':
-                            widget.field_value = f1_submitter_email
-                            widget.update()
-                        elif field_name == 'Preferred Date to be Completed not guaranteed':
-                            widget.field_value = str(f1_preferred_date)
-                            widget.update()
-                        elif field_name == 'Account Number':
-                            widget.field_value = f1_account_number
-                            widget.update()
-                        elif field_name == 'Short Title':
-                            widget.field_value = f1_short_title
-                            widget.update()
-                        elif field_name == 'Total Dollar Amount':
-                            widget.field_value = f1_total_amount
-                            widget.update()
-                        elif field_name == 'Expense Purpose and Summary who what where when why 1':
-                            widget.field_value = f1_expense_purpose
-                            widget.update()
-                        elif field_name == 'Payable To':
-                            widget.field_value = f1_payable_to
-                            widget.update()
-                        elif field_name == 'Student ID':
-                            widget.field_value = f1_student_id
-                            widget.update()
-                        elif field_name == 'Family Member of Student Relationship':
-                            widget.field_value = f1_relationship
-                            widget.update()
-                        elif field_name == 'Other':
-                            widget.field_value = f1_other_entity
-                            widget.update()
-                        elif field_name == 'Address Street Address AptSte  City State Zip Code 1':
-                            widget.field_value = f1_address_1
-                            widget.update()
-                        elif field_name == 'Address Street Address AptSte  City State Zip Code 2':
-                            widget.field_value = f1_address_2
-                            widget.update()
-                        elif field_name == 'Contact Number':
-                            widget.field_value = f1_contact_number
-                            widget.update()
-                        elif field_name == 'Contact Email':
-                            widget.field_value = f1_contact_email
-                            widget.update()
-
-                        # Fill checkboxes
-                        elif field_name == 'Credit Union':
-                            widget.field_value = (f1_account_type == "Credit Union")
-                            widget.update()
-                        elif field_name == 'RCC':
-                            widget.field_value = (f1_account_type == "RCC")
-                            widget.update()
-                        elif field_name == 'Gift':
-                            widget.field_value = (f1_account_type == "Gift")
-                            widget.update()
-                        elif field_name == 'Reimbursement' and f1_account_type == "Credit Union":
-                            widget.field_value = (f1_expense_type == "Reimbursement")
-                            widget.update()
-                        elif field_name == 'Pay Ahead':
-                            widget.field_value = (f1_expense_type == "Pay Ahead")
-                            widget.update()
-                        elif field_name == 'Reimbursement_2' and f1_account_type in ["RCC", "Gift"]:
-                            widget.field_value = (f1_expense_type == "Reimbursement")
-                            widget.update()
-                        elif field_name == 'Purchase Order':
-                            widget.field_value = (f1_expense_type == "Purchase Order")
-                            widget.update()
-                        elif field_name == 'Requisition':
-                            widget.field_value = (f1_expense_type == "Requisition")
-                            widget.update()
-                        elif field_name == 'Credit Card':
-                            widget.field_value = (f1_expense_type == "Credit Card")
-                            widget.update()
-
-                        # Entity type checkboxes
-                        elif field_name == 'Is the above entity a':
-                            widget.field_value = (f1_entity_type == "Student")
-                            widget.update()
-                        elif field_name == 'Company  Organization':
-                            widget.field_value = (f1_entity_type == "Company / Organization")
-                            widget.update()
-
-                    # Handle pickup check radio buttons
-                    for widget in page.widgets():
-                        if widget.field_name == 'If RCC or Gift Reimbursement pick up check':
-                            if widget.field_type == 5:  # Radio button
-                                # Get button states to identify which radio button this is
-                                button_states = widget.button_states()
-                                normal_states = button_states.get('normal', [])
-
-                                # Set the correct value based on what this radio button represents
-                                if 'Yes' in normal_states and f1_pickup_check == "Yes":
-                                    widget.field_value = 'Yes'
-                                    widget.update()
-                                elif 'No' in normal_states and f1_pickup_check == "No":
-                                    widget.field_value = 'No'
-                                    widget.update()
-                                elif 'NA' in normal_states and f1_pickup_check == "N/A":
-                                    widget.field_value = 'NA'
-                                    widget.update()
-
-                    # Fill page 2 - Reimbursement items
-                    if len(f1_reimbursement_items) > 0:
-                        page2 = doc1[1]
-                        for widget in page2.widgets():
-                            for idx, item in enumerate(f1_reimbursement_items, start=1):
-                                if widget.field_name == f'Description{idx}':
-                                    widget.field_value = item['desc']
-                                    widget.update()
-                                elif widget.field_name == f'Quantity{idx}':
-                                    widget.field_value = item['qty']
-                                    widget.update()
-                                elif widget.field_name == f'Total Item Amount{idx}':
-                                    widget.field_value = item['amt']
-                                    widget.update()
-
-                            # Fill total reimbursement
-                            if widget.field_name == 'Total Item AmountTotal Reimbursement Amount':
-                                widget.field_value = f1_total_reimbursement
-                                widget.update()
-
-                    # Add to output
-                    output_pdf.insert_pdf(doc1)
-                    doc1.close()
-
-                # FILL FORM 2
-                if form2_selected:
-                    st.info("Processing Form 2: Non-Travel Expense Report...")
-                    doc2 = fitz.open('Original Forms/Non_travel expense form.pdf')
-                    page = doc2[0]
-
-                    for widget in page.widgets():
-                        if widget.field_name == 'nter-dept':
-                            widget.field_value = f2_department
-                            widget.update()
-                        elif widget.field_name == 'nter-acct':
-                            widget.field_value = f2_account
-                            widget.update()
-                        elif widget.field_name == 'nter-crq-no':
-                            widget.field_value = f2_check_request
-                            widget.update()
-                        elif widget.field_name == 'nter-purpose':
-                            widget.field_value = f2_business_purpose
-                            widget.update()
-                        elif widget.field_name == 'tot-amt':
-                            widget.field_value = f2_total_reimbursement
-                            widget.update()
-                        elif widget.field_name == 'Text3':  # Reimbursee signature date
-                            widget.field_value = str(f2_reimbursee_sig_date)
-                            widget.update()
-
-                        # Fill expense items
-                        for idx, item in enumerate(f2_expense_items, start=1):
-                            if widget.field_name == f'nter-dt{idx}':
-                                widget.field_value = item['date']
-                                widget.update()
-                            elif widget.field_name == f'nter-desc{idx}':
-                                widget.field_value = item['desc']
-                                widget.update()
-                            elif widget.field_name == f'nter-qty{idx}':
-                                widget.field_value = item['qty']
-                                widget.update()
-                            elif widget.field_name == f'nter-amt{idx}':
-                                widget.field_value = item['amt']
-                                widget.update()
-                            elif widget.field_name == f'nter-unall-amt{idx}':
-                                widget.field_value = item['gu_amt']
-                                widget.update()
-
-                    output_pdf.insert_pdf(doc2)
-                    doc2.close()
-
-                # FILL FORM 3
-                if form3_selected:
-                    st.info("Processing Form 3: Travel Expense Report...")
-                    doc3 = fitz.open('Original Forms/Travel_Expense_Form.pdf')
-                    page = doc3[0]
-
-                    for widget in page.widgets():
-                        if widget.field_name == 'ter-reimburseename':
-                            widget.field_value = f3_reimbursee_name
-                            widget.update()
-                        elif widget.field_name == 'ter-dept':
-                            widget.field_value = f3_department
-                            widget.update()
-                        elif widget.field_name == 'ter-acct':
-                            widget.field_value = f3_account
-                            widget.update()
-                        elif widget.field_name == 'ter-cr':
-                            widget.field_value = f3_check_request
-                            widget.update()
-                        elif widget.field_name == 'ter-dest':
-                            widget.field_value = f3_destination
-                            widget.update()
-                        elif widget.field_name == 'ter-travel-pd':
-                            widget.field_value = f3_period_covered
-                            widget.update()
-                        elif widget.field_name == 'ter-prupose':
-                            widget.field_value = f3_business_purpose
-                            widget.update()
-
-                        # Fill incidentals
-                        for idx, item in enumerate(f3_incidentals, start=1):
-                            if widget.field_name == f'ter-inc-dt{idx}':
-                                widget.field_value = item['date']
-                                widget.update()
-                            elif widget.field_name == f'ter-inc-desc{idx}':
-                                widget.field_value = item['desc']
-                                widget.update()
-                            elif widget.field_name == f'ter-inc-amt{idx}':
-                                widget.field_value = item['amt']
-                                widget.update()
-                            elif widget.field_name == f'ter-inc-gu-amt{idx}':
-                                widget.field_value = item['gu_amt']
-                                widget.update()
-
-                        # Incidentals subtotals
-                        if widget.field_name == 'tot-inc':
-                            widget.field_value = f"{inc_total_amt:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'tot-inc-gu':
-                            widget.field_value = f"{inc_total_gu:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'ter-inc-total':  # BOXED TOTAL
-                            widget.field_value = f"{inc_total_amt:.2f}"
-                            widget.update()
-
-                        # Fill transportation
-                        for idx, item in enumerate(f3_transportation, start=1):
-                            if widget.field_name == f'ter-tr-type{idx}':
-                                widget.field_value = item['type']
-                                widget.update()
-                            elif widget.field_name == f'ter-tr-co{idx}':
-                                widget.field_value = item['company']
-                                widget.update()
-                            elif widget.field_name == f'ter-tr-dt{idx}':
-                                widget.field_value = item['date']
-                                widget.update()
-                            elif widget.field_name == f'ter-tr-amt{idx}':
-                                widget.field_value = item['amt']
-                                widget.update()
-                            elif widget.field_name == f'ter-tr-gu-amt{idx}':
-                                widget.field_value = item['gu_amt']
-                                widget.update()
-
-                        # Transportation subtotals
-                        if widget.field_name == 'tot-tr':
-                            widget.field_value = f"{trans_total_amt:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'tot-tr-gu':
-                            widget.field_value = f"{trans_total_gu:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'ter-tr-total':  # BOXED TOTAL
-                            widget.field_value = f"{trans_total_amt:.2f}"
-                            widget.update()
-
-                        # Fill lodging
-                        for idx, item in enumerate(f3_lodging, start=1):
-                            if widget.field_name == f'ter-flr-hotel{idx}':
-                                widget.field_value = item['hotel']
-                                widget.update()
-                            elif widget.field_name == f'ter-flr-dt{idx}':
-                                widget.field_value = item['from_date']
-                                widget.update()
-                            elif widget.field_name == f'ter-flr-todt{idx}':
-                                widget.field_value = item['to_date']
-                                widget.update()
-                            elif widget.field_name == f'ter-flr-days{idx}':
-                                widget.field_value = item['days']
-                                widget.update()
-                            elif widget.field_name == f'ter-flr-rate{idx}':
-                                widget.field_value = item['rate']
-                                widget.update()
-                            elif widget.field_name == f'ter-flr-amt{idx}':
-                                widget.field_value = item['amt']
-                                widget.update()
-
-                        # Lodging subtotal
-                        if widget.field_name == 'tot-hotel':
-                            widget.field_value = f"{lodging_total:.2f}"
-                            widget.update()
-
-                        # Fill meals
-                        for idx, item in enumerate(f3_meals, start=1):
-                            if widget.field_name == f'ter-meals-dt{idx}':
-                                widget.field_value = item['date']
-                                widget.update()
-                            elif widget.field_name == f'ter-ml-bf{idx}':
-                                widget.field_value = item['breakfast']
-                                widget.update()
-                            elif widget.field_name == f'ter-ml-lun{idx}':
-                                widget.field_value = item['lunch']
-                                widget.update()
-                            elif widget.field_name == f'ter-ml-dinr{idx}':
-                                widget.field_value = item['dinner']
-                                widget.update()
-                            elif widget.field_name == f'ter-ml-gu{idx}':
-                                widget.field_value = item['gu']
-                                widget.update()
-
-                        # Meals subtotals
-                        if widget.field_name == 'tot-meals-temp':
-                            widget.field_value = f"{meals_total:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'tot-meals-gu':
-                            widget.field_value = f"{meals_gu_total:.2f}"
-                            widget.update()
-                        elif widget.field_name == 'ter-meals-total':  # BOXED TOTAL
-                            widget.field_value = f"{meals_total:.2f}"
-                            widget.update()
-
-                        # Total expenditure - CORRECTED FIELD NAME
-                        if widget.field_name == 'tot-travel-reimb':
-                            widget.field_value = f"{total_expenditure:.2f}"
-                            widget.update()
-
-                    # Add signature date on second page if needed
-                    if len(doc3) > 1:
-                        page2 = doc3[1]
-                        # Note: Signature fields might be on page 1 or 2 depending on PDF structure
-
-                    # Try to add signature date
-                    for pg in doc3:
-                        for widget in pg.widgets():
-                            # Look for signature date field - adjust field name as needed
-                            if 'signature' in widget.field_name.lower() or 'date' in widget.field_name.lower():
-                                pass  # Handle if found
-
-                    output_pdf.insert_pdf(doc3)
-                    doc3.close()
-
-                # ADD UPLOADED DOCUMENTS
-                if uploaded_files:
-                    st.info(f"Adding {len(uploaded_files)} supporting documents...")
-                    for file in uploaded_files:
-                        file_type = file.name.split('.')[-1].lower()
+            template_problems = start_warmup(background=False).result()
+            if template_problems:
+                raise ValueError("The form templates do not match the schema manifest: " + "; ".join(template_problems))
+            form_data = st.session_state.form_data
+            forms = PackageForms(
+                cover_sheet=form_data["cover_sheet"] if form1_selected else None,
+                non_travel=form_data["non_travel"] if form2_selected else None,
+                travel=form_data["travel"] if form3_selected else None,
+            )
+            check_amounts(forms)
+
+            if streaming:
+                if 'spool' not in st.session_state:
+                    from form_filler.spool import SpoolDir
+
+                    st.session_state.spool = SpoolDir()
+                spool = st.session_state.spool
+                spooled = st.session_state.spooled_uploads
+                current = {file.file_id for file in uploaded_files or []}
+                for file_id in list(spooled):
+                    if file_id not in current:
+                        spool.discard(spooled.pop(file_id))
+                for file in uploaded_files or []:
+                    if file.file_id not in spooled:
+                        spooled[file.file_id] = spool.spool(file.name, file.getvalue())
+                attachments = [replace(spooled[file.file_id], pages=selected_pages(file.file_id))
+                               for file in uploaded_files or []]
+            else:
+                attachments = [Attachment(file.name, file.getvalue(), pages=selected_pages(file.file_id))
+                               for file in uploaded_files or []]
+            # Uploads converted in the background are already in the stage cache
+            failed_jobs = upload_store().wait(timeout=CONVERSION_WAIT_SECONDS)
+            if failed_jobs:
+                raise ValueError("Could not convert: " + "; ".join(f"{job.filename} ({job.error})" for job in failed_jobs))
+
+            request = PackageRequest(forms, attachments, profile=output_profile, appearance=appearance_mode,
+                                     flatten=flatten_forms,
+                                     image_options=image_options, near_duplicates=st.session_state.near_duplicates,
+                                     nup=st.session_state.get("nup_options"), capture_profile=capture_profile)
+            if streaming:
+                if st.session_state.spooled_package is not None:
+                    spool.discard(st.session_state.spooled_package)
+                st.session_state.spooled_package = Attachment("package.pdf", path=spool.new_path(".pdf"))
+                request.output_path = st.session_state.spooled_package.path
+                request.memory_limit_mb = memory_limit_mb
+
+            # Only one build per session; a new request replaces the previous one
+            if st.session_state.get("package_job"):
+                job_queue.cancel(st.session_state.package_job)
+            st.session_state.package_job = job_queue.submit(request, cache=st.session_state.stage_cache).id
+            st.session_state.package_streaming = streaming
+            st.session_state.package_filename = f"USC_Finance_Package_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+        except InvalidAmounts as e:
+            st.error("❌ Fix these amounts before generating the package:\n"
+                     + "\n".join(f"- {error}" for error in e.errors[:20]))
+        except Exception as e:
+            st.error(f"❌ An error occurred: {str(e)}")
+            st.exception(e)
 
-                        if file_type == 'pdf':
-                            # Add PDF directly
-                            pdf_bytes = file.read()
-                            pdf_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-                            output_pdf.insert_pdf(pdf_doc)
-                            pdf_doc.close()
-                        elif file_type in ['png', 'jpg', 'jpeg', 'gif', 'bmp']:
-                            # Convert image to PDF
-                            img = Image.open(file)
-
-                            # Convert to RGB if necessary
-                            if img.mode in ('RGBA', 'LA', 'P'):
-                                img = img.convert('RGB')
-
-                            # Save image to bytes
-                            img_bytes = io.BytesIO()
-                            img.save(img_bytes, format='PDF')
-                            img_bytes.seek(0)
-
-                            # Add to output PDF
-                            img_pdf = fitz.open(stream=img_bytes.read(), filetype="pdf")
-                            output_pdf.insert_pdf(img_pdf)
-                            img_pdf.close()
-
-                # Save the merged PDF
-                pdf_bytes = output_pdf.tobytes()
-                output_pdf.close()
-
-                # Generate filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"USC_Finance_Package_{timestamp}.pdf"
-
-                st.success("✅ PDF Package generated successfully!")
-
-                # Download button
+    package_job = job_queue.get(st.session_state.get("package_job") or "")
+    package_result = job_queue.result(package_job.id) if package_job is not None else None
+    if package_job is not None and package_job.active:
+        package_job_status(package_job.id)
+    elif package_job is not None and package_job.status == "failed":
+        st.error(f"❌ An error occurred: {package_job.error}")
+    elif package_job is not None and package_job.status == "cancelled":
+        st.warning("Package generation was cancelled.")
+    elif package_job is not None and package_result is None:
+        st.warning("The generated package has expired; please generate it again.")
+    elif package_result is not None:
+        pdf_bytes, stats = package_result
+        streaming_result = st.session_state.package_streaming
+
+        st.success(f"✅ PDF Package generated successfully in {package_job.seconds:.1f}s!")
+
+        output_report = stats["output"]
+        linear_note = ""
+        if OUTPUT_PROFILES[output_report.profile].linear and not output_report.linearized:
+            linear_note = " (linearization is not supported by this PyMuPDF build)"
+        st.markdown(
+            f"**Output profile '{output_report.profile}': {output_report.bytes / 1024:,.0f} KB, "
+            f"saved in {output_report.seconds:.2f}s**{linear_note}"
+        )
+        if stats["rebuilt"]:
+            st.caption(f"Rebuilt: {', '.join(stats['rebuilt'])}. Everything else was reused from the previous build.")
+        else:
+            st.caption("Nothing changed since the previous build; every stage was reused.")
+        if stats["duplicates"]:
+            st.caption("Left out as duplicates: " + "; ".join(str(d) for d in stats["duplicates"]))
+        if streaming_result:
+            peak_rss = stats["peak_rss"]
+            peak_note = f"peak memory {peak_rss / 1024 ** 2:,.0f} MB" if peak_rss else "peak memory unavailable"
+            st.caption(f"Streaming mode: flushed to disk {stats['flushes']} time(s), {peak_note}.")
+
+        image_reports = stats["images"]
+        if image_reports:
+            saved = sum(r.bytes_saved for r in image_reports)
+            st.markdown(f"**Image optimization saved {saved / 1024:,.0f} KB**")
+            st.dataframe([
+                {
+                    "File": r.filename,
+                    "Original (KB)": round(r.original_bytes / 1024),
+                    "Optimized (KB)": round(r.normalized_bytes / 1024),
+                    "Saved (KB)": round(r.bytes_saved / 1024),
+                    "Pixels": f"{r.width}×{r.height}",
+                }
+                for r in image_reports
+            ], hide_index=True)
+
+        # Download button
+        if streaming_result:
+            # Streamlit reads the file into its media store; our copy stays on disk
+            with open(st.session_state.spooled_package.path, "rb") as package_file:
                 st.download_button(
                     label="⬇️ Download Complete PDF Package",
-                    data=pdf_bytes,
-                    file_name=filename,
+                    data=package_file,
+                    file_name=st.session_state.package_filename,
                     mime="application/pdf"
                 )
-
-        except Exception as e:
-            st.error(f"❌ An error occurred: {str(e)}")
-            st.exception(e)
+        else:
+            st.download_button(
+                label="⬇️ Download Complete PDF Package",
+                data=pdf_bytes,
+                file_name=st.session_state.package_filename,
+                mime="application/pdf"
+            )
+
+        package_preview = st.expander("🔍 Preview package", key="preview_package", on_change="rerun")
+        with package_preview:
+            if package_preview.open:
+                if streaming_result:
+                    with open(st.session_state.spooled_package.path, "rb") as package_file:
+                        show_pdf_preview(package_file.read())
+                else:
+                    show_pdf_preview(pdf_bytes)
+
+        with st.expander("🩺 Diagnostics"):
+            trace = stats["trace"]
+            counts = ", ".join(f"{n} {name}" for name, n in trace.counts.items())
+            st.markdown(f"**Build took {trace.seconds:.2f}s** ({counts})")
+            st.dataframe([
+                {
+                    "Stage": row["stage"],
+                    "Calls": row["calls"],
+                    "Time (ms)": round(row["seconds"] * 1000, 1),
+                    "Share": f"{row['seconds'] / trace.seconds:.0%}" if trace.seconds else "",
+                    "Size (KB)": round(row["bytes"] / 1024) if row["bytes"] is not None else None,
+                    "Pages": row["pages"],
+                }
+                for row in trace.summary()
+            ], hide_index=True)
+            if "profile" in stats:
+                st.markdown("**cProfile (top functions by cumulative time)**")
+                st.code(stats["profile"], language=None)
+                st.download_button(
+                    label="Download cProfile data (.prof)",
+                    data=stats["profile_data"],
+                    file_name="package_build.prof",
+                    mime="application/octet-stream",
+                    key="download_profile",
+                )
+            st.download_button(
+                label="Download Prometheus metrics",
+                data=METRICS.render(),
+                file_name="form_filler_metrics.prom",
+                mime="text/plain",
+                key="download_metrics",
+            )